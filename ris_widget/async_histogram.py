@@ -0,0 +1,124 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import concurrent.futures as futures
+import multiprocessing
+import threading
+import traceback
+
+from PyQt5 import Qt
+
+from . import histogram
+from . import image
+
+_EXECUTOR = None
+def _executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        # NB: histogram jobs may themselves fan out across histogram's own thread pool, so they must not run on it
+        _EXECUTOR = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+    return _EXECUTOR
+
+class AsyncHistogram(Qt.QObject):
+    """Computes the histograms of successive images on a background thread, with latest-wins
+    semantics: submitting a new job supersedes any job that has not yet started, and the result of
+    a job that was already running when superseded is discarded rather than delivered. Thus only
+    histograms of the newest image are ever delivered, and a burst of images costs at most two
+    histogram computations.
+
+    Results are delivered by the ready signal, as (min, max, hist, channel_hists) tuples, on the
+    thread that owns the AsyncHistogram (normally the GUI thread). Jobs that fail have their
+    exceptions printed, and deliver nothing.
+    """
+    ready = Qt.pyqtSignal(object)
+    _computed = Qt.pyqtSignal(object, object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tiled_histogram = histogram.TiledHistogram()
+        self._lock = threading.Lock() # guards the job bookkeeping below
+        self._compute_lock = threading.Lock() # serializes use of tiled_histogram
+        self._generation = 0
+        self._pending = None
+        self._running = False
+        self._force_full = False
+        self._computed.connect(self._on_computed)
+
+    def submit(self, image_data, range, image_bits, mask_geometry, changed_region=None, n_workers=1, single_pass=False,
+            n_bins=None, log_bins=False):
+        """Compute the histogram of image_data in the background, superseding any pending job.
+        Arguments are as for histogram.TiledHistogram.update()."""
+        with self._lock:
+            self._generation += 1
+            if self._pending is not None:
+                # the superseded job will never run, so its changed region must be included in this one
+                changed_region = image._union(self._pending[1][4], changed_region)
+            if self._force_full:
+                changed_region = None
+                self._force_full = False
+            self._pending = self._generation, (image_data, range, image_bits, mask_geometry, changed_region, n_workers, single_pass,
+                n_bins, log_bins)
+            if not self._running:
+                self._running = True
+                _executor().submit(self._run)
+
+    def compute(self, image_data, range, image_bits, mask_geometry, changed_region=None, n_workers=1, single_pass=False,
+            n_bins=None, log_bins=False):
+        """Compute and return the histogram of image_data on the calling thread, superseding any
+        pending job."""
+        self.cancel()
+        with self._lock:
+            if self._force_full:
+                changed_region = None
+                self._force_full = False
+        with self._compute_lock:
+            return self.tiled_histogram.update(image_data, range, image_bits, mask_geometry, changed_region, n_workers, single_pass,
+                n_bins, log_bins)
+
+    def cancel(self):
+        """Discard any pending job, and the result of any running job."""
+        with self._lock:
+            self._generation += 1
+            if self._pending is not None:
+                # the tiled histogram never saw the dropped job's changes
+                self._force_full = True
+                self._pending = None
+
+    def invalidate(self):
+        """Discard any pending job, and the result of any running job, and make the next job
+        recompute the whole histogram, e.g. because the histogram of a different image was
+        obtained elsewhere in the meantime."""
+        with self._lock:
+            self._generation += 1
+            self._pending = None
+            self._force_full = True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    self._running = False
+                    return
+                generation, args = self._pending
+                self._pending = None
+            try:
+                with self._compute_lock:
+                    result = self.tiled_histogram.update(*args)
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+            # queued to the thread that owns self
+            self._computed.emit(generation, result, error)
+
+    def _on_computed(self, generation, result, error):
+        if generation != self._generation:
+            return # superseded
+        if error is not None:
+            # NB: an exception escaping a slot may abort the process, so report the failure and keep the
+            # previous histogram instead. The tiled histogram may be part-way through an update, so make the
+            # next job start afresh.
+            traceback.print_exception(type(error), error, error.__traceback__)
+            with self._lock:
+                self._force_full = True
+            return
+        self.ready.emit(result)
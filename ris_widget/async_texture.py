@@ -1,22 +1,46 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import collections
 import threading
-import queue
+import time
 import ctypes
+import weakref
 
 import numpy
 from OpenGL import GL
 from PyQt5 import Qt
 
 from . import shared_resources
+from . import image
 
+# Integer images are stored in normalized integer textures of the same precision, which are sampled as
+# values in [0, 1] (just as integer data uploaded to a float texture is normalized), in a quarter (8-bit)
+# or half (16-bit) the memory that a 32-bit float texture would take.
 IMAGE_TYPE_TO_GL_TEXTURE_FORMATS = {
-    'G': GL.GL_R32F,
-    'Ga': GL.GL_RG32F,
-    'rgb': GL.GL_RGB32F,
-    'rgba': GL.GL_RGBA32F
+    ('G', numpy.bool8): GL.GL_R8,
+    ('G', numpy.uint8): GL.GL_R8,
+    ('G', numpy.uint16): GL.GL_R16,
+    ('G', numpy.float32): GL.GL_R32F,
+    ('Ga', numpy.uint8): GL.GL_RG8,
+    ('Ga', numpy.uint16): GL.GL_RG16,
+    ('Ga', numpy.float32): GL.GL_RG32F,
+    ('rgb', numpy.uint8): GL.GL_RGB8,
+    ('rgb', numpy.uint16): GL.GL_RGB16,
+    ('rgb', numpy.float32): GL.GL_RGB32F,
+    ('rgba', numpy.uint8): GL.GL_RGBA8,
+    ('rgba', numpy.uint16): GL.GL_RGBA16,
+    ('rgba', numpy.float32): GL.GL_RGBA32F
 }
 
+GL_TEXTURE_FORMAT_BYTES = {
+    GL.GL_R8: 1, GL.GL_R16: 2, GL.GL_R32F: 4,
+    GL.GL_RG8: 2, GL.GL_RG16: 4, GL.GL_RG32F: 8,
+    GL.GL_RGB8: 3, GL.GL_RGB16: 6, GL.GL_RGB32F: 12,
+    GL.GL_RGBA8: 4, GL.GL_RGBA16: 8, GL.GL_RGBA32F: 16
+}
+
+_FORMAT_IMAGE_TYPES = {format: image_type for (image_type, dtype), format in IMAGE_TYPE_TO_GL_TEXTURE_FORMATS.items()}
+
 IMAGE_TYPE_TO_SOURCE_FORMATS = {
     'G': GL.GL_RED,
     'Ga': GL.GL_RG,
@@ -32,129 +56,964 @@ NUMPY_DTYPE_TO_GL_PIXEL_TYPE = {
 }
 
 USE_BG_UPLOAD_THREAD = True # debug flag for testing with flaky drivers
+# Number of OffscreenContextThreads (each with its own GL context) among which uploads are spread, so that the
+# textures of several layers that change together are uploaded concurrently. The uploads of any one texture
+# are always issued in order, by one thread at a time.
+UPLOAD_THREADS = 2
+# If True (and USE_BG_UPLOAD_THREAD), stream uploads through a ring of PBO_RING_SIZE pixel unpack buffers, so
+# that copying the pixels of one upload overlaps the driver's transfer of the previous ones to their textures.
+# Requires glMapBufferRange and sync objects (OpenGL 3.2, or ARB_map_buffer_range and ARB_sync): in contexts without
+# sync objects, uploads are made directly.
+USE_PBO_UPLOAD = False
+PBO_RING_SIZE = 3
 
-class AsyncTexture:
+MIPMAP_MAX_LEVEL = 6
+
+_MEMORY_LOCK = threading.Lock()
+_MEMORY_USAGE = [0, 0, 0] # texture count, bytes, bytes if stored as 32-bit floats
+
+def texture_memory_usage():
+    """Return (count, nbytes, float32_nbytes): the number of textures currently allocated for images
+    (including those held free in TEXTURE_POOL), the GPU memory that they occupy (counting mipmaps, whether or not generated), and the memory that they would occupy if stored,
+    as formerly, in 32-bit float formats."""
+    with _MEMORY_LOCK:
+        return tuple(_MEMORY_USAGE)
+
+def texture_nbytes(format, shape):
+    """Return the number of bytes of a texture of the given internal format and (w, h) shape, with mipmaps."""
+    w, h = shape
+    pixels = sum(max(1, w >> level) * max(1, h >> level) for level in range(MIPMAP_MAX_LEVEL + 1))
+    return pixels * GL_TEXTURE_FORMAT_BYTES[format]
+
+_SYNC_OBJECT_SUPPORT = {} # QOpenGLContext: whether sync objects are supported
+def has_sync_objects():
+    """Whether the current GL context supports sync objects (OpenGL 3.2 or ARB_sync; GL_QSURFACE_FORMAT asks only
+    for OpenGL 2.1). Checked once per context."""
+    context = Qt.QOpenGLContext.currentContext()
+    if context not in _SYNC_OBJECT_SUPPORT:
+        supported = bool((context.format().version() >= (3, 2) or context.hasExtension(b'GL_ARB_sync'))
+            and GL.glFenceSync)
+        _SYNC_OBJECT_SUPPORT[context] = supported
+        context.aboutToBeDestroyed.connect(lambda c=context: _SYNC_OBJECT_SUPPORT.pop(c))
+    return _SYNC_OBJECT_SUPPORT[context]
+
+def _make_fence(finish=True):
+    """Return a fence sync marking the completion of the commands issued so far in the current context, flushed
+    so that other contexts can wait on it. Without sync objects, return None, after waiting for the commands to
+    complete with glFinish() if finish is True (or otherwise only flushing them)."""
+    if has_sync_objects():
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glFlush()
+        return fence
+    if finish:
+        GL.glFinish()
+    else:
+        GL.glFlush()
+    return None
+
+# Stands in for the fence of an upload made in a context without sync objects, which is complete once issued
+_UPLOAD_COMPLETE = 'complete'
+
+def _wait_fence(fence):
+    # make the current context's subsequent commands wait (in the GL server) for the fence to signal
+    if fence is not None and fence is not _UPLOAD_COMPLETE:
+        GL.glWaitSync(fence, 0, GL.GL_TIMEOUT_IGNORED)
+
+def _delete_fence(fence):
+    if fence is not None and fence is not _UPLOAD_COMPLETE:
+        GL.glDeleteSync(fence)
+
+def _fence_signaled(fence):
+    return fence is _UPLOAD_COMPLETE or GL.glClientWaitSync(fence, 0, 0) in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED)
+
+# AsyncTextures retired by destroy_after_uploads(), whose destruction awaits the GUI thread's GL context
+_RETIRED = []
+
+def destroy_retired_textures():
+    """Queue the destruction of the AsyncTextures retired since the last call, each after a fence marking the
+    completion of the draws from it already issued by the GUI thread, except those whose front texture is still
+    drawn by the AsyncTexture that it was taken from (see AsyncTexture.take_front()), which are kept until it is
+    not. Called by AsyncTexture.swap(). Must be called with the GUI thread's GL context current."""
+    global _RETIRED
+    if not _RETIRED:
+        return
+    retired, _RETIRED = _RETIRED, []
+    for texture in retired:
+        if texture._borrower is not None:
+            # a retired texture is never drawn or swapped again, so no longer draws the front texture taken from it
+            texture._borrower._lender = None
+            texture._borrower = None
+    for texture in retired:
+        if texture._lender is not None:
+            _RETIRED.append(texture)
+        else:
+            fence = _make_fence(finish=False)
+            (texture._upload_thread or OffscreenContextThread.get()).enqueue(texture._destroy_after, fence)
+
+def _count_texture_memory(sign, format, shape):
+    float_format = IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[_FORMAT_IMAGE_TYPES[format], numpy.float32]
+    with _MEMORY_LOCK:
+        _MEMORY_USAGE[0] += sign
+        _MEMORY_USAGE[1] += sign * texture_nbytes(format, shape)
+        _MEMORY_USAGE[2] += sign * texture_nbytes(float_format, shape)
+
+class TexturePool:
+    """A thread-safe pool of image textures released by AsyncTextures, keyed by internal format and (w, h)
+    shape, from which new uploads of the same format and shape take a texture rather than allocating one, so
+    that switching a layer between images (or among flipbook pages) of the same shape allocates no texture
+    memory. Textures are shared among all contexts, so may be released in one and reused in another: each is
+    released with a fence, which the context reusing it waits on (in the GL server) before writing to it. (In
+    contexts without sync objects, the releasing context instead finishes its commands with glFinish().)
+
+    Attributes:
+        max_bytes: the pool's memory cap. Least-recently-released textures are deleted as necessary to keep
+            the total size of the free textures below this; 0 disables pooling.
+        nbytes: current total size of the free textures (see texture_nbytes()).
+        hits, misses: counts of acquire() calls that did and did not find a free texture.
+        evictions: count of free textures deleted to stay within max_bytes.
+    """
+    def __init__(self, max_bytes=256*2**20):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._free = collections.OrderedDict() # texture: (format, shape, fence)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self, format, shape):
+        """Return a free texture of the given format and shape, or None if there is none. Must be called with
+        a GL context current."""
+        with self._lock:
+            for texture, (t_format, t_shape, fence) in self._free.items():
+                if t_format == format and t_shape == shape:
+                    del self._free[texture]
+                    self.nbytes -= texture_nbytes(format, shape)
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+                return None
+        _wait_fence(fence)
+        _delete_fence(fence)
+        return texture
+
+    def release(self, texture, format, shape):
+        """Return a texture, no longer drawn from or written to, to the pool (or delete it, if it is larger than
+        max_bytes). Must be called with a GL context current."""
+        nbytes = texture_nbytes(format, shape)
+        if nbytes > self.max_bytes:
+            self._delete(texture, format, shape)
+            return
+        # commands already issued in this context that draw from or write to the texture must complete before
+        # it is written to in another
+        fence = _make_fence()
+        evicted = []
+        with self._lock:
+            self._free[texture] = format, shape, fence
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                evicted.append(self._pop_oldest())
+                self.evictions += 1
+        for args in evicted:
+            self._delete(*args)
+
+    def clear(self):
+        """Delete all free textures. Must be called with a GL context current."""
+        with self._lock:
+            evicted = [self._pop_oldest() for _ in range(len(self._free))]
+        for args in evicted:
+            self._delete(*args)
+
+    def _pop_oldest(self):
+        texture, (format, shape, fence) = self._free.popitem(last=False)
+        self.nbytes -= texture_nbytes(format, shape)
+        _delete_fence(fence)
+        return texture, format, shape
+
+    @staticmethod
+    def _delete(texture, format, shape):
+        GL.glDeleteTextures([texture])
+        _count_texture_memory(-1, format, shape)
+
+TEXTURE_POOL = TexturePool()
+
+class _TextureBuffer:
+    __slots__ = ('texture', 'format', 'shape', 'transposed', 'image_key', 'missing', 'mipmaps_valid', 'mipmap_filter')
     def __init__(self):
-        self.ready = threading.Event()
-        self.status = 'waiting'
         self.texture = None
         self.format = None
         self.shape = None
+        self.transposed = False
+        self.image_key = None # (serial, generation) of the Image whose contents the texture holds
+        self.missing = None # region of the texture missing uploads that were made to other textures
+        self.mipmaps_valid = False # whether the mipmaps were generated since the texture was last written
+        self.mipmap_filter = False # whether GL_TEXTURE_MIN_FILTER samples the mipmaps
 
-    def upload(self, image, upload_region=None):
-        new_format = IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[image.type]
-        new_shape = image.data.shape[:2]
+    def use_mipmaps(self, mipmaps):
+        """Set the bound texture to be minified from its mipmaps, generating them if they are out of date, or
+        not: mipmaps are only needed, and so only generated, when the texture is drawn smaller than full size."""
+        if mipmaps and not self.mipmaps_valid:
+            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+            self.mipmaps_valid = True
+        if mipmaps != self.mipmap_filter:
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR if mipmaps else GL.GL_LINEAR)
+            self.mipmap_filter = mipmaps
 
-        if self.texture is not None and new_format != self.format or new_shape != self.shape:
-            self.destroy()
+def _union_regions(a, b):
+    # regions are (x, y, w, h), None for the whole texture, or False for none of it
+    if a is False:
+        return b
+    if b is False:
+        return a
+    return image._union(a, b)
+
+class AsyncTexture:
+    """A texture holding an Image, uploaded on an OffscreenContextThread (if USE_BG_UPLOAD_THREAD).
+
+    Uploads are double-buffered: each is written to a back texture, and completion is marked by a GL fence
+    sync created in the upload thread's context (or, in contexts without sync objects, by finishing the upload
+    with glFinish() in the upload thread). bind() binds the front texture, and swaps in the texture of the most
+    recently completed upload once its fence has signalled, so neither uploading nor painting ever waits on the
+    other. If the next upload starts before that swap, as when images are streamed faster than they can be
+    uploaded, it is written to a third texture, so that completed uploads are still drawn; the third texture is
+    released once uploads no longer queue up. (Only the region changed since a texture was last written, i.e.
+    the regions of the uploads made to the other textures since then plus that of the current upload, is uploaded
+    to it.)
+
+    With double_buffered=False, uploads are written to the single texture that is drawn, which is not bound
+    until its first upload is complete: this halves the memory used by textures that are seldom re-uploaded.
+
+    Textures are taken from and released to TEXTURE_POOL as the format or shape of the uploaded image changes.
+    A full upload of an image whose current contents (see Image.generation) were already uploaded is skipped.
+    """
+    def __init__(self, double_buffered=True):
+        self.double_buffered = double_buffered
+        self.status = 'waiting' # 'uploading' while an upload is pending, and 'uploaded' once the last one is drawable
+        self.exception = None
+        self.format = None # format and shape of the most recent upload
+        self.shape = None
+        self._lock = threading.Lock()
+        self._front = None
+        self._ready = None # the texture of the most recently completed upload, until swapped in as the front
+        self._idle = [] # (texture, release fence) of the textures neither drawn nor awaiting a swap
+        self._pending_uploads = 0 # uploads not yet issued by the upload thread
+        self._upload_fence = None # signals when the issued uploads are complete
+        self._upload_transposed = False
+        self._front_taken = False # whether the front texture was handed over by take_front()
+        self._borrower = None # the AsyncTexture to which take_front() handed the front texture, until the next swap
+        self._lender = None # the AsyncTexture that handed over this one's front texture, while it still draws it
+        self.image_key = None # (serial, generation) of the Image most recently uploaded
+        self._upload_thread = None # the OffscreenContextThread to which uploads and destroy() are queued
+
+    @classmethod
+    def _from_buffer(cls, buffer):
+        texture = cls()
+        texture._front = buffer
+        texture.format = buffer.format
+        texture.shape = buffer.shape
+        texture._upload_transposed = buffer.transposed
+        texture.image_key = buffer.image_key
+        texture.status = 'uploaded'
+        return texture
+
+    @property
+    def transposed(self):
+        """Whether the texture that bind() binds holds the image transposed (see Image.transposed)."""
+        return self._upload_transposed if self._front is None else self._front.transposed
+
+    @property
+    def nbytes(self):
+        """GPU memory occupied by the texture(s) and mipmaps (if generated), once uploaded, not counting the third
+        texture that is used only while uploads queue up."""
+        if self.format is None:
+            return 0
+        return texture_nbytes(self.format, self.shape) * (2 if self.double_buffered else 1)
+
+    @property
+    def uploads_issued(self):
+        """Whether every upload queued has been issued by the upload thread without error, so that (once
+        the GPU completes them) the texture can be drawn."""
+        with self._lock:
+            return (self._pending_uploads == 0 and self.exception is None
+                and (self._front is not None or self._ready is not None))
+
+    def upload(self, image, upload_region=None):
+        """Queue an upload of the image (or only of upload_region, if not None). Must be called on the GUI thread."""
+        image_key = image.serial, image.generation
+        if upload_region is None and image_key == self.image_key and self.exception is None:
+            return
+        self.image_key = image_key
+        new_format = IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[image.type, image.data.dtype.type]
+        data = image.data
+        if image.transposed:
+            # pixels are contiguous along y, so the texture holds the transposed image
+            data = data.swapaxes(0, 1)
+            if upload_region is not None:
+                x, y, w, h = upload_region
+                upload_region = y, x, h, w
+        new_shape = data.shape[:2]
+        if (new_format, new_shape, image.transposed) != (self.format, self.shape, self._upload_transposed):
+            # the back texture (in whatever thread does the upload) and the front (after the next swap) must be
+            # reallocated: no GL context need be current here
+            upload_region = None
         self.format = new_format
         self.shape = new_shape
+        self._upload_transposed = image.transposed
         source_format = IMAGE_TYPE_TO_SOURCE_FORMATS[image.type]
         source_type = NUMPY_DTYPE_TO_GL_PIXEL_TYPE[image.data.dtype.type]
-        upload_args = image.data, source_format, source_type, upload_region
-        if self.texture is None and upload_region is not None:
-            raise ValueError('The first time the texture is uploaded, the full region must be used.')
-        if self.ready.is_set():
-            # if the texture was already uploaded and done is set, make sure to
-            # reset it so that bind waits for this new upload.
-            self.ready.clear()
-        self.status = 'uploading'
+        upload_args = data, new_format, image.transposed, source_format, source_type, upload_region, image_key
+        with self._lock:
+            self._pending_uploads += 1
+            self.status = 'uploading'
         if USE_BG_UPLOAD_THREAD:
-            OffscreenContextThread.get().enqueue(self._upload, *upload_args)
+            self._upload_thread = thread = OffscreenContextThread.for_texture(self)
+            # an upload of the whole texture supersedes any still queued
+            thread.enqueue_upload(self, upload_region is None, self._stream_upload if USE_PBO_UPLOAD else self._upload, *upload_args)
         else:
             self._upload_fg(*upload_args)
+            self.swap()
+
+    def _drop_upload(self):
+        # called by the OffscreenContextThread for a queued upload that it will never issue
+        with self._lock:
+            self._pending_uploads -= 1
+
+    @staticmethod
+    def _coalesce_upload(dropped_args, upload_args):
+        # called by the OffscreenContextThread to merge a queued upload that it will never issue into a later
+        # upload, whose data are no older, by extending the later upload's region to cover the dropped one's
+        region = _union_regions(dropped_args[5], upload_args[5])
+        return upload_args[:5] + (region,) + upload_args[6:]
 
-    def bind(self, tex_unit):
-        if self.status not in ('uploading', 'uploaded'):
+    def swap(self):
+        """If the most recently completed upload is done, make its texture the front texture, even if later uploads
+        are still queued or running. Return whether there is a front texture to bind. Never waits. Must be called
+        with the GUI thread's GL context current."""
+        destroy_retired_textures()
+        with self._lock:
+            ready = self._ready
+            # the upload fence is deleted only with the lock held, when a later upload replaces it
+            if ready is None or (USE_BG_UPLOAD_THREAD and not _fence_signaled(self._upload_fence)):
+                return self._front is not None
+            front = self._front
+            self._front = ready
+            self._ready = None
+            # a front texture handed over by take_front() belongs to another AsyncTexture now
+            if self.double_buffered and front is not None and not self._front_taken:
+                # the next upload to the former front texture must wait until previous frames have been drawn from
+                # it. Without sync objects, the draws are at least flushed before the upload is issued.
+                release_fence = _make_fence(finish=False) if USE_BG_UPLOAD_THREAD else None
+                self._idle.append((front, release_fence))
+            self._front_taken = False
+            if self._borrower is not None:
+                # the taken front texture is no longer drawn here, so the texture that took it may be destroyed
+                self._borrower._lender = None
+                self._borrower = None
+            if self.exception is None and not self._pending_uploads:
+                self.status = 'uploaded'
+        return True
+
+    def bind(self, tex_unit, mipmaps=False):
+        """Bind the front texture to the given texture unit, after swapping in the back texture if its upload
+        is complete. Return False (binding nothing) if no upload is complete yet. Never waits. If mipmaps is
+        True, the texture is minified from its mipmaps, which are regenerated if its contents have changed
+        since they were last used; otherwise, it is minified by linear interpolation."""
+        if self.status == 'waiting':
             raise RuntimeError('Cannot bind texture that has not been first uploaded')
-        self.ready.wait()
-        if hasattr(self, 'exception'):
+        self.swap()
+        if self.exception is not None:
             raise self.exception
-        assert self.texture is not None
+        if self._front is None:
+            return False
         GL.glActiveTexture(GL.GL_TEXTURE0 + tex_unit)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._front.texture)
+        self._front.use_mipmaps(mipmaps)
+        return True
+
+    def take_front(self, image):
+        """If the front texture holds the current contents of image, return a new AsyncTexture drawing it (as
+        for ImageTextureCache), and never write to or delete it again. The front texture is still drawn here
+        until the next swap, so the new AsyncTexture is not destroyed until then (see destroy_after_uploads()),
+        even if retired first. Otherwise, return None. Must be called on the GUI thread."""
+        with self._lock:
+            front = self._front
+            if (not self.double_buffered or front is None or self._front_taken or self.exception is not None
+                    or front.image_key != (image.serial, image.generation)):
+                return None
+            self._front_taken = True
+        borrower = self._from_buffer(front)
+        borrower._lender = self
+        self._borrower = borrower
+        return borrower
+
+    def destroy_after_uploads(self):
+        """Retire the texture, which must no longer be drawn or uploaded to: it is destroyed in an upload thread's
+        context once the uploads already queued to it and the draws from it already issued by the GUI thread are
+        done (see destroy_retired_textures()). Must be called on the GUI thread, but no GL context need be current."""
+        if USE_BG_UPLOAD_THREAD:
+            _RETIRED.append(self)
+        else:
+            self.destroy()
+
+    def _destroy_after(self, fence):
+        # runs on an upload thread: the textures must not be reused before the GUI thread's draws from them are done
+        _wait_fence(fence)
+        _delete_fence(fence)
+        self.destroy()
 
     def destroy(self):
-        if self.texture is not None:
+        with self._lock:
+            fences = [fence for fence in [self._upload_fence] + [fence for buffer, fence in self._idle] if fence is not None]
+            self._upload_fence = None
+            front = None if self._front_taken else self._front
+            if self._borrower is not None:
+                # destroyed directly, rather than retired
+                self._borrower._lender = None
+                self._borrower = None
+            buffers = {front, self._ready}.union(buffer for buffer, fence in self._idle)
+            buffers = [buffer for buffer in buffers if buffer is not None and buffer.texture is not None]
+            self._front = self._ready = None
+            self._front_taken = False
+            self._idle = []
+        if fences or buffers:
             # requires a valid context
             assert Qt.QOpenGLContext.currentContext() is not None
-            GL.glDeleteTextures([self.texture])
-            self.texture = None
-            self.status = 'waiting'
+        for fence in fences:
+            # the textures may have been written (or drawn) in other contexts
+            _wait_fence(fence)
+            _delete_fence(fence)
+        for buffer in buffers:
+            TEXTURE_POOL.release(buffer.texture, buffer.format, buffer.shape)
+        self.format = self.shape = None
+        self.image_key = None
+        self.status = 'waiting'
 
-    def _upload_fg(self, data, source_format, source_type, upload_region):
+    def _upload_fg(self, *upload_args):
         assert Qt.QOpenGLContext.currentContext() is not None
         orig_unpack_alignment = GL.glGetIntegerv(GL.GL_UNPACK_ALIGNMENT)
         GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
         try:
-            self._upload(data, source_format, source_type, upload_region)
+            self._upload(*upload_args)
         finally:
             # QPainter font rendering for OpenGL surfaces can break if we do not restore GL_UNPACK_ALIGNMENT
             # and this function was called within QPainter's native painting operations
             GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, orig_unpack_alignment)
 
-    def _upload(self, data, source_format, source_type, upload_region):
-        try:
-            if self.texture is None:
-                self.texture = GL.glGenTextures(1)
-                alloc_texture = True
+    def _stream_upload(self, *upload_args):
+        # runs on the texture's OffscreenContextThread
+        thread = self._upload_thread
+        if not has_sync_objects():
+            # the ring of pixel buffers is recycled by way of fences
+            self._upload(*upload_args)
+            return
+        if thread.pixel_buffers is None:
+            thread.pixel_buffers = _PixelBufferRing(PBO_RING_SIZE)
+        self._upload(*upload_args, pixel_buffers=thread.pixel_buffers)
+
+    def _upload(self, data, format, transposed, source_format, source_type, upload_region, image_key, pixel_buffers=None):
+        """Upload data (or only upload_region of it, the region changed since the previous upload) to a texture
+        that is neither drawn nor awaiting a swap, along with the region of that texture missing uploads made to
+        the others, directly from host memory, or if pixel_buffers (a _PixelBufferRing) is given, by way of a
+        pixel unpack buffer. Then create a fence marking the upload's completion, after which swap() makes the
+        texture the front texture."""
+        with self._lock:
+            if self._idle:
+                back, release_fence = self._idle.pop()
+            elif not self.double_buffered and (self._ready or self._front) is not None:
+                back, release_fence = self._ready or self._front, None
             else:
-                alloc_texture = False
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
-            w, h = self.shape
-            if alloc_texture:
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, 6)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
-                GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, self.format, w, h, 0,
-                    source_format, source_type, data.ctypes.data_as(ctypes.c_void_p))
-            else: # texture already exists
-                row_stride = w
-                if upload_region is None:
-                    x = y = 0
+                # the front texture is drawn, and the previous upload's texture awaits its swap
+                back, release_fence = _TextureBuffer(), None
+            surplus = []
+            if self._pending_uploads == 1:
+                # no further uploads are queued, so any third texture is no longer needed
+                surplus, self._idle = self._idle, []
+            others = [buffer for buffer, fence in self._idle]
+            others += [buffer for buffer in (self._ready, None if self._front_taken else self._front)
+                if buffer is not None and buffer is not back]
+            for buffer in others:
+                buffer.missing = _union_regions(buffer.missing, upload_region)
+            upload_region = _union_regions(back.missing, upload_region)
+            # marks the uploads issued before this one, which may have been issued from another upload thread's
+            # context (see OffscreenContextThread.for_texture()). It is not deleted until replaced by this
+            # upload's fence.
+            previous_fence = self._upload_fence
+        try:
+            _wait_fence(previous_fence)
+            _wait_fence(release_fence)
+            _delete_fence(release_fence)
+            for buffer, fence in surplus:
+                _wait_fence(fence)
+                _delete_fence(fence)
+                if buffer.texture is not None:
+                    TEXTURE_POOL.release(buffer.texture, buffer.format, buffer.shape)
+            shape = data.shape[:2]
+            if back.texture is not None and (back.format, back.shape) != (format, shape):
+                TEXTURE_POOL.release(back.texture, back.format, back.shape)
+                back.texture = None
+            alloc_texture = False
+            if back.texture is None:
+                back.texture = TEXTURE_POOL.acquire(format, shape)
+                if back.texture is None:
+                    back.texture = GL.glGenTextures(1)
+                    _count_texture_memory(1, format, shape)
+                    alloc_texture = True
                 else:
-                    x, y, w, h = upload_region
-                    data = data[x:x+w, y:y+h]
-                try:
-                    GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, row_stride)
+                    # a pooled texture keeps its parameters, but may have been minified from its mipmaps
+                    GL.glBindTexture(GL.GL_TEXTURE_2D, back.texture)
+                    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+                back.mipmap_filter = False
+                back.format = format
+                back.shape = shape
+                upload_region = None
+            back.transposed = transposed
+            back.image_key = image_key
+            back.mipmaps_valid = False
+            GL.glBindTexture(GL.GL_TEXTURE_2D, back.texture)
+            if upload_region is None:
+                x = y = 0
+                w, h = shape
+            else:
+                x, y, w, h = upload_region
+                data = data[x:x+w, y:y+h]
+            if pixel_buffers is None:
+                # data is contiguous along its first axis, with rows of pixels data.strides[1] bytes apart (see Image)
+                row_length = data.strides[1] // data.strides[0]
+                pixels = data.ctypes.data_as(ctypes.c_void_p)
+            else:
+                # the staged copy is tightly packed, and pixels is an offset into the bound buffer
+                row_length = 0
+                pixels = pixel_buffers.stage(data)
+            try:
+                GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, row_length)
+                if alloc_texture:
+                    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, MIPMAP_MAX_LEVEL)
+                    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+                    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+                    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+                    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+                    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, format, w, h, 0,
+                        source_format, source_type, pixels)
+                else: # texture already exists
                     GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x, y, w, h,
-                        source_format, source_type, data.ctypes.data_as(ctypes.c_void_p))
-                finally:
-                    GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
-            # whether or not allocating texture, need to regenerate mipmaps
-            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
-            # need glFinish to make sure that the GL calls (which run asynchronously)
-            # have completed before we set self.ready
-            GL.glFinish()
-            self.status = 'uploaded'
+                        source_format, source_type, pixels)
+            finally:
+                GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
+                if pixel_buffers is not None:
+                    pixel_buffers.unbind()
+            if pixel_buffers is not None:
+                pixel_buffers.fence()
+            # flushed so that the fence (and the commands before it) reach the GPU and can be waited on from the
+            # GUI thread's context
+            fence = _make_fence()
+            if fence is None:
+                # no sync objects: the upload was finished
+                fence = _UPLOAD_COMPLETE
+            self.exception = None
         except Exception as e:
             self.exception = e
+            fence = None
+        with self._lock:
+            old_fence = self._upload_fence
+            if fence is None:
+                # the texture's contents are unknown, so it is written in full by its next upload
+                back.missing = None
+                if back is not self._front and back is not self._ready:
+                    self._idle.append((back, None))
+            else:
+                back.missing = False
+                self._upload_fence = fence
+                if self._ready is not None and self._ready is not back:
+                    # superseded before it was ever drawn, so it may be written again at once
+                    self._idle.append((self._ready, None))
+                self._ready = back
+                _delete_fence(old_fence)
+            self._pending_uploads -= 1
+
+
+class _PixelBufferRing:
+    """A ring of pixel unpack buffers, used in turn to stage texture uploads. Each buffer is reused only once
+    the transfer from it has completed (as marked by a fence sync), so the pixels of the next upload can be
+    copied into one buffer while the driver transfers the contents of the others. Must be used only in the GL
+    context in which it was created."""
+    def __init__(self, size):
+        self.buffers = [GL.glGenBuffers(1) for _ in range(size)]
+        self.capacities = [0] * size
+        self.fences = [None] * size
+        self.index = 0
+
+    def stage(self, data):
+        """Copy data, an (x, y[, c]) array contiguous along x, into the next buffer, tightly packed, and leave
+        the buffer bound for unpacking. Return the pixels argument for glTex(Sub)Image2D."""
+        self.index = i = (self.index + 1) % len(self.buffers)
+        self._wait(i)
+        nbytes = data.size * data.itemsize
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self.buffers[i])
+        if self.capacities[i] < nbytes:
+            GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, nbytes, None, GL.GL_STREAM_DRAW)
+            self.capacities[i] = nbytes
+        address = GL.glMapBufferRange(GL.GL_PIXEL_UNPACK_BUFFER, 0, nbytes,
+            GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT)
+        if not isinstance(address, int):
+            address = ctypes.cast(address, ctypes.c_void_p).value
+        try:
+            pixel_bytes = data.itemsize if data.ndim == 2 else data.itemsize * data.shape[2]
+            strides = (pixel_bytes, pixel_bytes * data.shape[0]) + data.strides[2:]
+            staged = numpy.ndarray(data.shape, data.dtype, (ctypes.c_byte * nbytes).from_address(address), strides=strides)
+            staged[:] = data
         finally:
-            self.ready.set()
+            GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+        return ctypes.c_void_p(0)
+
+    def unbind(self):
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def fence(self):
+        """Mark the end of the commands that read from the current buffer."""
+        self.fences[self.index] = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+    def _wait(self, i):
+        fence = self.fences[i]
+        if fence is not None:
+            while GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 10**8) == GL.GL_TIMEOUT_EXPIRED:
+                pass
+            GL.glDeleteSync(fence)
+            self.fences[i] = None
+
+    def destroy(self):
+        for i in range(len(self.buffers)):
+            self._wait(i)
+        GL.glDeleteBuffers(len(self.buffers), self.buffers)
+
+
+class TiledTexture:
+    """Textures for an image_pyramid.PyramidImage: an overview texture of the pyramid's coarsest level, plus
+    tiles of the finer levels, which are uploaded (in the background, like AsyncTexture) only when they first
+    come into view. Tiles are cached up to MAX_BYTES of texture memory, after which the least recently drawn
+    are deleted.
+
+    bind() binds the overview texture, so a TiledTexture can be drawn like an AsyncTexture; LayerStackItem
+    draws tiled layers tile by tile with visible_tiles().
+    """
+    MAX_BYTES = 512 * 2**20
+
+    def __init__(self):
+        self.image = None
+        self.overview = AsyncTexture()
+        self._overview_image = None
+        self._tiles = collections.OrderedDict() # (level, tx, ty): (AsyncTexture, nbytes)
+        self._nbytes = 0
+        self._stale = [] # evicted textures, to be deleted
+
+    @property
+    def status(self):
+        return self.overview.status
+
+    @property
+    def transposed(self):
+        return self.overview.transposed
+
+    def upload(self, image, upload_region=None):
+        if image is not self.image:
+            upload_region = None
+        self.image = image
+        for key in list(self._tiles):
+            if upload_region is None or self._intersects(image.tile_rect(*key), upload_region):
+                self._discard(key)
+        self._upload_overview()
+
+    def _upload_overview(self):
+        if self._overview_image is not self.image.overview:
+            self._overview_image = self.image.overview
+            self.overview.upload(self._overview_image)
+
+    @staticmethod
+    def _intersects(a, b):
+        ax, ay, aw, ah = a
+        bx, by, bw, bh = b
+        return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+    def _discard(self, key):
+        texture, nbytes = self._tiles.pop(key)
+        self._nbytes -= nbytes
+        self._stale.append(texture)
+
+    def bind(self, tex_unit, mipmaps=False):
+        self._upload_overview()
+        return self.overview.bind(tex_unit, mipmaps)
+
+    def visible_tiles(self, level, rect):
+        """Return the tiles of the given pyramid level that intersect rect (x, y, w, h, in pixels of the image's
+        .data) as a list of (tile_rect, texture), where tile_rect is as for PyramidImage.tile_rect(), and texture
+        is the tile's AsyncTexture if it has been uploaded, or else None (in which case its upload is queued).
+        Must be called with the GUI thread's GL context current (see AsyncTexture.swap())."""
+        self._destroy_stale()
+        image = self.image
+        scale = image.TILE_SIZE * 2**level
+        x, y, w, h = rect
+        columns, rows = image.tile_grid(level)
+        tiles = []
+        visible_keys = set()
+        for tx in range(max(0, int(x // scale)), min(columns, int((x + w) // scale) + 1)):
+            for ty in range(max(0, int(y // scale)), min(rows, int((y + h) // scale) + 1)):
+                key = level, tx, ty
+                visible_keys.add(key)
+                if key in self._tiles:
+                    self._tiles.move_to_end(key)
+                    texture = self._tiles[key][0]
+                else:
+                    tile = image.tile_image(*key)
+                    # tiles are uploaded only once, so need not be double-buffered
+                    texture = AsyncTexture(double_buffered=False)
+                    texture.upload(tile)
+                    self._tiles[key] = texture, texture.nbytes
+                    self._nbytes += self._tiles[key][1]
+                tiles.append((image.tile_rect(*key), texture if texture.swap() else None))
+        # evict least-recently drawn tiles, but never those being drawn now
+        for key in list(self._tiles):
+            if self._nbytes <= self.MAX_BYTES or key in visible_keys:
+                break
+            self._discard(key)
+        self._destroy_stale()
+        return tiles
+
+    def _destroy_stale(self):
+        for texture in self._stale:
+            texture.destroy_after_uploads()
+        self._stale = []
+
+    def destroy_after_uploads(self):
+        """Retire the overview and tile textures, to be destroyed once the uploads already queued to them and the
+        draws from them already issued are done (see AsyncTexture.destroy_after_uploads()). Must be called on the
+        GUI thread, but no GL context need be current."""
+        for key in list(self._tiles):
+            self._discard(key)
+        self._destroy_stale()
+        self.overview.destroy_after_uploads()
+        self._overview_image = None
+
+    def destroy(self):
+        for key in list(self._tiles):
+            self._discard(key)
+        self._destroy_stale()
+        self.overview.destroy()
+        self._overview_image = None
+
+
+class ImageTextureCache:
+    """A least-recently-used cache of the textures of images that layers have stopped showing (e.g. the
+    pages of a flipbook that were flipped away from), so that returning to an image draws its texture again
+    without uploading it. Entries are keyed by Image.serial and hold the contents of one Image.generation:
+    those of images refreshed since are never returned, and those of images since deleted are dropped.
+    Each entry holds a single texture (and its mipmaps). Must be used only on the GUI thread.
+
+    Attributes:
+        max_bytes: the cache's texture memory cap. Least-recently-used textures are evicted (to
+            TEXTURE_POOL) as necessary to keep the total size of the cached textures below this.
+        max_images: the maximum number of textures cached, or None for no limit beyond max_bytes.
+        nbytes: current total size of the cached textures.
+        hits, misses: counts of take() calls that did and did not find a drawable texture.
+    """
+    def __init__(self, max_bytes=256*2**20, max_images=None):
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+        self._entries = collections.OrderedDict() # serial: (weakref to Image, AsyncTexture, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, image, texture):
+        """Cache texture, an AsyncTexture holding the current contents of image, such as one returned by
+        AsyncTexture.take_front()."""
+        self._discard(image.serial)
+        self._insert(image, texture)
+
+    def take(self, image):
+        """Remove and return the texture holding the current contents of image, if it is cached and drawable
+        (see AsyncTexture.uploads_issued), or else return None."""
+        entry = self._entries.get(image.serial)
+        if entry is not None:
+            texture = entry[1]
+            if texture.image_key != (image.serial, image.generation):
+                self._discard(image.serial)
+            elif texture.uploads_issued:
+                del self._entries[image.serial]
+                self.nbytes -= entry[2]
+                self.hits += 1
+                return texture
+        self.misses += 1
+        return None
+
+    def preload(self, image):
+        """Queue an upload of image to a new cached texture, unless its current contents are cached already."""
+        entry = self._entries.get(image.serial)
+        if entry is not None and entry[1].image_key == (image.serial, image.generation):
+            self._entries.move_to_end(image.serial)
+            return
+        self._discard(image.serial)
+        texture = AsyncTexture()
+        texture.upload(image)
+        self._insert(image, texture)
+
+    def clear(self):
+        for serial in list(self._entries):
+            self._discard(serial)
+
+    def _insert(self, image, texture):
+        nbytes = texture_nbytes(texture.format, texture.shape)
+        if nbytes > self.max_bytes:
+            texture.destroy_after_uploads()
+            return
+        for serial, (image_ref, _, _) in list(self._entries.items()):
+            if image_ref() is None:
+                self._discard(serial)
+        self._entries[image.serial] = weakref.ref(image), texture, nbytes
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes or (self.max_images is not None and len(self._entries) > self.max_images):
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, serial):
+        entry = self._entries.pop(serial, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+            entry[1].destroy_after_uploads()
 
 
 class OffscreenContextThread(Qt.QThread):
-    _ACTIVE_THREAD = None
+    """A thread with an offscreen GL context, sharing objects with all others, that runs queued functions
+    (such as texture uploads) in order. There are up to UPLOAD_THREADS of them: see for_texture().
+
+    Uploads queued with enqueue_upload() are latest-wins: an upload of a whole texture drops all uploads to that
+    texture still waiting in the queue, as they would be overwritten anyway, so that images that arrive faster
+    than they can be uploaded cost no uploads of frames that would never be drawn. Enqueueing never waits: once
+    MAX_QUEUE_DEPTH functions are waiting, an upload of part of a texture instead replaces the uploads to that
+    texture still waiting, and covers their regions as well as its own, so the queue grows beyond MAX_QUEUE_DEPTH
+    by at most one upload per texture.
+
+    Attributes (backpressure statistics):
+        max_depth_seen: the greatest number of functions waiting at once.
+        uploads, dropped_uploads: counts of the uploads run and of those dropped as superseded.
+        coalesced_uploads: count of the dropped uploads whose regions were merged into a later upload because
+            the queue was full.
+        upload_latency: mean time, in seconds, from the queueing of an upload until it has been issued.
+    """
+    _THREADS = []
+    MAX_QUEUE_DEPTH = 64
 
     @classmethod
-    def get(cls):
-        if cls._ACTIVE_THREAD is None:
-            cls._ACTIVE_THREAD = cls()
-        return cls._ACTIVE_THREAD
+    def get(cls, index=0):
+        """Return the index-th thread, starting it if need be. Must be called on the GUI thread."""
+        while len(cls._THREADS) <= index:
+            cls._THREADS.append(cls())
+        return cls._THREADS[index]
+
+    @classmethod
+    def for_texture(cls, texture):
+        """Return the thread to which to queue an upload to texture: the thread that its previous uploads went
+        to, if any of them is still queued or running, so that they are issued in order, or otherwise the least
+        busy of the first UPLOAD_THREADS threads. (An upload issued in one thread's context waits, in the GL
+        server, for the completion of the previous upload to the texture, which may have been issued in another.)
+        Must be called on the GUI thread."""
+        thread = texture._upload_thread
+        if thread is not None and thread.has_work_for(texture):
+            return thread
+        threads = [cls.get(index) for index in range(max(1, UPLOAD_THREADS))]
+        return min(threads, key=lambda thread: thread.queue_depth + (thread._running_texture is not None))
 
     def __init__(self):
         super().__init__()
         self.offscreen_surface = Qt.QOffscreenSurface()
         self.offscreen_surface.setFormat(shared_resources.GL_QSURFACE_FORMAT)
         self.offscreen_surface.create()
-        self.queue = queue.Queue()
+        self._queue = collections.deque() # [func, args, texture (for uploads), time queued]
+        self._queue_changed = threading.Condition()
+        self._queued_uploads = {} # texture: list of its queue entries
+        self._running_texture = None # texture of the upload being run
+        self.max_depth_seen = 0
+        self.coalesced_uploads = 0
+        self.uploads = 0
+        self.dropped_uploads = 0
+        self._upload_seconds = 0.0
         self.running = True
+        self.pixel_buffers = None # created in the thread's GL context, by the first streamed upload
         self.start()
 
+    @property
+    def queue_depth(self):
+        """Number of functions waiting in the queue."""
+        return len(self._queue)
+
+    @property
+    def upload_latency(self):
+        return self._upload_seconds / self.uploads if self.uploads else 0.0
+
+    def has_work_for(self, texture):
+        """Whether an upload to texture is queued or running on this thread."""
+        with self._queue_changed:
+            return texture in self._queued_uploads or self._running_texture is texture
+
     def enqueue(self, func, *args):
-        self.queue.put((func, args))
+        with self._queue_changed:
+            self._put([func, args, None, None])
+
+    def enqueue_upload(self, texture, supersedes, func, *args):
+        """Queue func(*args), an upload to texture (an AsyncTexture). If supersedes is True, the upload
+        overwrites the whole texture, so any uploads to it still waiting are dropped. Otherwise, if the queue
+        is full, they are merged into this one (see AsyncTexture._coalesce_upload())."""
+        with self._queue_changed:
+            entries = self._queued_uploads.pop(texture, [])
+            if entries and not supersedes and len(self._queue) >= self.MAX_QUEUE_DEPTH:
+                for entry in entries:
+                    args = texture._coalesce_upload(entry[1], args)
+                self.coalesced_uploads += len(entries)
+                supersedes = True
+            if entries and supersedes:
+                for entry in entries:
+                    texture._drop_upload()
+                self.dropped_uploads += len(entries)
+                # remove the dropped entries from the queue, so that they do not count toward its depth
+                dropped = set(map(id, entries))
+                self._queue = collections.deque(entry for entry in self._queue if id(entry) not in dropped)
+                entries = []
+            entry = [func, args, texture, time.perf_counter()]
+            entries.append(entry)
+            self._queued_uploads[texture] = entries
+            self._put(entry)
+
+    def _put(self, entry):
+        # called with self._queue_changed held
+        self._queue.append(entry)
+        self.max_depth_seen = max(self.max_depth_seen, len(self._queue))
+        self._queue_changed.notify_all()
+
+    def _get(self):
+        with self._queue_changed:
+            self._queue_changed.wait_for(lambda: self._queue or not self.running)
+            if not self.running:
+                return None
+            entry = self._queue.popleft()
+            texture = entry[2]
+            if texture is not None:
+                self._running_texture = texture
+                # a texture's uploads are queued in order, so this is the first of its entries
+                entries = self._queued_uploads[texture]
+                del entries[0]
+                if not entries:
+                    del self._queued_uploads[texture]
+            self._queue_changed.notify_all()
+            return entry
+
+    def stop(self):
+        with self._queue_changed:
+            self.running = False
+            self._queue_changed.notify_all()
 
     def run(self):
         gl_context = Qt.QOpenGLContext()
@@ -165,11 +1024,22 @@ class OffscreenContextThread(Qt.QThread):
         gl_context.makeCurrent(self.offscreen_surface)
         GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
         try:
-            while self.running:
-                func, args = self.queue.get()
-                if not self.running:
+            while True:
+                entry = self._get()
+                if entry is None:
                     # self.running may go to false while blocked waiting on the queue
                     break
-                func(*args)
+                func, args, texture, queued = entry
+                try:
+                    func(*args)
+                finally:
+                    if texture is not None:
+                        with self._queue_changed:
+                            self._running_texture = None
+                if texture is not None:
+                    self.uploads += 1
+                    self._upload_seconds += time.perf_counter() - queued
         finally:
+            if self.pixel_buffers is not None:
+                self.pixel_buffers.destroy()
             gl_context.doneCurrent()
\ No newline at end of file
@@ -1 +1,2 @@
-from .histogram import histogram
\ No newline at end of file
+from .histogram import histogram, histogram_with_channels, histograms, float_histogram, bin_edges, log_bin_range, percentile_range, MAX_BINS, TiledHistogram
+from .cache import HistogramCache
\ No newline at end of file
@@ -2,49 +2,45 @@
 
 #include <inttypes.h>
 #include <math.h>
+#include <string.h>
 
-void hist_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    uint32_t *histogram, uint8_t *min, uint8_t *max) {
-    uint8_t working_min = *(uint8_t *) image;
-    uint8_t working_max = *(uint8_t *) image;
-    const char *row_start, *pixel;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
-        for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
-            uint8_t val = *(uint8_t *) pixel;
-            histogram[val]++;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
-        }
+// Binning of values into n_bins bins over [hist_min, hist_max], with bin_factor = n_bins / (hist_max - hist_min).
+// Values outside that range are not counted. NB: due to float imprecision (or a zero-width range), the computed
+// bin can be >= n_bins (or NaN) even if val <= hist_max: such values go in the last bin.
+
+static inline void ranged_bin_uint16(uint32_t *histogram, uint32_t n_bins, float bin_factor, uint16_t val,
+    uint16_t hist_min, uint16_t hist_max) {
+    if (val >= hist_min && val <= hist_max) {
+        float bin = bin_factor * (val - hist_min);
+        histogram[bin < n_bins ? (uint32_t) bin : n_bins - 1]++;
+    }
+}
+
+static inline void ranged_bin_float(uint32_t *histogram, uint32_t n_bins, float bin_factor, float val,
+    float hist_min, float hist_max) {
+    if (val >= hist_min && val <= hist_max) {
+        float bin = bin_factor * (val - hist_min);
+        histogram[bin < n_bins ? (uint32_t) bin : n_bins - 1]++;
+    }
+}
+
+// As ranged_bin_float, but with the bins evenly spaced in log(val): hist_min must be positive, log_min is
+// logf(hist_min), and bin_factor is n_bins / (logf(hist_max) - log_min).
+static inline void log_bin_float(uint32_t *histogram, uint32_t n_bins, float bin_factor, float val,
+    float hist_min, float hist_max, float log_min) {
+    if (val >= hist_min && val <= hist_max) {
+        float bin = bin_factor * (logf(val) - log_min);
+        histogram[bin < n_bins ? (uint32_t) bin : n_bins - 1]++;
     }
-    *min = working_min;
-    *max = working_max;
 }
 
-void ranged_hist_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    uint32_t *histogram, uint8_t hist_min, uint8_t hist_max, uint8_t *min, uint8_t *max) {
+void hist_uint8(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    uint32_t *histogram, uint8_t *min, uint8_t *max) {
     uint8_t working_min = *(uint8_t *) image;
     uint8_t working_max = *(uint8_t *) image;
     const char *row_start, *pixel;
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
         for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
-            uint8_t val = *(uint8_t *) pixel;
-            if (val >= hist_min && val <= hist_max) histogram[val - hist_min]++;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
-        }
-    }
-    *min = working_min;
-    *max = working_max;
-}
-
-void masked_hist_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint8_t *min, uint8_t *max) {
-        // ends are exclusive bounds
-    uint8_t working_min, working_max;
-    working_min = working_max = *(uint8_t *) (image + (*starts)*c_stride);
-    const char *row_start, *pixel;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
-        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
             uint8_t val = *(uint8_t *) pixel;
             histogram[val]++;
             if (val < working_min) working_min = val;
@@ -55,25 +51,28 @@ void masked_hist_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t
     *max = working_max;
 }
 
-void masked_ranged_hist_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint8_t hist_min, uint8_t hist_max, uint8_t *min, uint8_t *max) {
-        // ends are exclusive bounds
-    uint8_t working_min, working_max;
-    working_min = working_max = *(uint8_t *) (image + (*starts)*c_stride);
+void masked_hist_uint8(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint8_t *min, uint8_t *max) {
+    // row i uses the spans offsets[i] through offsets[i+1]-1; ends are exclusive bounds
+    uint8_t working_min = UINT8_MAX;
+    uint8_t working_max = 0;
     const char *row_start, *pixel;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
-        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
-            uint8_t val = *(uint8_t *) pixel;
-            if (val >= hist_min && val <= hist_max) histogram[val - hist_min]++;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
+    uint32_t span;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, offsets++) {
+        for (span = offsets[0]; span != offsets[1]; span++) {
+            for (pixel = row_start + starts[span]*c_stride; pixel != row_start + ends[span]*c_stride; pixel += c_stride) {
+                uint8_t val = *(uint8_t *) pixel;
+                histogram[val]++;
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
     *min = working_min;
     *max = working_max;
 }
 
-void hist_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+void hist_uint16(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
     uint32_t *histogram, uint8_t shift, uint16_t *min, uint16_t *max) {
     uint16_t working_min = *(uint16_t *) image;
     uint16_t working_max = *(uint16_t *) image;
@@ -90,20 +89,16 @@ void hist_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_str
     *max = working_max;
 }
 
-void ranged_hist_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    uint32_t *histogram, uint16_t n_bins, uint16_t hist_min, uint16_t hist_max, uint16_t *min, uint16_t *max) {
+void ranged_hist_uint16(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    uint32_t *histogram, uint32_t n_bins, uint16_t hist_min, uint16_t hist_max, uint16_t *min, uint16_t *max) {
     uint16_t working_min = *(uint16_t *) image;
     uint16_t working_max = *(uint16_t *) image;
     const char *row_start, *pixel;
     float bin_factor = (float) n_bins / (hist_max - hist_min);
-    uint32_t *last_bin = histogram + n_bins - 1;
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
         for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
             uint16_t val = *(uint16_t *) pixel;
-            int32_t bin = bin_factor * (val - hist_min);
-            if (bin >= 0 && bin < n_bins) histogram[bin]++;
-            else if (val <= hist_max) (*last_bin)++;
-
+            ranged_bin_uint16(histogram, n_bins, bin_factor, val, hist_min, hist_max);
             if (val < working_min) working_min = val;
             else if (val > working_max) working_max = val;
         }
@@ -112,49 +107,51 @@ void ranged_hist_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_
     *max = working_max;
 }
 
-void masked_hist_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint8_t shift, uint16_t *min, uint16_t *max) {
-    // ends are exclusive bounds
-    uint16_t working_min, working_max;
-    working_min = working_max = *(uint16_t *) (image + (*starts)*c_stride);
+void masked_hist_uint16(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint8_t shift, uint16_t *min, uint16_t *max) {
+    // row i uses the spans offsets[i] through offsets[i+1]-1; ends are exclusive bounds
+    uint16_t working_min = UINT16_MAX;
+    uint16_t working_max = 0;
     const char *row_start, *pixel;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
-        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
-            uint16_t val = *(uint16_t *) pixel;
-            histogram[val >> shift]++;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
+    uint32_t span;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, offsets++) {
+        for (span = offsets[0]; span != offsets[1]; span++) {
+            for (pixel = row_start + starts[span]*c_stride; pixel != row_start + ends[span]*c_stride; pixel += c_stride) {
+                uint16_t val = *(uint16_t *) pixel;
+                histogram[val >> shift]++;
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
     *min = working_min;
     *max = working_max;
 }
 
-void masked_ranged_hist_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, uint16_t hist_min, uint16_t hist_max,
+void masked_ranged_hist_uint16(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t n_bins, uint16_t hist_min, uint16_t hist_max,
     uint16_t *min, uint16_t *max) {
-    // ends are exclusive bounds
-    uint16_t working_min, working_max;
-    working_min = working_max = *(uint16_t *) (image + (*starts)*c_stride);
+    // row i uses the spans offsets[i] through offsets[i+1]-1; ends are exclusive bounds
+    uint16_t working_min = UINT16_MAX;
+    uint16_t working_max = 0;
     const char *row_start, *pixel;
+    uint32_t span;
     float bin_factor = (float) n_bins / (hist_max - hist_min);
-    uint32_t *last_bin = histogram + n_bins - 1;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
-        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
-            uint16_t val = *(uint16_t *) pixel;
-            int32_t bin = bin_factor * (val - hist_min);
-            if (bin >= 0 && bin < n_bins) histogram[bin]++;
-            else if (val <= hist_max) (*last_bin)++;
-
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, offsets++) {
+        for (span = offsets[0]; span != offsets[1]; span++) {
+            for (pixel = row_start + starts[span]*c_stride; pixel != row_start + ends[span]*c_stride; pixel += c_stride) {
+                uint16_t val = *(uint16_t *) pixel;
+                ranged_bin_uint16(histogram, n_bins, bin_factor, val, hist_min, hist_max);
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
     *min = working_min;
     *max = working_max;
 }
 
-void minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+void minmax_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
     float *min, float *max) {
     float working_min = *(float *) image;
     float working_max = *(float *) image;
@@ -170,52 +167,415 @@ void minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_st
     *max = working_max;
 }
 
-void masked_minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, float *min, float *max) {
-    // ends are exclusive bounds
-    float working_min, working_max;
-    working_min = working_max = *(float *) (image + (*starts)*c_stride);
+void masked_minmax_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, float *min, float *max) {
+    // row i uses the spans offsets[i] through offsets[i+1]-1; ends are exclusive bounds
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
     const char *row_start, *pixel;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
-        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
-            float val = *(float *) pixel;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
+    uint32_t span;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, offsets++) {
+        for (span = offsets[0]; span != offsets[1]; span++) {
+            for (pixel = row_start + starts[span]*c_stride; pixel != row_start + ends[span]*c_stride; pixel += c_stride) {
+                float val = *(float *) pixel;
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
     *min = working_min;
     *max = working_max;
 }
 
-void ranged_hist_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    uint32_t *histogram, uint16_t n_bins, float hist_min, float hist_max) {
+void ranged_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    uint32_t *histogram, uint32_t n_bins, float hist_min, float hist_max) {
     const char *row_start, *pixel;
     float bin_factor = (float) n_bins / (hist_max - hist_min);
-    uint32_t *last_bin = histogram + n_bins - 1;
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
         for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
             float val = *(float *) pixel;
-            // NB: due to float imprecision, bin can still == n_bins, even if val < hist_max
-            int32_t bin = bin_factor * (val - hist_min);
-            if (bin >= 0 && bin < n_bins) histogram[bin]++;
-            else if (val <= hist_max) (*last_bin)++;
+            ranged_bin_float(histogram, n_bins, bin_factor, val, hist_min, hist_max);
         }
     }
 }
 
-void masked_ranged_hist_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, float hist_min, float hist_max) {
-    // ends are exclusive bounds
+void masked_ranged_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t n_bins, float hist_min, float hist_max) {
+    // row i uses the spans offsets[i] through offsets[i+1]-1; ends are exclusive bounds
     const char *row_start, *pixel;
+    uint32_t span;
     float bin_factor = (float) n_bins / (hist_max - hist_min);
-    uint32_t *last_bin = histogram + n_bins - 1;
-    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
-        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
-            float val = *(float *) pixel;
-            // NB: due to float imprecision, bin can still == n_bins, even if val < hist_max
-            int32_t bin = bin_factor * (val - hist_min);
-            if (bin >= 0 && bin < n_bins) histogram[bin]++;
-            else if (val <= hist_max) (*last_bin)++;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, offsets++) {
+        for (span = offsets[0]; span != offsets[1]; span++) {
+            for (pixel = row_start + starts[span]*c_stride; pixel != row_start + ends[span]*c_stride; pixel += c_stride) {
+                float val = *(float *) pixel;
+                ranged_bin_float(histogram, n_bins, bin_factor, val, hist_min, hist_max);
+            }
+        }
+    }
+}
+
+// Log-binned float histogram: as ranged_hist_float, but with the bins evenly spaced in log(value). hist_min must be
+// positive. If offsets is NULL, whole rows are used; otherwise spans are given as for the masked kernels above.
+void log_ranged_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t n_bins,
+    float hist_min, float hist_max) {
+    float log_min = logf(hist_min);
+    float bin_factor = (float) n_bins / (logf(hist_max) - log_min);
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                log_bin_float(histogram, n_bins, bin_factor, *(float *) pixel, hist_min, hist_max, log_min);
+            }
+        }
+    }
+}
+
+// Single-pass float histograms. Non-finite values (NaN, -Inf, +Inf) are counted in nonfinite[0], [1], and [2]
+// respectively, and are otherwise ignored (including for the min and max). If offsets is NULL, whole rows are used;
+// otherwise spans are given as for the masked kernels above.
+//
+// bucket_hist_float bins each value by the top bits of its IEEE representation, remapped so that the bucket index
+// increases with the value: each bucket covers a range of values 2^-FLOAT_BUCKET_MANTISSA_BITS of their magnitude
+// wide. The buckets can then be rebinned into a histogram over any range once the min and max are known.
+// fused_ranged_hist_float bins into a given range exactly as ranged_hist_float does, while finding the min and max.
+
+#define FLOAT_BUCKET_MANTISSA_BITS 13
+#define FLOAT_BUCKET_SHIFT (23 - FLOAT_BUCKET_MANTISSA_BITS)
+
+static inline void count_nonfinite(float val, uint32_t *nonfinite) {
+    if (isnan(val)) nonfinite[0]++;
+    else if (val < 0) nonfinite[1]++;
+    else nonfinite[2]++;
+}
+
+void bucket_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *buckets, uint32_t *nonfinite,
+    float *min, float *max) {
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                float val = *(float *) pixel;
+                uint32_t bits;
+                memcpy(&bits, &val, sizeof(bits));
+                if ((bits & 0x7F800000u) == 0x7F800000u) { // all-ones exponent: NaN or Inf
+                    count_nonfinite(val, nonfinite);
+                    continue;
+                }
+                // flip all bits of negative values and just the sign bit of positive ones, so that the order
+                // of the unsigned integers matches that of the floats
+                bits ^= (uint32_t) ((int32_t) bits >> 31) | 0x80000000u;
+                buckets[bits >> FLOAT_BUCKET_SHIFT]++;
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
-}
\ No newline at end of file
+    *min = working_min;
+    *max = working_max;
+}
+
+void fused_ranged_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t *nonfinite,
+    uint32_t n_bins, float hist_min, float hist_max, float *min, float *max) {
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                float val = *(float *) pixel;
+                // NaN and Inf fail the range test (unless the range is infinite), and so fall through to
+                // the slow path. Values in range are binned exactly as ranged_bin_float bins them.
+                if (val >= hist_min && val <= hist_max) {
+                    float bin = bin_factor * (val - hist_min);
+                    histogram[bin < n_bins ? (uint32_t) bin : n_bins - 1]++;
+                } else if (!isfinite(val)) {
+                    count_nonfinite(val, nonfinite);
+                    continue;
+                }
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+// Luminance-plus-channel histograms for interleaved RGB(A) images. The luminance of each pixel is the
+// CIE 1931 linear luminance, converted to the image type (as with numpy's astype), and the red, green,
+// and blue histograms are stored one after another in channel_histograms. The min and max are those of the
+// luminance. If offsets is NULL, whole rows are used; otherwise spans are given as for the masked kernels above.
+
+static inline double luma_double(double r, double g, double b) {
+    return 0.2126*r + 0.7152*g + 0.0722*b;
+}
+
+static inline float luma_float(float r, float g, float b) {
+    return 0.2126f*r + 0.7152f*g + 0.0722f*b;
+}
+
+void rgb_hist_uint8(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride, uint32_t ch_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t *channel_histograms, uint8_t *min, uint8_t *max) {
+    uint8_t working_min = UINT8_MAX;
+    uint8_t working_max = 0;
+    uint32_t *r_hist = channel_histograms, *g_hist = channel_histograms + 256, *b_hist = channel_histograms + 512;
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                uint8_t r = *(uint8_t *) pixel, g = *(uint8_t *) (pixel + ch_stride), b = *(uint8_t *) (pixel + 2*ch_stride);
+                uint8_t val = luma_double(r, g, b);
+                histogram[val]++;
+                r_hist[r]++;
+                g_hist[g]++;
+                b_hist[b]++;
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void rgb_hist_uint16(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride, uint32_t ch_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t *channel_histograms, uint32_t n_bins,
+    uint8_t shift, uint16_t *min, uint16_t *max) {
+    uint16_t working_min = UINT16_MAX;
+    uint16_t working_max = 0;
+    uint32_t *r_hist = channel_histograms, *g_hist = channel_histograms + n_bins, *b_hist = channel_histograms + 2*n_bins;
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                uint16_t r = *(uint16_t *) pixel, g = *(uint16_t *) (pixel + ch_stride), b = *(uint16_t *) (pixel + 2*ch_stride);
+                uint16_t val = luma_double(r, g, b);
+                histogram[val >> shift]++;
+                r_hist[r >> shift]++;
+                g_hist[g >> shift]++;
+                b_hist[b >> shift]++;
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void ranged_rgb_hist_uint16(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride, uint32_t ch_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t *channel_histograms, uint32_t n_bins,
+    uint16_t hist_min, uint16_t hist_max, uint16_t *min, uint16_t *max) {
+    uint16_t working_min = UINT16_MAX;
+    uint16_t working_max = 0;
+    uint32_t *r_hist = channel_histograms, *g_hist = channel_histograms + n_bins, *b_hist = channel_histograms + 2*n_bins;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                uint16_t r = *(uint16_t *) pixel, g = *(uint16_t *) (pixel + ch_stride), b = *(uint16_t *) (pixel + 2*ch_stride);
+                uint16_t val = luma_double(r, g, b);
+                ranged_bin_uint16(histogram, n_bins, bin_factor, val, hist_min, hist_max);
+                ranged_bin_uint16(r_hist, n_bins, bin_factor, r, hist_min, hist_max);
+                ranged_bin_uint16(g_hist, n_bins, bin_factor, g, hist_min, hist_max);
+                ranged_bin_uint16(b_hist, n_bins, bin_factor, b, hist_min, hist_max);
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void rgb_minmax_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride, uint32_t ch_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, float *min, float *max) {
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                float val = luma_float(*(float *) pixel, *(float *) (pixel + ch_stride), *(float *) (pixel + 2*ch_stride));
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void ranged_rgb_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride, uint32_t ch_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t *channel_histograms, uint32_t n_bins,
+    float hist_min, float hist_max) {
+    uint32_t *r_hist = channel_histograms, *g_hist = channel_histograms + n_bins, *b_hist = channel_histograms + 2*n_bins;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                float r = *(float *) pixel, g = *(float *) (pixel + ch_stride), b = *(float *) (pixel + 2*ch_stride);
+                ranged_bin_float(histogram, n_bins, bin_factor, luma_float(r, g, b), hist_min, hist_max);
+                ranged_bin_float(r_hist, n_bins, bin_factor, r, hist_min, hist_max);
+                ranged_bin_float(g_hist, n_bins, bin_factor, g, hist_min, hist_max);
+                ranged_bin_float(b_hist, n_bins, bin_factor, b, hist_min, hist_max);
+            }
+        }
+    }
+}
+
+void log_ranged_rgb_hist_float(const char *image, uint32_t rows, uint32_t cols, size_t r_stride, size_t c_stride, uint32_t ch_stride,
+    const uint32_t *offsets, const uint32_t *starts, const uint32_t *ends, uint32_t *histogram, uint32_t *channel_histograms, uint32_t n_bins,
+    float hist_min, float hist_max) {
+    // as ranged_rgb_hist_float, but with the bins evenly spaced in log(value), as for log_ranged_hist_float
+    uint32_t *r_hist = channel_histograms, *g_hist = channel_histograms + n_bins, *b_hist = channel_histograms + 2*n_bins;
+    float log_min = logf(hist_min);
+    float bin_factor = (float) n_bins / (logf(hist_max) - log_min);
+    const char *row_start, *pixel, *row_end;
+    uint32_t span, span_end;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        span = 0;
+        span_end = 1;
+        if (offsets) {
+            span = offsets[0];
+            span_end = offsets[1];
+            offsets++;
+        }
+        for (; span != span_end; span++) {
+            pixel = row_start;
+            row_end = row_start + cols*c_stride;
+            if (offsets) {
+                pixel += starts[span]*c_stride;
+                row_end = row_start + ends[span]*c_stride;
+            }
+            for (; pixel != row_end; pixel += c_stride) {
+                float r = *(float *) pixel, g = *(float *) (pixel + ch_stride), b = *(float *) (pixel + 2*ch_stride);
+                log_bin_float(histogram, n_bins, bin_factor, luma_float(r, g, b), hist_min, hist_max, log_min);
+                log_bin_float(r_hist, n_bins, bin_factor, r, hist_min, hist_max, log_min);
+                log_bin_float(g_hist, n_bins, bin_factor, g, hist_min, hist_max, log_min);
+                log_bin_float(b_hist, n_bins, bin_factor, b, hist_min, hist_max, log_min);
+            }
+        }
+    }
+}
@@ -0,0 +1,72 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import collections
+import threading
+
+import numpy
+
+def hashable(value):
+    """Return a hashable equivalent of value, which may contain (nested) lists, tuples, and
+    numpy arrays, such as a histogram mask geometry."""
+    if isinstance(value, numpy.ndarray):
+        if value.dtype == bool:
+            return 'array', value.shape, numpy.packbits(value).tobytes()
+        return 'array', value.shape, value.dtype.str, value.tobytes()
+    if isinstance(value, (list, tuple)):
+        return tuple(hashable(v) for v in value)
+    return value
+
+class HistogramCache:
+    """A thread-safe, least-recently-used cache of histogram results, such as the
+    (min, max, hist, channel_hists) tuples from histogram_with_channels(), bounded by the total
+    size of the numpy arrays they contain.
+
+    Attributes:
+        max_bytes: the cache's memory cap. Least-recently-used results are evicted as necessary
+            to keep the total size of the cached arrays below this.
+        nbytes: current total size of the cached arrays.
+        hits, misses: counts of get() calls that did and did not find a result.
+    """
+    def __init__(self, max_bytes=32*2**20):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._results = collections.OrderedDict()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """Return the result cached for key, or None."""
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        nbytes = sum(v.nbytes for v in result if isinstance(v, numpy.ndarray))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._results.pop(key, None)
+            if old is not None:
+                self.nbytes -= self._nbytes(old)
+            self._results[key] = result
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                key, old = self._results.popitem(last=False)
+                self.nbytes -= self._nbytes(old)
+
+    @staticmethod
+    def _nbytes(result):
+        return sum(v.nbytes for v in result if isinstance(v, numpy.ndarray))
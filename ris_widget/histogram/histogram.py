@@ -1,173 +1,683 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
-import functools
+import concurrent.futures as futures
+import multiprocessing
 import numpy
 
 from . import _histogram
-
-_mn = _histogram.ffi.new('uint8_t *')
-_mx = _histogram.ffi.new('uint8_t *')
-_mn16 = _histogram.ffi.new('uint16_t *')
-_mx16 = _histogram.ffi.new('uint16_t *')
-_mnf = _histogram.ffi.new('float *')
-_mxf = _histogram.ffi.new('float *')
+from . import mask_spans
 
 _int_hists = {
-    # dtype, ranged, masked: (hist_func, min_var, max_var)
-    (numpy.uint16, False, False): (_histogram.lib.hist_uint16, _mn16, _mx16),
-    (numpy.uint8, False, False): (_histogram.lib.hist_uint8, _mn, _mx),
-    (numpy.uint16, False, True): (_histogram.lib.masked_hist_uint16, _mn16, _mx16),
-    (numpy.uint8, False, True): (_histogram.lib.masked_hist_uint8, _mn, _mx),
-    (numpy.uint16, True, True): (_histogram.lib.masked_ranged_hist_uint16, _mn16, _mx16),
-    (numpy.uint8, True, True): (_histogram.lib.masked_ranged_hist_uint8, _mn, _mx),
-    (numpy.uint16, True, False): (_histogram.lib.ranged_hist_uint16, _mn16, _mx16),
-    (numpy.uint8, True, False): (_histogram.lib.ranged_hist_uint8, _mn, _mx),
+    # dtype, ranged, masked: (hist_func, min/max c type)
+    # NB: uint8 images are always histogrammed one bin per value, and then rebinned if necessary (see _rebin_uint8)
+    (numpy.uint16, False, False): (_histogram.lib.hist_uint16, 'uint16_t *'),
+    (numpy.uint8, False, False): (_histogram.lib.hist_uint8, 'uint8_t *'),
+    (numpy.uint16, False, True): (_histogram.lib.masked_hist_uint16, 'uint16_t *'),
+    (numpy.uint8, False, True): (_histogram.lib.masked_hist_uint8, 'uint8_t *'),
+    (numpy.uint16, True, True): (_histogram.lib.masked_ranged_hist_uint16, 'uint16_t *'),
+    (numpy.uint16, True, False): (_histogram.lib.ranged_hist_uint16, 'uint16_t *'),
 }
 
-def _scanline_bounds(cx, cy, r):
-    # based on 8-connected super-circle algorithm from comments in http://www.willperone.net/Code/codecircle.php
-    # and:
-    # A Chronological and Mathematical Overview of Digital Circle Generation Algorithms - Introducing Efficient 4 and 8-Connected Circles
-    # DOI: 10.1080/00207160.2015.1056170
-    # stores start and end position (on x axis) along each scanline of the circle
-    bounds = numpy.empty((2*r + 1, 2), dtype=numpy.int16)
-    x = 0
-    y = r
-    d = -r/2
-    while x <= y:
-        bounds[r+y] = bounds[r-y] = cx-x, cx+x+1
-        bounds[r+x] = bounds[r-x] = cx-y, cx+y+1
-        if d <= 0:
-            x += 1
-            d += x
-        else:
-            x += 1
-            y -= 1
-            d += x-y
-    return bounds
-
-@functools.lru_cache(maxsize=16)
-def _circle_mask(cx, cy, r, image_shape):
-    sx, sy = image_shape
-    bounds = _scanline_bounds(cx, cy, r)
-    ymin = cy - r
-    ymax = cy + r + 1
-    to_trim_bottom = max(0, -ymin)
-    to_trim_top = max(0, ymax - sy)
-    ymin += to_trim_bottom
-    ymax -= to_trim_top
-    bounds = bounds[to_trim_bottom:len(bounds)-to_trim_top]
-    bounds = bounds.clip(0, sx).astype(numpy.uint16)
-    starts = bounds[:,0].copy()
-    ends = bounds[:,1].copy()
-    if ymin == 0 and ymax == sy and numpy.all(starts == 0) and numpy.all(ends == sx):
-        # mask is just whole image...
-        return None, None, None, None
-    return ymin, ymax, starts, ends
+# Largest supported number of histogram bins: enough for one bin per value of a uint16 image
+MAX_BINS = 65536
+# Log-binned histograms span at most this ratio between the top and bottom of their range: a range whose
+# lower bound is smaller than (or not positive) is raised to the upper bound divided by this.
+LOG_BINS_MAX_RATIO = 2**20
+
+# Minimum number of rows in each band when an image is split across worker threads:
+# below this, the per-band overhead outweighs any gain from parallelism.
+MIN_BAND_ROWS = 16
+
+_THREAD_POOL = None
+def _thread_pool():
+    global _THREAD_POOL
+    if _THREAD_POOL is None:
+        _THREAD_POOL = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+    return _THREAD_POOL
+
+_rgb_hists = {
+    # dtype, ranged: (hist_func, min/max c type)
+    (numpy.uint16, False): (_histogram.lib.rgb_hist_uint16, 'uint16_t *'),
+    (numpy.uint8, False): (_histogram.lib.rgb_hist_uint8, 'uint8_t *'),
+    (numpy.uint16, True): (_histogram.lib.ranged_rgb_hist_uint16, 'uint16_t *'),
+}
 
 def _fast_index_first(image):
     image = numpy.asarray(image)
     if image.strides[0] > image.strides[1]:
-        return image.T, True
+        return image.swapaxes(0, 1), True
     else:
         return image, False
 
-def histogram(image, range=(None, None), image_bits=None, mask_geometry=None):
+def _bands(i, spans, n_workers):
+    """Split the (fast-index-first) image i, and its mask spans if present, into at most
+    n_workers bands of contiguous rows."""
+    rows = i.shape[1]
+    if rows == 0:
+        # an empty mask: the masked kernels visit no pixels
+        yield i, spans
+        return
+    n_bands = max(1, min(n_workers, rows // MIN_BAND_ROWS))
+    if spans is None:
+        bounds = numpy.linspace(0, rows, n_bands + 1).round().astype(int)
+    else:
+        # balance the bands by the number of masked pixels in each, rather than the number of rows
+        offsets, starts, ends = spans
+        span_pixels = numpy.concatenate([[0], numpy.cumsum(ends.astype(numpy.int64) - starts)])
+        row_pixels = span_pixels[offsets]
+        bounds = numpy.searchsorted(row_pixels, numpy.linspace(0, row_pixels[-1], n_bands + 1))
+        bounds[0] = 0
+        bounds[-1] = rows
+        bounds = numpy.unique(bounds)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if spans is None:
+            yield i[:, lo:hi], None
+        else:
+            # the band's offsets still index into the full starts and ends arrays
+            yield i[:, lo:hi], (offsets[lo:hi+1], starts, ends)
+
+def _map_bands(task, i, spans, n_workers):
+    """Call task(band, band_spans) for each band of the image, in parallel if n_workers > 1,
+    and return the list of results in band order. The C kernels release the GIL while they
+    run, so the bands are processed concurrently."""
+    bands = list(_bands(i, spans, n_workers))
+    if len(bands) == 1:
+        return [task(*bands[0])]
+    return list(_thread_pool().map(lambda band: task(*band), bands))
+
+def _kernel_args(i, spans, nullable_spans=False):
+    """Return the image and span arguments for a kernel call. If nullable_spans, the kernel
+    takes NULL spans for unmasked images (as do all the RGB(A) kernels)."""
+    args = [_histogram.ffi.cast('char *', i.ctypes.data), i.shape[1], i.shape[0], i.strides[1], i.strides[0]]
+    if i.ndim == 3:
+        # RGB(A) kernels take the channel stride
+        args.append(i.strides[2])
+        nullable_spans = True
+    if spans is None and nullable_spans:
+        args += [_histogram.ffi.NULL, _histogram.ffi.NULL, _histogram.ffi.NULL]
+    if spans is not None:
+        offsets, starts, ends = spans
+        args += [_histogram.ffi.cast('uint32_t *', offsets.ctypes.data),
+            _histogram.ffi.cast('uint32_t *', starts.ctypes.data),
+            _histogram.ffi.cast('uint32_t *', ends.ctypes.data)]
+    return args
+
+def _hist_args(n_bins, rgb):
+    """Allocate the histogram (and, for RGB images, the red, green, and blue channel histograms)
+    for a kernel call, and return them along with the pointer arguments to pass."""
+    hist = numpy.zeros(n_bins, dtype=numpy.uint32)
+    args = [_histogram.ffi.cast('uint32_t *', hist.ctypes.data)]
+    if rgb:
+        channel_hists = numpy.zeros((3, n_bins), dtype=numpy.uint32)
+        args.append(_histogram.ffi.cast('uint32_t *', channel_hists.ctypes.data))
+    else:
+        channel_hists = None
+    return hist, channel_hists, args
+
+def _merge_hists(hists):
+    if len(hists) == 1:
+        return hists[0]
+    # sum in uint32 so that the merged counts match the single-threaded kernels exactly
+    return numpy.sum(hists, axis=0, dtype=numpy.uint32)
+
+# Must match FLOAT_BUCKET_SHIFT in _histogram_src.c: the number of low bits of each float's representation
+# that are dropped to give its bucket in the single-pass float histogram.
+_FLOAT_BUCKET_SHIFT = 10
+# Single-pass float histograms are first binned provisionally (into buckets by floating-point representation,
+# or into fine bins over a provisional range), and then rebinned. If the provisional bins are wider than this
+# fraction of a final bin, the rebinned histogram would be too coarse, and a second, exact pass is made instead.
+SINGLE_PASS_MAX_BIN_FRACTION = 1/4
+# Number of fine bins per final bin when binning over a provisional range
+SINGLE_PASS_OVERSAMPLING = 8
+
+def _float_buckets(values):
+    """Return the single-pass histogram buckets of the given float32 values, as computed by
+    bucket_hist_float in _histogram_src.c."""
+    bits = numpy.asarray(values, dtype=numpy.float32).view(numpy.uint32)
+    bits = bits ^ numpy.where(bits & 0x80000000, numpy.uint32(0xFFFFFFFF), numpy.uint32(0x80000000))
+    return bits >> _FLOAT_BUCKET_SHIFT
+
+def _float_bucket_edges(buckets):
+    """Return the lowest and highest float32 values that fall in each of the given buckets."""
+    low = numpy.asarray(buckets).astype(numpy.uint32) << _FLOAT_BUCKET_SHIFT
+    high = low | numpy.uint32(2**_FLOAT_BUCKET_SHIFT - 1)
+    edges = []
+    for bits in (low, high):
+        bits = bits ^ numpy.where(bits & 0x80000000, numpy.uint32(0x80000000), numpy.uint32(0xFFFFFFFF))
+        edges.append(bits.view(numpy.float32))
+    return edges
+
+def _bin_values(values, n_bins, r_min, r_max):
+    """Return the bins of the given float32 values, and a mask of those within [r_min, r_max], exactly as
+    the ranged_bin_* functions in _histogram_src.c bin them."""
+    with numpy.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        r_min = numpy.float32(r_min)
+        r_max = numpy.float32(r_max)
+        in_range = (values >= r_min) & (values <= r_max)
+        bin_factor = numpy.float32(n_bins) / (r_max - r_min)
+        bins = bin_factor * (values[in_range] - r_min)
+        bins = numpy.where(bins < n_bins, bins, n_bins - 1).astype(numpy.intp)
+    return bins, in_range
+
+def _rebin(counts, lows, highs, mn, mx, n_bins, r_min, r_max):
+    """Rebin provisional bins, with the given low and high edges, into n_bins bins over [r_min, r_max].
+    The count of each provisional bin is placed according to its midpoint (limited to the image's
+    [mn, mx]), which is binned exactly as ranged_hist_float bins pixel values."""
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        midpoints = (lows.astype(numpy.float64) + highs) / 2
+        # fmin and fmax ignore the NaN representations past the largest finite float
+        values = numpy.fmax(numpy.fmin(midpoints, mx), mn).astype(numpy.float32)
+    bins, in_range = _bin_values(values, n_bins, r_min, r_max)
+    return numpy.bincount(bins, weights=counts[in_range], minlength=n_bins).astype(numpy.uint32)
+
+def _rebin_uint8(hists, n_bins, r_min, r_max):
+    """Rebin exact (one bin per value) uint8 histograms, along their last axis, into n_bins bins over
+    [r_min, r_max], exactly as ranged_hist_uint16 would bin the values."""
+    bins, in_range = _bin_values(numpy.arange(256, dtype=numpy.float32), n_bins, r_min, r_max)
+    if hists.ndim == 1:
+        return numpy.bincount(bins, weights=hists[in_range], minlength=n_bins).astype(numpy.uint32)
+    return numpy.array([_rebin_uint8(hist, n_bins, r_min, r_max) for hist in hists])
+
+def log_bin_range(r_min, r_max):
+    """Return the (low, high) range actually covered by a log-binned histogram over (r_min, r_max),
+    given LOG_BINS_MAX_RATIO, or None if r_max is not positive (in which case the histogram is empty)."""
+    if not r_max > 0:
+        return None
+    return max(r_min, r_max / LOG_BINS_MAX_RATIO), r_max
+
+def bin_edges(n_bins, range, log_bins=False):
+    """Return the n_bins + 1 edges of the bins of a float32 histogram over the given (low, high) range,
+    spaced logarithmically if log_bins (see histogram())."""
+    if log_bins:
+        range = log_bin_range(*range)
+        if range is None:
+            return numpy.full(n_bins + 1, numpy.nan)
+        return numpy.geomspace(*range, num=n_bins + 1)
+    return numpy.linspace(*range, num=n_bins + 1)
+
+def percentile_range(hist, range, percentiles=(0.1, 99.9), log_bins=False):
+    """Return the values at the given (low, high) percentiles of the distribution of values in a histogram
+    over the given (min, max) range, interpolating within the bins (in log(value) if log_bins; see bin_edges()).
+    This takes time proportional to the number of bins, not the number of pixels, so it is cheap enough to
+    run on every frame of a live image stream. The (0, 100) percentiles are the lower edge of the first
+    non-empty bin and the upper edge of the last.
+
+    returns: (low, high), or None if the histogram is empty.
+    """
+    hist = numpy.asarray(hist)
+    cumulative = numpy.cumsum(hist, dtype=numpy.float64)
+    total = cumulative[-1]
+    if total == 0:
+        return None
+    edges = bin_edges(len(hist), range, log_bins)
+    if log_bins:
+        edges = numpy.log(edges)
+    values = []
+    # For the low percentile, take the first bin whose cumulative count exceeds the target count, and for the high,
+    # the first that reaches it, so that empty bins at a boundary between the two are excluded from the range.
+    for percentile, side in zip(percentiles, ('right', 'left')):
+        target = total * min(max(percentile, 0), 100) / 100
+        i = min(numpy.searchsorted(cumulative, target, side=side), len(hist) - 1)
+        fraction = min(max((target - (cumulative[i] - hist[i])) / hist[i], 0), 1) if hist[i] else 0
+        values.append(edges[i] + fraction * (edges[i+1] - edges[i]))
+    if log_bins:
+        values = numpy.exp(values)
+    return float(values[0]), float(values[1])
+
+def _single_pass_float_histogram(i, spans, r_min, r_max, n_bins, n_workers, provisional_range=None):
+    """Histogram a greyscale float32 image, reading it only once where possible. If the range is fully
+    specified, the histogram is binned directly, and is identical to that from the two-pass kernels.
+    Otherwise, the values are binned into fine bins over provisional_range, if given and if it contains
+    all the image's values, or else into buckets by their floating-point representations. These are
+    rebinned over the range once the min and max are known, unless they prove too coarse, in which case
+    the image is binned exactly in a second pass.
+
+    returns: min, max, hist, (nan_count, neg_inf_count, pos_inf_count)
+    """
+    def run(kernel, hist_len, *kernel_args):
+        def task(band, band_spans):
+            # NB: numpy.zeros allocates lazily, so only the pages of a large bucket array that are used get touched
+            hist = numpy.zeros(hist_len, dtype=numpy.uint32)
+            nonfinite = numpy.zeros(3, dtype=numpy.uint32)
+            mn = _histogram.ffi.new('float *')
+            mx = _histogram.ffi.new('float *')
+            kernel(*_kernel_args(band, band_spans, nullable_spans=True), _histogram.ffi.cast('uint32_t *', hist.ctypes.data),
+                _histogram.ffi.cast('uint32_t *', nonfinite.ctypes.data), *kernel_args, mn, mx)
+            return mn[0], mx[0], hist, nonfinite
+        mins, maxes, hists, nonfinites = zip(*_map_bands(task, i, spans, n_workers))
+        return min(mins), max(maxes), hists, tuple(int(count) for count in _merge_hists(nonfinites))
+
+    fused = _histogram.lib.fused_ranged_hist_float
+    if r_min is not None and r_max is not None:
+        mn, mx, hists, nonfinite = run(fused, n_bins, n_bins, r_min, r_max)
+        return mn, mx, _merge_hists(hists), nonfinite
+    if provisional_range is not None:
+        p_min, p_max = provisional_range
+        n_fine = n_bins * SINGLE_PASS_OVERSAMPLING
+        mn, mx, hists, nonfinite = run(fused, n_fine, n_fine, p_min, p_max)
+    else:
+        mn, mx, hists, nonfinite = run(_histogram.lib.bucket_hist_float, 2**(32 - _FLOAT_BUCKET_SHIFT))
+    if mn > mx:
+        # no finite values at all
+        return numpy.nan, numpy.nan, numpy.zeros(n_bins, dtype=numpy.uint32), nonfinite
+    r_min = mn if r_min is None else r_min
+    r_max = mx if r_max is None else r_max
+    max_width = SINGLE_PASS_MAX_BIN_FRACTION * (r_max - r_min) / n_bins
+    if provisional_range is not None:
+        if p_min <= mn and mx <= p_max and (p_max - p_min) / n_fine <= max_width:
+            fine_edges = numpy.linspace(p_min, p_max, n_fine + 1)
+            return mn, mx, _rebin(_merge_hists(hists), fine_edges[:-1], fine_edges[1:], mn, mx, n_bins, r_min, r_max), nonfinite
+    else:
+        first_bucket, last_bucket = _float_buckets([mn, mx])
+        lows, highs = _float_bucket_edges([first_bucket, last_bucket])
+        # buckets are widest at the largest magnitudes, which are at one end or the other
+        if (highs - lows).max() <= max_width:
+            buckets = _merge_hists([hist[first_bucket:last_bucket+1] for hist in hists])
+            # a range that spans zero covers millions of buckets, but few are occupied
+            occupied = numpy.flatnonzero(buckets)
+            lows, highs = _float_bucket_edges(occupied + first_bucket)
+            return mn, mx, _rebin(buckets[occupied], lows, highs, mn, mx, n_bins, r_min, r_max), nonfinite
+    hists = run(fused, n_bins, n_bins, r_min, r_max)[2]
+    return mn, mx, _merge_hists(hists), nonfinite
+
+def histogram(image, range=(None, None), image_bits=None, mask_geometry=None, n_workers=1, single_pass=False, n_bins=None,
+        log_bins=False):
     """
     image: 2-dimensional greyscale image, or GA, RGB, or RGBA image in (x, y, c) index order.
-        If RGB(A), the RGB channels will be converted to greyscale first. Alpha channels are ignored.
+        If RGB(A), the histogram is of the CIE 1931 linear luminance of the RGB channels.
+        Alpha channels are ignored.
     range: [low, high] range over which histogram is calculated
     image_bits: only applies to uint16 images. If None, images are assumed to occupy full 16-bit range.
-    mask_geometry: (cx, cy, radius) of a vignette mask, as fractions of image.shape.
-        (cx and radius will be in terms of image.shape[0], cy in terms of image.shape[1])
+    mask_geometry: region of the image to which the histogram is restricted: either
+        (cx, cy, radius) of a vignette mask, as fractions of image.shape (cx and radius will be
+        in terms of image.shape[0], cy in terms of image.shape[1]), a ('rect', geometry),
+        ('ellipse', geometry), or ('polygon', geometry) pair in pixel coordinates, or a boolean
+        mask array. See mask_spans for details. Only the pixels within the mask are visited.
+    n_workers: number of threads across which to split the image, in bands of rows.
+        Each thread builds its own histogram, min, and max, which are then merged, so
+        the results are identical to those from a single thread.
+    single_pass: only applies to greyscale float32 images. If True, or a provisional (low, high)
+        range such as that of the previous frame of a series, read the image only once where
+        possible, rather than once for the min and max and again for the histogram. Unless range
+        is fully specified, the histogram is then approximate: values near a bin edge may be
+        counted in the adjacent bin (see float_histogram()). Does not apply to log-binned histograms.
+    n_bins: number of bins, from 1 to MAX_BINS. By default, 256 for uint8 images (or one bin per
+        value of the range, if specified) and 1024 otherwise. Unranged uint16 histograms with a
+        power-of-two number of bins (up to 2**image_bits) are binned by bit-shifting; in
+        particular, 65536 bins gives one bin per value of a 16-bit image. Ignored for bool images.
+    log_bins: only applies to float32 images. If True, the bins are evenly spaced in log(value)
+        rather than value, for high-dynamic-range images. Only positive values can be so binned:
+        the range is limited as described for log_bin_range(). See bin_edges().
     returns: min, max, hist
-        min, max: image min and max values (possibly outside the range, if specified)
+        min, max: image min and max values (possibly outside the range, if specified), or NaN if
+            the mask contains no pixels (in which case the histogram is all zeros)
         hist: histogram
     """
+    return _histogram_impl(image, range, image_bits, mask_geometry, n_workers, single_pass, n_bins, log_bins)[:3]
+
+def histogram_with_channels(image, range=(None, None), image_bits=None, mask_geometry=None, n_workers=1, single_pass=False,
+        n_bins=None, log_bins=False):
+    """As histogram(), but also returns the individual histograms of the red, green, and
+    blue channels of RGB(A) images. These are computed in the same pass over the image as the
+    luminance histogram, and are binned over the same range.
+
+    returns: min, max, hist, channel_hists
+        min, max, hist: as for histogram()
+        channel_hists: array of shape (3, len(hist)) with the red, green, and blue histograms,
+            or None if the image is not RGB(A).
+    """
+    return _histogram_impl(image, range, image_bits, mask_geometry, n_workers, single_pass, n_bins, log_bins)[:4]
+
+def float_histogram(image, range=(None, None), mask_geometry=None, n_workers=1, provisional_range=None, n_bins=None):
+    """Histogram a greyscale float32 image in a single pass over its pixels where possible, counting
+    NaN and infinite values separately. Non-finite values are otherwise ignored, including for the
+    min and max (which are NaN if the image has no finite values).
+
+    If range is fully specified, the histogram is identical to that from histogram(). Otherwise,
+    values are first binned provisionally: into fine bins over provisional_range if it is given,
+    or else by the top bits of their floating-point representations. Once the min and max are
+    known, the provisional bins are rebinned into the histogram, with each value binned as though
+    it were at the middle of its provisional bin. If the provisional bins turn out to be too coarse
+    for that (wider than SINGLE_PASS_MAX_BIN_FRACTION of a histogram bin), or provisional_range
+    does not contain all the image's values, the image is binned exactly in a second pass.
+
+    The rebinned histogram is therefore approximate: a value within half a provisional bin width
+    (at most SINGLE_PASS_MAX_BIN_FRACTION / 2 of a histogram bin) of a bin edge may be counted in
+    the bin on the other side of it. The min and max, and the counts of non-finite values, are exact.
+
+    returns: min, max, hist, (nan_count, neg_inf_count, pos_inf_count)
+    """
+    image = numpy.asarray(image)
+    if image.dtype != numpy.float32 or image.ndim != 2:
+        raise ValueError('Only 2D float32 images are supported')
+    single_pass = True if provisional_range is None else provisional_range
+    mn, mx, hist, channel_hists, nonfinite = _histogram_impl(image, range, None, mask_geometry, n_workers, single_pass, n_bins)
+    return mn, mx, hist, nonfinite
+
+def histograms(images, range=(None, None), image_bits=None, mask_geometry=None, n_workers=None, n_bins=None, log_bins=False):
+    """Histogram a batch of images, such as the frames of a time series, in parallel.
+
+    images: sequence of images, or an array whose first axis indexes a stack of images (e.g. a
+        3D array of 2D greyscale images, in (frame, x, y) index order). All images must have the
+        same dtype (and thus number of histogram bins).
+    range, image_bits, mask_geometry, n_bins, log_bins: as for histogram(), and applied to each image. Unless range
+        is fully specified, the histogram of each float32 image is binned over its own min and max.
+    n_workers: number of images to histogram concurrently (default: the number of CPUs).
+
+    returns: mins, maxes, hists
+        mins, maxes: arrays of each image's min and max value (float32 arrays, with NaN for images
+            with no pixels within the mask, if there are any such)
+        hists: array of shape (len(images), n_bins), with the histogram of each image as a row.
+    """
+    if len(images) == 0:
+        raise ValueError('At least one image is required.')
+    images = [numpy.asarray(image) for image in images]
+    if len(set(image.dtype for image in images)) > 1:
+        raise ValueError('All images must have the same dtype.')
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    def task(batch):
+        # each image is histogrammed on a single thread, so tasks never wait on the thread pool themselves
+        return [_histogram_impl(image, range, image_bits, mask_geometry, 1, False, n_bins, log_bins)[:3] for image in batch]
+    bounds = numpy.linspace(0, len(images), min(n_workers, len(images)) + 1).round().astype(int)
+    batches = [images[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+    if len(batches) == 1:
+        results = task(batches[0])
+    else:
+        results = [result for batch_results in _thread_pool().map(task, batches) for result in batch_results]
+    mins, maxes, hists = zip(*results)
+    dtype = images[0].dtype
+    if any(numpy.isnan(mn) for mn in mins):
+        dtype = numpy.float32
+    return numpy.array(mins, dtype=dtype), numpy.array(maxes, dtype=dtype), numpy.stack(hists)
+
+def _histogram_impl(image, range, image_bits, mask_geometry, n_workers, single_pass, n_bins=None, log_bins=False):
     image = numpy.asarray(image)
     assert image.dtype.type in {numpy.bool8, numpy.uint8, numpy.uint16, numpy.float32}
-    if image.ndim == 3:
-        if image.shape[2] in (3, 4): # RGB/RGBA
-            r, g, b = numpy.rollaxis(image, -1)[:3]
-            luma = 0.2126*r + 0.7152*g + 0.0722*b # use CIE 1931 linear luminance
-            image = luma.astype(image.dtype)
-        elif image.shape[2] == 2: # GA
-            image = image[:,:,0]
-    if image.ndim != 2:
+    rgb = image.ndim == 3 and image.shape[2] in (3, 4)
+    if image.ndim == 3 and image.shape[2] == 2: # GA
+        image = image[:,:,0]
+    if image.ndim != 2 and not rgb:
         raise ValueError('Only 2D, GA, RGB, and RGBA images are supported')
+    if n_bins is not None and not 1 <= n_bins <= MAX_BINS:
+        raise ValueError('n_bins must be in [1, {}].'.format(MAX_BINS))
 
+    range = tuple(range)
     if image.dtype == numpy.bool8:
         was_bool = True
         image = image.view(numpy.uint8)
+        range = (None, None)
+        n_bins = None
     else:
         was_bool = False
-    masked = mask_geometry is not None
-    range = tuple(range)
     ranged = range != (None, None)
     r_min, r_max = range
 
     i, transpose = _fast_index_first(image)
-    if masked:
-        # multiply cx, cy, and r by the shape of the original image
-        cx, cy, r = (numpy.array(mask_geometry) * [image.shape[0], image.shape[1], image.shape[0]]).astype(int)
-        if transpose:
-            cx, cy = cy, cx
-        ymin, ymax, starts, ends = _circle_mask(cx, cy, r, i.shape)
-        if ymin is None:
-            # mask is whole region
-            masked = False
-        else:
+    spans = None
+    if mask_geometry is not None:
+        mask = mask_spans.rasterize(mask_geometry, image.shape, transpose)
+        if mask is not None: # otherwise mask is whole region
+            ymin, ymax, offsets, starts, ends = mask
+            spans = offsets, starts, ends
             i = i[:,ymin:ymax]
-    args = [_histogram.ffi.cast('char *', i.ctypes.data), i.shape[1], i.shape[0], i.strides[1], i.strides[0]]
-    if masked:
-        sp = _histogram.ffi.cast('uint16_t *', starts.ctypes.data)
-        ep = _histogram.ffi.cast('uint16_t *', ends.ctypes.data)
-        args += [sp, ep]
-
-    if image.dtype == numpy.uint8:
-        hist = numpy.zeros(256, dtype=numpy.uint32)
-    else:
-        hist = numpy.zeros(1024, dtype=numpy.uint32)
-    args.append(_histogram.ffi.cast('uint32_t *', hist.ctypes.data))
+    masked = spans is not None
 
+    nonfinite = None
     if image.dtype == numpy.float32:
-        mn, mx = _mnf, _mxf
-        if masked:
+        if n_bins is None:
+            n_bins = 1024
+        log_bins = bool(log_bins)
+    else:
+        log_bins = False
+    if image.dtype == numpy.float32 and single_pass is not False and not rgb and not log_bins:
+        provisional_range = None if single_pass is True else tuple(single_pass)
+        mn, mx, hist, nonfinite = _single_pass_float_histogram(i, spans, r_min, r_max, n_bins, n_workers, provisional_range)
+        hists = [hist]
+        channel_hists = None
+    elif image.dtype == numpy.float32:
+        nullable_spans = False
+        if rgb:
+            minmax_func = _histogram.lib.rgb_minmax_float
+            hist_func = _histogram.lib.log_ranged_rgb_hist_float if log_bins else _histogram.lib.ranged_rgb_hist_float
+        elif log_bins:
+            minmax_func = _histogram.lib.masked_minmax_float if masked else _histogram.lib.minmax_float
+            hist_func = _histogram.lib.log_ranged_hist_float
+            nullable_spans = True
+        elif masked:
             minmax_func = _histogram.lib.masked_minmax_float
             hist_func = _histogram.lib.masked_ranged_hist_float
         else:
             minmax_func = _histogram.lib.minmax_float
             hist_func = _histogram.lib.ranged_hist_float
-        minmax_args = args[:-1] + [mn, mx] # ditch the hist pointer, and add the min and max pointers
-        minmax_func(*minmax_args)
+        def minmax_task(band, band_spans):
+            mn = _histogram.ffi.new('float *')
+            mx = _histogram.ffi.new('float *')
+            minmax_func(*_kernel_args(band, band_spans), mn, mx)
+            return mn[0], mx[0]
+        mins, maxes = zip(*_map_bands(minmax_task, i, spans, n_workers))
+        mn, mx = min(mins), max(maxes)
         if r_min is None:
-            r_min = mn[0]
+            r_min = mn
         if r_max is None:
-            r_max = mx[0]
-        args += [len(hist), r_min, r_max]
+            r_max = mx
+        bin_range = log_bin_range(r_min, r_max) if log_bins else (r_min, r_max)
+        def hist_task(band, band_spans):
+            hist, channel_hists, hist_args = _hist_args(n_bins, rgb)
+            if bin_range is not None:
+                hist_func(*_kernel_args(band, band_spans, nullable_spans), *hist_args, n_bins, *bin_range)
+            return hist, channel_hists
+        hists, channel_hists = zip(*_map_bands(hist_task, i, spans, n_workers))
     else: # integral type image
-        hist_func, mn, mx = _int_hists[(image.dtype.type, ranged, masked)]
-        if image.dtype == numpy.uint16:
+        if image.dtype == numpy.uint8:
+            max_value = 255
+        else:
             if image_bits is None:
                 image_bits = 16
-            if ranged:
-                args.append(len(hist)) # nbins arg
-            else:
-                assert image_bits >= 10
-                args.append(image_bits - 10) # bit shift arg
+            max_value = 2**image_bits - 1
         if ranged:
-            if r_min is None:
-                r_min = 0
-            if r_max is None:
-                if image.dtype == numpy.uint8:
-                    r_max = 255
-                else:
-                    r_max = 2**image_bits - 1
-            args += [int(r_min), int(r_max)]
-        args += [mn, mx]
-    hist_func(*args)
+            r_min = 0 if r_min is None else int(r_min)
+            r_max = max_value if r_max is None else int(r_max)
+        if image.dtype == numpy.uint8:
+            if n_bins is None:
+                n_bins = r_max - r_min + 1 if ranged else 256
+            # histogram exactly, one bin per value: any other binning is done by rebinning afterward
+            kernel_ranged = False
+            kernel_bins = 256
+            extra_args = []
+        else:
+            if n_bins is None:
+                n_bins = 1024
+            kernel_bins = n_bins
+            shift = image_bits - (n_bins.bit_length() - 1)
+            if ranged or n_bins & (n_bins - 1) or shift < 0:
+                kernel_ranged = True
+                if not ranged:
+                    r_min, r_max = 0, max_value
+                extra_args = [n_bins, r_min, r_max]
+            else:
+                # power-of-two bins over the full range: bin by bit-shifting
+                kernel_ranged = False
+                extra_args = [n_bins, shift] if rgb else [shift]
+        if rgb:
+            hist_func, minmax_type = _rgb_hists[(image.dtype.type, kernel_ranged)]
+        else:
+            hist_func, minmax_type = _int_hists[(image.dtype.type, kernel_ranged, masked)]
+        def hist_task(band, band_spans):
+            hist, channel_hists, hist_args = _hist_args(kernel_bins, rgb)
+            mn = _histogram.ffi.new(minmax_type)
+            mx = _histogram.ffi.new(minmax_type)
+            hist_func(*_kernel_args(band, band_spans), *hist_args, *extra_args, mn, mx)
+            return mn[0], mx[0], hist, channel_hists
+        mins, maxes, hists, channel_hists = zip(*_map_bands(hist_task, i, spans, n_workers))
+        mn, mx = min(mins), max(maxes)
+    if masked and len(spans[1]) == 0:
+        # no pixels within the mask: the kernels' min and max are their initial values, with min > max
+        mn = mx = numpy.nan
+    hist = _merge_hists(hists)
+    channel_hists = _merge_hists(channel_hists) if rgb else None
     if was_bool:
         hist = hist[:2]
-        r_min, r_max = bool(r_min), bool(r_max)
-    return mn[0], mx[0], hist
+        if rgb:
+            channel_hists = channel_hists[:, :2]
+    elif image.dtype == numpy.uint8 and (ranged or n_bins != 256):
+        if not ranged:
+            r_min, r_max = 0, 255
+        hist = _rebin_uint8(hist, n_bins, r_min, r_max)
+        if rgb:
+            channel_hists = _rebin_uint8(channel_hists, n_bins, r_min, r_max)
+    return mn, mx, hist, channel_hists, nonfinite
+
+class TiledHistogram:
+    """Maintains the histogram, min, and max of an image as the sum of the histograms of a grid
+    of tiles, so that after a change to a sub-region of the image only the tiles that the region
+    touches need to be recomputed.
+
+    The grid is built lazily: full-image updates are computed directly (and invalidate the grid),
+    and the first partial update after that builds the grid. Masked histograms are always
+    computed for the full image.
+    """
+    def __init__(self, tile_size=256):
+        self.tile_size = tile_size
+        self._last_min_max = None
+        self.invalidate()
+
+    def invalidate(self):
+        self._params = None
+        self.tile_mins = self.tile_maxes = self.tile_histograms = self.tile_channel_histograms = None
+
+    def update(self, image, range=(None, None), image_bits=None, mask_geometry=None, changed_region=None, n_workers=1,
+            single_pass=False, n_bins=None, log_bins=False):
+        """Return (min, max, hist, channel_hists) for image, exactly as histogram_with_channels()
+        would. If changed_region, given as (x, y, w, h), is not None, only the pixels within that
+        region are assumed to have changed since the previous update.
+
+        If single_pass is True, greyscale float32 images are histogrammed in a single pass, binning
+        provisionally within the range of the previous image (see float_histogram()). The first
+        image, for which there is no such range, is histogrammed in two passes as usual."""
+        image = numpy.asarray(image)
+        range = tuple(range)
+        if changed_region is None or mask_geometry is not None:
+            self.invalidate()
+            if single_pass:
+                single_pass = self._provisional_range()
+            result = histogram_with_channels(image, range, image_bits, mask_geometry, n_workers, single_pass, n_bins, log_bins)
+            self._last_min_max = result[:2]
+            return result
+        params = image.shape, image.dtype, range, image_bits, single_pass, n_bins, log_bins
+        if params != self._params:
+            self._single_pass = single_pass
+            self._n_bins = n_bins
+            self._log_bins = log_bins
+            self._build(image, range, image_bits, n_workers)
+            self._params = params
+        else:
+            self._update_tiles(image, changed_region)
+        return self.min, self.max, self.hist, self.channel_hists
+
+    def _provisional_range(self):
+        # Without a provisional range, single-pass histograms bin by floating-point representation,
+        # which must then be scanned over millions of buckets if the range spans zero: a two-pass
+        # histogram is generally no slower.
+        if self._last_min_max is None:
+            return False
+        mn, mx = self._last_min_max
+        if not (numpy.isfinite(mn) and numpy.isfinite(mx) and mn < mx):
+            return False
+        # pad the range a little, as successive images of a series rarely have exactly the same range
+        pad = (mx - mn) / 8
+        return mn - pad, mx + pad
+
+    def _tiles(self, x0, x1, y0, y1):
+        return [(tx, ty) for tx in range(x0, x1) for ty in range(y0, y1)]
+
+    def _compute_tiles(self, image, tiles, n_workers=1):
+        ts = self.tile_size
+        def tile_task(tile):
+            tx, ty = tile
+            return histogram_with_channels(image[tx*ts:(tx+1)*ts, ty*ts:(ty+1)*ts], self._tile_range, self._image_bits,
+                single_pass=self._single_pass, n_bins=self._n_bins, log_bins=self._log_bins)
+        if n_workers > 1:
+            results = _thread_pool().map(tile_task, tiles)
+        else:
+            results = map(tile_task, tiles)
+        for (tx, ty), (mn, mx, hist, channel_hists) in zip(tiles, results):
+            if self.tile_histograms is None:
+                tiles_x, tiles_y = self.tile_mins.shape
+                self.tile_histograms = numpy.empty((tiles_x, tiles_y, len(hist)), dtype=numpy.uint32)
+                if channel_hists is not None:
+                    self.tile_channel_histograms = numpy.empty((tiles_x, tiles_y) + channel_hists.shape, dtype=numpy.uint32)
+            self.tile_mins[tx, ty] = mn
+            self.tile_maxes[tx, ty] = mx
+            self.tile_histograms[tx, ty] = hist
+            if channel_hists is not None:
+                self.tile_channel_histograms[tx, ty] = channel_hists
+
+    def _update_min_max(self):
+        if self._single_pass and self.tile_mins.dtype == numpy.float32:
+            # single-pass float tiles with no finite values have NaN min and max
+            self.min = numpy.nanmin(self.tile_mins).item()
+            self.max = numpy.nanmax(self.tile_maxes).item()
+        else:
+            self.min = self.tile_mins.min().item()
+            self.max = self.tile_maxes.max().item()
+
+    def _resum(self):
+        self.hist = self.tile_histograms.sum(axis=(0, 1), dtype=numpy.uint32)
+        if self.tile_channel_histograms is None:
+            self.channel_hists = None
+        else:
+            self.channel_hists = self.tile_channel_histograms.sum(axis=(0, 1), dtype=numpy.uint32)
+
+    def _build(self, image, hist_range, image_bits, n_workers):
+        self._range = hist_range
+        self._image_bits = image_bits
+        ts = self.tile_size
+        tiles_x = -(-image.shape[0] // ts)
+        tiles_y = -(-image.shape[1] // ts)
+        minmax_dtype = numpy.uint8 if image.dtype == bool else image.dtype
+        self.tile_mins = numpy.empty((tiles_x, tiles_y), dtype=minmax_dtype)
+        self.tile_maxes = numpy.empty((tiles_x, tiles_y), dtype=minmax_dtype)
+        self.tile_histograms = self.tile_channel_histograms = None
+        if image.dtype == numpy.float32 and None in hist_range:
+            # Float histograms with an unspecified range are binned between the image min and max,
+            # so the min and max over the whole image must be known before any tile can be binned.
+            mn, mx, hist, channel_hists = histogram_with_channels(image, hist_range, image_bits, None, n_workers, self._single_pass,
+                self._n_bins, self._log_bins)
+            self._tile_range = self._resolve_float_range(mn, mx)
+        else:
+            self._tile_range = hist_range
+        self._compute_tiles(image, self._tiles(0, tiles_x, 0, tiles_y), n_workers)
+        self._update_min_max()
+        self._resum()
+
+    def _resolve_float_range(self, mn, mx):
+        r_min, r_max = self._range
+        return mn if r_min is None else r_min, mx if r_max is None else r_max
 
+    def _update_tiles(self, image, changed_region):
+        x, y, w, h = changed_region
+        ts = self.tile_size
+        tiles_x, tiles_y = self.tile_mins.shape
+        x0, y0 = max(0, x // ts), max(0, y // ts)
+        x1, y1 = min(tiles_x, -(-(x + w) // ts)), min(tiles_y, -(-(y + h) // ts))
+        if x0 >= x1 or y0 >= y1:
+            return
+        old_hist = self.tile_histograms[x0:x1, y0:y1].sum(axis=(0, 1), dtype=numpy.uint32)
+        if self.tile_channel_histograms is not None:
+            old_channel_hists = self.tile_channel_histograms[x0:x1, y0:y1].sum(axis=(0, 1), dtype=numpy.uint32)
+        self._compute_tiles(image, self._tiles(x0, x1, y0, y1))
+        self._update_min_max()
+        if image.dtype == numpy.float32 and None in self._range:
+            tile_range = self._resolve_float_range(self.min, self.max)
+            if tile_range != self._tile_range:
+                # the image min or max moved, so the bins of every tile are now out of date
+                self._tile_range = tile_range
+                self._compute_tiles(image, self._tiles(0, tiles_x, 0, tiles_y))
+                self._resum()
+                return
+        # uint32 arithmetic wraps, so updating the running total matches a full re-sum exactly
+        self.hist = self.hist - old_hist + self.tile_histograms[x0:x1, y0:y1].sum(axis=(0, 1), dtype=numpy.uint32)
+        if self.tile_channel_histograms is not None:
+            new_channel_hists = self.tile_channel_histograms[x0:x1, y0:y1].sum(axis=(0, 1), dtype=numpy.uint32)
+            self.channel_hists = self.channel_hists - old_channel_hists + new_channel_hists
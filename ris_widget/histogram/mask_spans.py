@@ -0,0 +1,178 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Rasterization of histogram masks into per-row spans of pixels.
+
+A histogram mask may be given as any of:
+    (cx, cy, r): a circular vignette, with cx and r as fractions of image.shape[0],
+        and cy as a fraction of image.shape[1].
+    ('rect', ((x1, y1), (x2, y2))): a rectangle, in pixel coordinates, as given by
+        the geometry of an overlay.roi.RectROI.
+    ('ellipse', ((x1, y1), (x2, y2))): the ellipse inscribed in the given rectangle, as
+        given by the geometry of an overlay.roi.EllipseROI.
+    ('polygon', [(x1, y1), (x2, y2), ...]): a closed polygon, in pixel coordinates, as given
+        by the geometry of an overlay.polyline.Polyline. Self-intersecting polygons
+        are filled according to the even-odd rule.
+    a boolean array of the same shape as the image (in (x, y) index order).
+Except for circles, which are rasterized as digital circles, a pixel is within a mask if its
+center is.
+
+Masks are rasterized along the rows of the image as indexed by the histogram kernels (i.e.
+fast-index-first: along y if the image is stored with x as its fast index, and vice versa),
+and are returned as (ymin, ymax, offsets, starts, ends), where ymin and ymax bound the rows
+that the mask touches, and the spans of the row ymin+j are given by starts[k] and ends[k]
+(exclusive) for k in range(offsets[j], offsets[j+1]). Rows may contain any number of spans,
+including none. A mask that lies entirely outside the image has no rows at all (ymin == ymax).
+"""
+
+import functools
+import numpy
+
+def rasterize(mask_geometry, image_shape, transpose):
+    """Return (ymin, ymax, offsets, starts, ends) for the given mask, or None if the mask
+    covers the whole image (in which case the mask is ignored). A mask that covers none of
+    the image has no spans, so that nothing is histogrammed.
+
+    image_shape: (x, y) shape of the image.
+    transpose: if True, the rows of the image run along x rather than y.
+    """
+    sx, sy = image_shape[:2]
+    shape = (sy, sx) if transpose else (sx, sy) # shape in (column, row) order
+    if isinstance(mask_geometry, numpy.ndarray):
+        if mask_geometry.shape != (sx, sy):
+            raise ValueError('A histogram mask array must have the same shape as the image.')
+        mask = mask_geometry.astype(bool, copy=False)
+        if not transpose:
+            mask = mask.T
+        # cache on the packed bits of the mask, in (row, column) order
+        return _mask_spans(numpy.packbits(mask).tobytes(), shape)
+    if len(mask_geometry) == 3:
+        # multiply cx, cy, and r by the shape of the original image
+        cx, cy, r = (numpy.array(mask_geometry) * [sx, sy, sx]).astype(int)
+        if transpose:
+            cx, cy = cy, cx
+        return _circle_spans(int(cx), int(cy), int(r), shape)
+    kind, geometry = mask_geometry
+    if kind not in _RASTERIZERS:
+        raise ValueError('Unknown histogram mask type "{}".'.format(kind))
+    points = tuple((float(y), float(x)) if transpose else (float(x), float(y)) for x, y in geometry)
+    return _geometry_spans(kind, points, shape)
+
+def _scanline_bounds(cx, cy, r):
+    # based on 8-connected super-circle algorithm from comments in http://www.willperone.net/Code/codecircle.php
+    # and:
+    # A Chronological and Mathematical Overview of Digital Circle Generation Algorithms - Introducing Efficient 4 and 8-Connected Circles
+    # DOI: 10.1080/00207160.2015.1056170
+    # stores start and end position (on x axis) along each scanline of the circle
+    bounds = numpy.empty((2*r + 1, 2), dtype=numpy.int64)
+    x = 0
+    y = r
+    d = -r/2
+    while x <= y:
+        bounds[r+y] = bounds[r-y] = cx-x, cx+x+1
+        bounds[r+x] = bounds[r-x] = cx-y, cx+y+1
+        if d <= 0:
+            x += 1
+            d += x
+        else:
+            x += 1
+            y -= 1
+            d += x-y
+    return bounds
+
+@functools.lru_cache(maxsize=16)
+def _circle_spans(cx, cy, r, shape):
+    bounds = _scanline_bounds(cx, cy, r)
+    rows = numpy.arange(cy - r, cy + r + 1)
+    return _spans(rows, bounds[:,0], bounds[:,1], shape)
+
+@functools.lru_cache(maxsize=16)
+def _geometry_spans(kind, points, shape):
+    rows, starts, ends = _RASTERIZERS[kind](numpy.array(points, dtype=float))
+    return _spans(rows, starts, ends, shape)
+
+@functools.lru_cache(maxsize=16)
+def _mask_spans(packed_mask, shape):
+    n_cols, n_rows = shape
+    mask = numpy.unpackbits(numpy.frombuffer(packed_mask, dtype=numpy.uint8), count=n_rows*n_cols)
+    mask = mask.reshape((n_rows, n_cols))
+    # +1 where a run of True pixels starts and -1 just past where one ends
+    edges = numpy.diff(numpy.pad(mask, ((0, 0), (1, 1))).view(numpy.int8), axis=1)
+    rows, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1]
+    return _spans(rows, starts, ends, shape)
+
+def _first_pixel_from(v):
+    # index of the first pixel whose center is at or beyond v
+    return numpy.ceil(numpy.asarray(v) - 0.5).astype(numpy.int64)
+
+def _rect_runs(points):
+    (c1, r1), (c2, r2) = numpy.sort(points, axis=0)
+    rows = numpy.arange(_first_pixel_from(r1), _first_pixel_from(r2))
+    starts = numpy.full(len(rows), _first_pixel_from(c1))
+    ends = numpy.full(len(rows), _first_pixel_from(c2))
+    return rows, starts, ends
+
+def _ellipse_runs(points):
+    (c1, r1), (c2, r2) = numpy.sort(points, axis=0)
+    rows = numpy.arange(_first_pixel_from(r1), _first_pixel_from(r2))
+    cc, rc = (c1 + c2) / 2, (r1 + r2) / 2
+    a, b = (c2 - c1) / 2, (r2 - r1) / 2
+    dy = (rows + 0.5 - rc) / b
+    half_width = a * numpy.sqrt(numpy.clip(1 - dy**2, 0, None))
+    return rows, _first_pixel_from(cc - half_width), _first_pixel_from(cc + half_width)
+
+def _polygon_runs(points):
+    # find where each edge crosses the centers of the rows, counting an edge as spanning
+    # the half-open interval [low, high) so that a vertex is crossed once, not twice
+    crossing_rows = []
+    crossing_cols = []
+    for (c0, r0), (c1, r1) in zip(points, numpy.roll(points, -1, axis=0)):
+        if r0 == r1:
+            continue
+        rows = numpy.arange(_first_pixel_from(min(r0, r1)), _first_pixel_from(max(r0, r1)))
+        crossing_rows.append(rows)
+        crossing_cols.append(c0 + (rows + 0.5 - r0) * (c1 - c0) / (r1 - r0))
+    if len(crossing_rows) == 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, empty, empty
+    rows = numpy.concatenate(crossing_rows)
+    cols = numpy.concatenate(crossing_cols)
+    order = numpy.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    # each row is crossed an even number of times: the pixels between successive pairs are inside
+    return rows[::2], _first_pixel_from(cols[::2]), _first_pixel_from(cols[1::2])
+
+_RASTERIZERS = {
+    'rect': _rect_runs,
+    'ellipse': _ellipse_runs,
+    'polygon': _polygon_runs
+}
+
+def _spans(rows, starts, ends, shape):
+    """Build the spans from arrays of the row, start, and end of each run of pixels, sorted
+    by row and then start. Runs are clipped to the image and empty runs are dropped."""
+    n_cols, n_rows = shape
+    starts = numpy.clip(starts, 0, n_cols)
+    ends = numpy.clip(ends, 0, n_cols)
+    keep = (ends > starts) & (rows >= 0) & (rows < n_rows)
+    rows = rows[keep]
+    starts = starts[keep]
+    ends = ends[keep]
+    if len(rows) == n_rows and numpy.all(starts == 0) and numpy.all(ends == n_cols):
+        # mask is just whole image...
+        return None
+    if len(rows) == 0:
+        # mask is entirely outside the image
+        ymin = ymax = 0
+    else:
+        ymin = int(rows[0])
+        ymax = int(rows[-1]) + 1
+    offsets = numpy.zeros(ymax - ymin + 1, dtype=numpy.uint32)
+    numpy.cumsum(numpy.bincount(rows - ymin, minlength=ymax - ymin), out=offsets[1:])
+    starts = starts.astype(numpy.uint32)
+    ends = ends.astype(numpy.uint32)
+    # the spans are cached and shared, so guard them against modification
+    for a in (offsets, starts, ends):
+        a.flags.writeable = False
+    return ymin, ymax, offsets, starts, ends
@@ -104,4 +104,21 @@ class HistogramMask:
         cy /= shape[1]
         r /= shape[0]
         self.layer_stack.histogram_mask = self.masks['custom'] = (cx, cy, r)
-        self.custom_mask.setChecked(True)
\ No newline at end of file
+        self.custom_mask.setChecked(True)
+
+def track_overlay(layer_stack, overlay):
+    """Restrict the histograms of all layers in layer_stack to the region of an overlay that provides
+    a histogram_mask property (an overlay.roi.RectROI or EllipseROI, or an overlay.polyline.Polyline),
+    following the overlay as it is edited in the GUI. Only the pixels within the overlay's region are
+    visited when computing the histograms.
+
+    Returns a function that, when called, stops following the overlay and clears the mask.
+    """
+    def geometry_changed(geometry):
+        layer_stack.histogram_mask = overlay.histogram_mask
+    overlay.geometry_change_callbacks.append(geometry_changed)
+    geometry_changed(overlay.geometry)
+    def stop_tracking():
+        overlay.geometry_change_callbacks.remove(geometry_changed)
+        layer_stack.histogram_mask = None
+    return stop_tracking
@@ -1,16 +1,36 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
 import ctypes
+import itertools
 
 import numpy
 from PyQt5 import Qt
 
+from . import mapped_image
+
 class Image(Qt.QObject):
     """An instance of the Image class is a wrapper around a Numpy ndarray representing a single image.
 
     Images are immutable: do not try to change the .data or .valid_range attributes after construction.
 
     The .data array can be modified in-place after construction, however: just call .refresh() afterward.
+
+    The data array is not copied if its pixels are contiguous along either axis, with a positive row stride
+    along the other: e.g. Fortran- or C-ordered arrays, or crops of either. If pixels are contiguous along y,
+    .transposed is True and the image is uploaded to its OpenGL texture transposed. Arrays with any other
+    layout are copied.
+
+    Each Image has a unique .serial number, and a .generation count that .refresh() increments, so
+    that (serial, generation) identifies the contents of the image (e.g. to cache its histogram).
+
+    By default, .refresh() emits .changed immediately, so that (e.g. with Layer.HISTOGRAM_ASYNC False) a
+    script sees the effects of a refresh as soon as it returns. Calls to .refresh(defer=True) (or all calls,
+    if COALESCE_REFRESHES is True) are instead coalesced: .changed is emitted once, with the union of the
+    changed regions, when control next returns to the Qt event loop (i.e. before the next frame is painted),
+    so that many refreshes in quick succession cost only one texture upload and histogram computation. Call
+    .flush_refresh() to emit .changed for pending refreshes immediately. .refresh_count and
+    .coalesced_refresh_count count the calls to .refresh() and those that were merged into an earlier
+    pending refresh.
     """
     # TODO: update documentation after image simplification
     changed = Qt.pyqtSignal(object)
@@ -21,11 +41,18 @@ class Image(Qt.QObject):
         numpy.uint16: (0, 65535),
         numpy.float32: (-numpy.inf, numpy.inf)}
 
+    _serials = itertools.count()
+
+    # If True, .refresh() calls that do not specify defer emit .changed once per pass through the event loop,
+    # rather than immediately
+    COALESCE_REFRESHES = False
+
     def __init__(self, data, image_bits=None, name=None, parent=None):
         """
         image_bits: only applies to uint16 images. If None, images are assumed to occupy full 16-bit range.
         The shape of image and mask data is interpreted as (x,y) for 2-d arrays and (x,y,c) for 3-d arrays.  If your image or mask was loaded as (y,x),
-        array.T will produce an (x,y)-shaped array.  In case of (y,x,c) image data, array.swapaxes(0,1) is required."""
+        array.T will produce an (x,y)-shaped array.  In case of (y,x,c) image data, array.swapaxes(0,1) is required.
+        Neither makes a copy of the data."""
         super().__init__(parent)
 
         data = numpy.asarray(data)
@@ -40,13 +67,16 @@ class Image(Qt.QObject):
         if image_bits is not None and data.dtype != numpy.uint16:
             raise ValueError('The image_bits argument may only be used if data is of type uint16.')
 
-        bpe = data.itemsize
-        desired_strides = (bpe, data.shape[0]*bpe) if data.ndim == 2 else (data.shape[2]*bpe, data.shape[0]*data.shape[2]*bpe, bpe)
-        if desired_strides == data.strides:
-            self._data = data
-        else:
+        transposed = self._texture_layout(data)
+        if transposed is None:
+            bpe = data.itemsize
+            desired_strides = (bpe, data.shape[0]*bpe) if data.ndim == 2 else (data.shape[2]*bpe, data.shape[0]*data.shape[2]*bpe, bpe)
             self._data = numpy.ndarray(data.shape, strides=desired_strides, dtype=data.dtype)
             self._data.flat = data.flat
+            self.transposed = False
+        else:
+            self._data = data
+            self.transposed = transposed
 
         if self._data.ndim == 2:
             self.type = 'G'
@@ -61,11 +91,42 @@ class Image(Qt.QObject):
             self.valid_range = self.NUMPY_DTYPE_TO_RANGE[data.dtype.type]
 
         self.name = name
+        self.serial = next(self._serials)
+        self.generation = 0
+        self.refresh_count = 0
+        self.coalesced_refresh_count = 0
+        self._refresh_pending = False
+        self._pending_region = None
+
+    @classmethod
+    def from_file(cls, path, image_bits=None, name=None, shape=None, dtype=None, offset=0):
+        """Construct an Image backed by a copy-on-write memory map of an image file, rather than reading
+        the whole file into memory. See mapped_image.map_image_file() for the supported file types and
+        the shape, dtype, and offset parameters of raw files. If name is None, the path is used."""
+        data = mapped_image.map_image_file(path, shape, dtype, offset)
+        return cls(data, image_bits, str(path) if name is None else name)
+
+    @staticmethod
+    def _texture_layout(data):
+        """Return False if the pixels of data are contiguous along x, True if they are contiguous along y,
+        and None if neither (or the stride between rows of pixels is not a positive multiple of the pixel
+        size), in which case data cannot be uploaded to a texture as is."""
+        pixel_bytes = data.itemsize
+        if data.ndim == 3:
+            if data.strides[2] != data.itemsize:
+                return None
+            pixel_bytes *= data.shape[2]
+        for transposed, (fast, slow) in ((False, (0, 1)), (True, (1, 0))):
+            row_stride = data.strides[slow]
+            if (data.strides[fast] == pixel_bytes and row_stride >= pixel_bytes * data.shape[fast]
+                    and row_stride % pixel_bytes == 0):
+                return transposed
+        return None
 
     def __repr__(self):
         return '{}; {}x{} ({})>'.format(super().__repr__()[:-1], self.size.width(), self.size.height(), self.type)
 
-    def refresh(self, changed_region=None):
+    def refresh(self, changed_region=None, defer=None):
         """
         The .refresh method should be called after modifying the contents of .data.
 
@@ -74,7 +135,35 @@ class Image(Qt.QObject):
 
         If only a portion of the image changed, call with (l, t, w, h) as the
         bounds of the changed_region.
+
+        If defer is True (or is None and COALESCE_REFRESHES is True), the .changed signal is emitted when
+        control returns to the event loop, unless .flush_refresh() is called first; otherwise it is emitted
+        before .refresh() returns, along with any deferred refreshes still pending (see class documentation).
         """
+        if defer is None:
+            defer = self.COALESCE_REFRESHES
+        self.generation += 1
+        self.refresh_count += 1
+        if self._refresh_pending:
+            self.coalesced_refresh_count += 1
+            self._pending_region = _union(self._pending_region, changed_region)
+            if not defer:
+                self.flush_refresh()
+            return
+        self._refresh_pending = True
+        self._pending_region = changed_region
+        if defer and Qt.QCoreApplication.instance() is not None:
+            Qt.QTimer.singleShot(0, self.flush_refresh)
+        else:
+            self.flush_refresh()
+
+    def flush_refresh(self):
+        """Emit .changed now for any refreshes pending since the last time it was emitted."""
+        if not self._refresh_pending:
+            return
+        changed_region = self._pending_region
+        self._refresh_pending = False
+        self._pending_region = None
         self.changed.emit(changed_region)
 
     def generate_contextual_info_for_pos(self, x, y):
@@ -95,6 +184,15 @@ class Image(Qt.QObject):
     def data(self):
         return self._data
 
+def _union(region_a, region_b):
+    """Return the bounding rectangle of two (x, y, w, h) regions, where None is the whole image."""
+    if region_a is None or region_b is None:
+        return None
+    xa, ya, wa, ha = region_a
+    xb, yb, wb, hb = region_b
+    x, y = min(xa, xb), min(ya, yb)
+    return x, y, max(xa + wa, xb + wb) - x, max(ya + ha, yb + hb) - y
+
 def array_from_qimage(qimage):
     if qimage.isNull() or qimage.format() != Qt.QImage.Format_Invalid:
         return
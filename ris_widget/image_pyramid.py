@@ -0,0 +1,160 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import concurrent.futures as futures
+import math
+import multiprocessing
+import threading
+
+import numpy
+from PyQt5 import Qt
+
+from . import image
+
+_THREAD_POOL = None
+def _thread_pool():
+    global _THREAD_POOL
+    if _THREAD_POOL is None:
+        _THREAD_POOL = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+    return _THREAD_POOL
+
+class PyramidImage(image.Image):
+    """An Image too large to display as a single texture, such as a stitched mosaic (which may be
+    memory-mapped with mapped_image.map_image_file to avoid reading it all into memory).
+
+    PyramidImages are displayed from a multiresolution pyramid: .levels[0] is .data, and each following
+    level is downsampled two-fold (by averaging 2x2 blocks of pixels) from the previous, down to a level
+    that fits in a single tile of TILE_SIZE x TILE_SIZE pixels. The levels are built in background threads,
+    and .levels_changed is emitted as each is completed. Until a level is built, the coarsest level
+    available is displayed. Each level is divided into tiles, which are uploaded to the GPU only as they
+    come into view at the current zoom (see async_texture.TiledTexture).
+
+    .overview is an Image of the coarsest level, or until that is built, of an evenly-spaced sample of
+    the pixels of .data. Histograms are calculated from a similar sample of at most HISTOGRAM_MAX_PIXELS
+    pixels (see histogram_sample()).
+
+    After modifying .data, call .refresh() as usual: the pyramid is rebuilt (once for each batch of coalesced
+    refreshes).
+    """
+    TILE_SIZE = 1024
+    HISTOGRAM_MAX_PIXELS = 2**22
+    # Each level is downsampled in bands of about this many pixels, spread across threads
+    BAND_PIXELS = 2**22
+
+    levels_changed = Qt.pyqtSignal()
+
+    def __init__(self, data, image_bits=None, name=None, parent=None):
+        super().__init__(data, image_bits, name, parent)
+        sx, sy = self.data.shape[:2]
+        self.level_count = 1 + max(0, math.ceil(math.log2(max(sx, sy) / self.TILE_SIZE)))
+        self._build_lock = threading.Lock()
+        self._build_id = 0
+        self._build()
+
+    def flush_refresh(self):
+        if self._refresh_pending:
+            self._build()
+        super().flush_refresh()
+
+    def _build(self):
+        with self._build_lock:
+            self._build_id += 1
+            build_id = self._build_id
+        self.levels = levels = [self.data]
+        step = 2**(self.level_count - 1)
+        self.overview = image.Image(self._copy_in_layout(self.data[::step, ::step]), self.image_bits)
+        if self.level_count > 1:
+            threading.Thread(target=self._build_levels, args=(levels, build_id), daemon=True).start()
+
+    def _build_levels(self, levels, build_id):
+        for level in range(1, self.level_count):
+            src = levels[level-1]
+            dst = self._empty_in_layout(((src.shape[0] + 1) // 2, (src.shape[1] + 1) // 2) + src.shape[2:], src.dtype)
+            rows = max(1, self.BAND_PIXELS // dst.shape[0])
+            bands = [(y, min(y + rows, dst.shape[1])) for y in range(0, dst.shape[1], rows)]
+            list(_thread_pool().map(lambda band: _downsample(src, dst, *band), bands))
+            with self._build_lock:
+                if build_id != self._build_id:
+                    # superseded by a refresh()
+                    return
+                levels.append(dst)
+                if level == self.level_count - 1:
+                    self.overview = image.Image(dst, self.image_bits)
+            self.levels_changed.emit()
+
+    def _empty_in_layout(self, shape, dtype):
+        # allocate levels with pixels contiguous along the same axis as in .data, so that all tiles
+        # are uploaded to textures in the same orientation (see Image.transposed)
+        if self.transposed:
+            return numpy.empty(shape, dtype=dtype)
+        return numpy.empty((shape[1], shape[0]) + shape[2:], dtype=dtype).swapaxes(0, 1)
+
+    def _copy_in_layout(self, array):
+        copy = self._empty_in_layout(array.shape, array.dtype)
+        copy[:] = array
+        return copy
+
+    def level_for_scale(self, scale):
+        """Return the index of the coarsest level with at least one pixel per screen pixel, given the scale
+        in pixels of .data per screen pixel, or None if that level is not yet built."""
+        level = min(max(0, int(math.floor(math.log2(scale)))) if scale > 0 else 0, self.level_count - 1)
+        return level if level < len(self.levels) else None
+
+    def tile_grid(self, level):
+        """Return the number of (columns, rows) of tiles in the given level."""
+        sx, sy = self.levels[level].shape[:2]
+        return math.ceil(sx / self.TILE_SIZE), math.ceil(sy / self.TILE_SIZE)
+
+    def tile_data(self, level, tx, ty):
+        """Return a view of the pixels of tile (tx, ty) of the given level."""
+        t = self.TILE_SIZE
+        return self.levels[level][tx*t:(tx+1)*t, ty*t:(ty+1)*t]
+
+    def tile_image(self, level, tx, ty):
+        """Return an Image of tile (tx, ty) of the given level, without copying its pixels."""
+        return image.Image(self.tile_data(level, tx, ty), self.image_bits)
+
+    def tile_rect(self, level, tx, ty):
+        """Return the (x, y, w, h) rectangle covered by tile (tx, ty) of the given level, in pixels of .data.
+        Tiles at the edge of a downsampled level may extend up to 2**level - 1 pixels past the edge of .data."""
+        scale = 2**level
+        w, h = self.tile_data(level, tx, ty).shape[:2]
+        return tx*self.TILE_SIZE*scale, ty*self.TILE_SIZE*scale, w*scale, h*scale
+
+    def histogram_sample(self, mask_geometry=None):
+        """Return an evenly-spaced sample of the pixels of .data, of at most HISTOGRAM_MAX_PIXELS pixels,
+        and the given histogram mask geometry scaled to match (see histogram.mask_spans)."""
+        sx, sy = self.data.shape[:2]
+        step = max(1, math.ceil(math.sqrt(sx * sy / self.HISTOGRAM_MAX_PIXELS)))
+        if step == 1:
+            return self.data, mask_geometry
+        if mask_geometry is not None:
+            if isinstance(mask_geometry, numpy.ndarray):
+                mask_geometry = mask_geometry[::step, ::step]
+            elif len(mask_geometry) != 3: # circles are given as fractions of the image shape: no scaling needed
+                kind, points = mask_geometry
+                mask_geometry = kind, [(x / step, y / step) for x, y in points]
+        return self.data[::step, ::step], mask_geometry
+
+def _downsample(src, dst, y0, y1):
+    """Fill rows [y0, y1) of dst with the means of the corresponding 2x2 blocks of src (repeating the last row
+    or column of src if it has an odd number)."""
+    block = src[:, 2*y0:2*y1]
+    pad = [(0, block.shape[0] % 2), (0, block.shape[1] % 2)] + [(0, 0)] * (block.ndim - 2)
+    if pad[0][1] or pad[1][1]:
+        block = numpy.pad(block, pad, mode='edge')
+    if src.dtype == numpy.float32:
+        acc_dtype = numpy.float32
+    else:
+        acc_dtype = numpy.uint32
+    acc = block[0::2, 0::2].astype(acc_dtype)
+    acc += block[1::2, 0::2]
+    acc += block[0::2, 1::2]
+    acc += block[1::2, 1::2]
+    if src.dtype == numpy.float32:
+        acc *= 0.25
+    elif src.dtype == bool:
+        acc = acc >= 2
+    else:
+        acc += 2
+        acc //= 4
+    dst[:, y0:y1] = acc
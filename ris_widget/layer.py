@@ -1,13 +1,21 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
 from PyQt5 import Qt
+import multiprocessing
 import warnings
 import numpy
 
 from . import image
+from . import image_pyramid
 from . import histogram
 from . import qt_property
 from . import async_texture
+from . import async_histogram
+
+try:
+    import matplotlib
+except ModuleNotFoundError:
+    matplotlib = None
 
 SHADER_PROP_HELP = """The GLSL fragment shader used to render an image within a layer stack is created
 by filling in the $-values from the following template (somewhat simplified) with the corresponding
@@ -52,6 +60,9 @@ _DEBUG_NO_HIST = False
 def coerce_to_str(v):
     return '' if v is None else str(v)
 
+def coerce_to_optional_int(v):
+    return None if v is None else int(v)
+
 def coerce_to_tint(v):
     v = tuple(map(float, v))
     if len(v) not in (3,4) or not all(map(lambda v_: 0 <= v_ <= 1, v)):
@@ -60,18 +71,61 @@ def coerce_to_tint(v):
         v += (1.0,)
     return v
 
+def coerce_to_colormap(v):
+    if v is None:
+        return None
+    if isinstance(v, str):
+        named_colormap(v) # fail now, rather than when drawn, if v is not a known colormap
+        return v
+    v = numpy.array(v, dtype=numpy.float32)
+    if v.ndim != 2 or v.shape[0] < 2 or v.shape[1] not in (3,4) or not ((v >= 0) & (v <= 1)).all():
+        raise ValueError('The value assigned to colormap must be None, the name of a matplotlib colormap, or an (N, 3) or (N, 4) '
+            'array of RGB(A) values in the interval [0, 1], with N >= 2.')
+    if v.shape[1] == 3:
+        v = numpy.concatenate((v, numpy.ones((len(v), 1), dtype=numpy.float32)), axis=1)
+    return v
+
+def named_colormap(name, n=256):
+    """Return the (n, 4) RGBA table of the named matplotlib colormap (e.g. 'viridis'). Raises RuntimeError
+    if matplotlib, an optional dependency, is not installed."""
+    if matplotlib is None:
+        raise RuntimeError('Could not import matplotlib module for named colormaps (matplotlib is an optional dependency): '
+            'install it, or assign an (N, 3) or (N, 4) array of RGB(A) values to colormap instead.')
+    try:
+        if hasattr(matplotlib, 'colormaps'):
+            colormap = matplotlib.colormaps[name]
+        else:
+            # matplotlib < 3.5
+            from matplotlib import cm
+            colormap = cm.get_cmap(name)
+    except (KeyError, ValueError):
+        raise ValueError('Unknown colormap name {!r}.'.format(name))
+    return colormap(numpy.linspace(0, 1, n)).astype(numpy.float32)
+
+def coerce_to_percentiles(v):
+    v = tuple(map(float, v))
+    if len(v) != 2 or not 0 <= v[0] < v[1] <= 100:
+        raise ValueError('The iterable assigned to auto_min_max_percentiles must represent two increasing real numbers in the interval [0, 100].')
+    return v
+
 class Layer(qt_property.QtPropertyOwner):
     """ The class Layer contains properties that control Image presentation.
 
     Properties:
         visible
+        mipmaps
         histogram_mask
         auto_min_max
+        auto_min_max_percentiles
+        auto_min_max_smoothing
         min
         max
         gamma
+        colormap
         histogram_min
         histogram_max
+        histogram_bins
+        histogram_log_bins
         getcolor_expression
         tint
         transform_section
@@ -81,9 +135,46 @@ class Layer(qt_property.QtPropertyOwner):
     The 'changed' signal is emitted when any property impacting image presentation
     is modified or image data is explicitly changed or refreshed. Each specific
     property also has its own changed signal, such as 'min_changed' &c.
+
+    The 'histogram_changed' signal is emitted when the histogram, image_min, and
+    image_max attributes have been updated, which may be after the image has changed:
+    see HISTOGRAM_ASYNC.
     """
 
     GAMMA_RANGE = (0.0625, 16.0)
+    # Histograms of images with at least HISTOGRAM_PARALLEL_PIXELS pixels are computed in bands
+    # of rows spread across HISTOGRAM_WORKERS threads; smaller images are done on one thread.
+    HISTOGRAM_PARALLEL_PIXELS = 2**20
+    HISTOGRAM_WORKERS = multiprocessing.cpu_count()
+    # If True (on the class or an instance), histograms of greyscale float32 images are computed in a single
+    # pass over the image where possible (see histogram.float_histogram). When histogram_min or histogram_max
+    # is unset, the histogram is then approximate: values within an eighth of a bin width of a bin edge may be
+    # counted in the adjacent bin. By default, float histograms are exact.
+    HISTOGRAM_FLOAT_SINGLE_PASS = False
+    # If True, histograms are computed on a background thread when an image changes, and histogram_changed
+    # is emitted when they are ready (only the newest image's histogram is ever delivered). The histogram of
+    # the first image of a given dtype and valid range is always computed synchronously, so that histogram,
+    # image_min, and image_max are always available. Set to False (on the class or an instance) for
+    # scripts that need the histogram of an image as soon as it is assigned.
+    HISTOGRAM_ASYNC = True
+    # Histograms are cached by image contents (see Image.generation) and histogram parameters, so that
+    # returning to an unchanged image (e.g. when flipping through flipbook pages) does not recompute its
+    # histogram. The cache is shared by all layers; set to None (on the class or an instance) to disable.
+    HISTOGRAM_CACHE = histogram.HistogramCache()
+    # When a layer's image is replaced, the texture holding the old image is kept in this cache (shared by all
+    # layers), so that a layer showing that image again (e.g. when flipping back to a flipbook page) draws it
+    # without uploading it. Set to None (on the class or an instance) to disable.
+    TEXTURE_CACHE = async_texture.ImageTextureCache()
+    # When auto_min_max_smoothing is nonzero, auto min/max updates for new histograms of a changing image
+    # that would move neither min nor max by more than this fraction of (max - min) are skipped, so that
+    # the display range does not flicker as a live image stream fluctuates.
+    AUTO_MIN_MAX_HYSTERESIS = 0.01
+    # If True (on the class or an instance), the gamma and tint of a layer with the default transform_section
+    # are applied by sampling a 1D lookup table texture of LUT_SIZE entries, rebuilt only when they change, rather
+    # than computed for every pixel. Layers with a colormap always use a lookup table. Each layer drawn through a
+    # lookup table uses an additional texture unit.
+    USE_LUT = False
+    LUT_SIZE = 4096
     IMAGE_TYPE_TO_GETCOLOR_EXPRESSION = {
         'G': 'vec4(s.rrr, 1.0f)',
         'Ga': 'vec4(s.rrr, s.g)',
@@ -125,6 +216,9 @@ class Layer(qt_property.QtPropertyOwner):
     #
     changed = Qt.pyqtSignal(object)
     image_changed = Qt.pyqtSignal(object)
+    # NB: .histogram_changed is emitted when a newly computed histogram, image_min, and image_max have been set,
+    # which (with HISTOGRAM_ASYNC) may be some time after the corresponding .image_changed
+    histogram_changed = Qt.pyqtSignal(object)
     opacity_changed = Qt.pyqtSignal(object)
     # below properties are necessary for proper updating of LayerStack table view when images change
     dtype_changed = Qt.pyqtSignal(object)
@@ -138,6 +232,12 @@ class Layer(qt_property.QtPropertyOwner):
         super().__init__(parent)
         self.image_changed.connect(self.changed)
         self.texture = async_texture.AsyncTexture()
+        self._async_histogram = async_histogram.AsyncHistogram()
+        self._async_histogram.ready.connect(self._on_histogram_ready)
+        self._histogram_image_kind = None
+        self._histogram_cache_key = None # key under which to cache the histogram being computed
+        self._auto_min_max_smoothed = None # (min, max) from the last auto min/max, before hysteresis
+        self._lut = None # ((gamma, tint), lookup table) (see lookup_table())
         # need to be set already for self.image setter to work propery
         self.dtype = None
         self.type = None
@@ -177,11 +277,17 @@ class Layer(qt_property.QtPropertyOwner):
             if not isinstance(new_image, image.Image):
                 new_image = image.Image(new_image)
             new_image.changed.connect(self._on_image_changed)
+            if isinstance(new_image, image_pyramid.PyramidImage):
+                # newly-built pyramid levels allow finer tiles to be drawn at the current zoom
+                new_image.levels_changed.connect(self._on_levels_changed)
 
         if self._image is not None:
             # deallocate old texture when we're done with it.
             self._image.changed.disconnect(self._on_image_changed)
+            if isinstance(self._image, image_pyramid.PyramidImage):
+                self._image.levels_changed.disconnect(self._on_levels_changed)
 
+        self._use_cached_texture(self._image, new_image)
         self._image = new_image
 
         if new_image is None:
@@ -207,30 +313,140 @@ class Layer(qt_property.QtPropertyOwner):
     def _on_image_changed(self, changed_region=None):
         if self.image is not None:
             # upload texture before calculating the histogram, so that the background texture upload (slow) runs in
-            # parallel with the foreground histogram calculation (slow)
+            # parallel with the histogram calculation (slow)
+            self._use_texture_type(async_texture.TiledTexture if isinstance(self.image, image_pyramid.PyramidImage) else async_texture.AsyncTexture)
             self.texture.upload(self.image, changed_region)
-            self.calculate_histogram()
+            self._update_histogram(changed_region)
+        else:
+            self._async_histogram.cancel()
+            self._histogram_cache_key = None
+            self._auto_min_max_smoothed = None
         self._update_property_defaults()
-        if self.image is not None:
-            if self.auto_min_max:
-                self.do_auto_min_max()
-            else:
-                l, h = self.image.valid_range
-                if self.min < l:
-                    self.min = l
-                if self.max > h:
-                    self.max = h
+        if self.image is not None and not self.auto_min_max:
+            l, h = self.image.valid_range
+            if self.min < l:
+                self.min = l
+            if self.max > h:
+                self.max = h
         self.image_changed.emit(self)
 
-    def calculate_histogram(self):
+    def _on_levels_changed(self):
+        self.changed.emit(self)
+
+    def _use_texture_type(self, texture_type):
+        if type(self.texture) is texture_type:
+            return
+        old_texture = self.texture
+        self.texture = texture_type()
+        self._destroy_texture(old_texture)
+
+    def _use_cached_texture(self, old_image, new_image):
+        """Cache the texture holding old_image (if its upload is complete), and if new_image is cached, draw its
+        texture rather than uploading it again. Otherwise, the new image is uploaded to the current texture, which
+        continues to draw the old image until then."""
+        cache = self.TEXTURE_CACHE
+        if cache is None or not async_texture.USE_BG_UPLOAD_THREAD or type(self.texture) is not async_texture.AsyncTexture:
+            return
+        if old_image is not None:
+            old_texture = self.texture.take_front(old_image)
+            if old_texture is not None:
+                cache.put(old_image, old_texture)
+        if new_image is not None and not isinstance(new_image, image_pyramid.PyramidImage):
+            cached_texture = cache.take(new_image)
+            if cached_texture is not None:
+                old_texture = self.texture
+                self.texture = cached_texture
+                self._destroy_texture(old_texture)
+
+    @staticmethod
+    def _destroy_texture(texture):
+        if async_texture.USE_BG_UPLOAD_THREAD:
+            # no GL context need be current here, so delete the old texture(s) from the upload threads' contexts,
+            # after any uploads already queued and the frames already drawn from them
+            texture.destroy_after_uploads()
+
+    def _image_kind(self):
+        return self.image.data.dtype, self.image.type, self.image.valid_range
+
+    def _update_histogram(self, changed_region=None):
+        # Only compute in the background if the current histogram is of an image of the same kind: otherwise
+        # the old histogram, image_min, and image_max may not even be valid for the new image.
+        if _DEBUG_NO_HIST or not self.HISTOGRAM_ASYNC or self._image_kind() != self._histogram_image_kind:
+            self.calculate_histogram(changed_region)
+        else:
+            key = self._histogram_key()
+            if not self._use_cached_histogram(key):
+                self._histogram_cache_key = key
+                self._async_histogram.submit(*self._histogram_args(changed_region))
+
+    def _histogram_key(self):
+        if self.HISTOGRAM_CACHE is None:
+            return None
         r_min = None if self._is_default('histogram_min') else self.histogram_min
         r_max = None if self._is_default('histogram_max') else self.histogram_max
+        return (self.image.serial, self.image.generation, r_min, r_max, self.image.image_bits,
+            histogram.cache.hashable(self.histogram_mask), self.HISTOGRAM_FLOAT_SINGLE_PASS, self.histogram_bins,
+            self.histogram_log_bins)
+
+    def _use_cached_histogram(self, key):
+        result = None if key is None else self.HISTOGRAM_CACHE.get(key)
+        if result is None:
+            return False
+        # the tiled histogram now holds tiles of some other image, so the next update must be a full one
+        self._async_histogram.invalidate()
+        self._histogram_cache_key = None
+        self._on_histogram_ready(result)
+        return True
+
+    def _histogram_args(self, changed_region):
+        r_min = None if self._is_default('histogram_min') else self.histogram_min
+        r_max = None if self._is_default('histogram_max') else self.histogram_max
+        data = self.image.data
+        mask = self.histogram_mask
+        if isinstance(self.image, image_pyramid.PyramidImage):
+            # histogram a sample of the pixels, rather than reading all of a (perhaps memory-mapped) huge image
+            data, mask = self.image.histogram_sample(mask)
+            changed_region = None
+        n_workers = self.HISTOGRAM_WORKERS if data.shape[0] * data.shape[1] >= self.HISTOGRAM_PARALLEL_PIXELS else 1
+        n_bins = self.histogram_bins
+        return (data, (r_min, r_max), self.image.image_bits, mask, changed_region, n_workers,
+            self.HISTOGRAM_FLOAT_SINGLE_PASS, n_bins, self.histogram_log_bins)
+
+    def calculate_histogram(self, changed_region=None):
+        """Recompute the histogram, image_min, and image_max of the current image synchronously,
+        superseding any histogram being computed in the background. For RGB(A) images, histogram
+        is of the luminance, and channel_histograms (otherwise None) holds the red, green, and
+        blue histograms as rows of a (3, len(histogram)) array. If changed_region (x, y, w, h)
+        is specified, only the histogram tiles touched by that region of the image are recomputed.
+        If the histogram of the image's current contents is in HISTOGRAM_CACHE, it is used instead."""
         if not _DEBUG_NO_HIST:
-            self.image_min, self.image_max, self.histogram = histogram.histogram(
-                self.image.data, (r_min, r_max), self.image.image_bits, self.histogram_mask)
+            key = self._histogram_key()
+            if self._use_cached_histogram(key):
+                return
+            self._histogram_cache_key = key
+            result = self._async_histogram.compute(*self._histogram_args(changed_region))
         else:
-            self.image_min, self.image_max = r_min, r_max
-            self.histogram = numpy.zeros(256, dtype=numpy.uint32)
+            r_min = None if self._is_default('histogram_min') else self.histogram_min
+            r_max = None if self._is_default('histogram_max') else self.histogram_max
+            result = r_min, r_max, numpy.zeros(256, dtype=numpy.uint32), None
+        self._on_histogram_ready(result)
+
+    def _on_histogram_ready(self, result):
+        if self.image is None:
+            return
+        if self._histogram_cache_key is not None:
+            if self.HISTOGRAM_CACHE is not None:
+                self.HISTOGRAM_CACHE.put(self._histogram_cache_key, result)
+            self._histogram_cache_key = None
+        self.image_min, self.image_max, self.histogram, self.channel_histograms = result
+        if self._image_kind() != self._histogram_image_kind:
+            self._auto_min_max_smoothed = None
+        self._histogram_image_kind = self._image_kind()
+        self._update_property_defaults()
+        if self.auto_min_max and not numpy.isnan(self.image_min):
+            # (image_min and image_max are NaN if there are no pixels within the histogram mask)
+            self._update_auto_min_max()
+        self.histogram_changed.emit(self)
 
     def generate_contextual_info_for_pos(self, x, y, idx=None):
         if self.image is None:
@@ -244,11 +460,44 @@ class Layer(qt_property.QtPropertyOwner):
         return image_text
 
     def do_auto_min_max(self):
+        """Set min and max to the auto_min_max_percentiles of the current histogram (without smoothing)."""
         assert self.image is not None
+        self._set_auto_min_max(*self._auto_min_max_range())
+
+    def _auto_min_max_range(self):
+        low = max(self.image_min, self.histogram_min)
+        high = min(self.image_max, self.histogram_max)
+        p_low, p_high = self.auto_min_max_percentiles
+        if p_low > 0 or p_high < 100:
+            log_bins = self.histogram_log_bins and self.dtype == numpy.float32
+            percentiles = histogram.percentile_range(self.histogram, (self.histogram_min, self.histogram_max),
+                (p_low, p_high), log_bins)
+            if percentiles is not None:
+                low = min(max(low, percentiles[0]), high)
+                high = max(min(high, percentiles[1]), low)
+        return low, high
+
+    def _update_auto_min_max(self):
+        # auto min/max for a new histogram of the image: smoothed over time and subject to AUTO_MIN_MAX_HYSTERESIS
+        low, high = self._auto_min_max_range()
+        smoothing = self.auto_min_max_smoothing
+        if smoothing == 0 or self._auto_min_max_smoothed is None:
+            self._set_auto_min_max(low, high)
+            return
+        old_low, old_high = self._auto_min_max_smoothed
+        low = smoothing * old_low + (1 - smoothing) * low
+        high = smoothing * old_high + (1 - smoothing) * high
+        self._auto_min_max_smoothed = low, high
+        tolerance = self.AUTO_MIN_MAX_HYSTERESIS * (self.max - self.min)
+        if abs(low - self.min) > tolerance or abs(high - self.max) > tolerance:
+            self._set_auto_min_max(low, high)
+
+    def _set_auto_min_max(self, low, high):
+        self._auto_min_max_smoothed = low, high
         self._retain_auto_min_max_on_min_max_change = True
         try:
-            self.min = max(self.image_min, self.histogram_min)
-            self.max = min(self.image_max, self.histogram_max)
+            self.min = low
+            self.max = high
         finally:
             self._retain_auto_min_max_on_min_max_change = False
 
@@ -256,12 +505,22 @@ class Layer(qt_property.QtPropertyOwner):
         default_value=True,
         coerce_arg_fn=bool)
 
+    mipmaps = qt_property.Property(
+        default_value=True,
+        coerce_arg_fn=bool,
+        doc='Whether the image is drawn from mipmaps (averaged half-, quarter-, ... size copies) when zoomed out, '
+            'so that it is smoothly downsampled rather than aliased. The mipmaps are generated on the GPU at the '
+            'first such paint after the image changes, which may be costly for large, rapidly-changing images.')
+
     def _histogram_mask_post_set(self, v):
         self._on_image_changed()
 
     histogram_mask = qt_property.Property(
         default_value=None,
-        post_set_callback=_histogram_mask_post_set)
+        post_set_callback=_histogram_mask_post_set,
+        doc='Region of the image to which the histogram (and so auto min/max) is restricted: None for the whole image, '
+            '(cx, cy, r) for a vignette as fractions of the image shape, the .histogram_mask of a RectROI, EllipseROI, '
+            'or Polyline overlay, or a boolean array of the image shape. See histogram.mask_spans for details.')
 
     def _auto_min_max_post_set(self, v):
         if v and self.image is not None:
@@ -272,6 +531,32 @@ class Layer(qt_property.QtPropertyOwner):
         coerce_arg_fn=bool,
         post_set_callback=_auto_min_max_post_set)
 
+    def _auto_min_max_percentiles_post_set(self, v):
+        if self.image is not None and self.auto_min_max:
+            self.do_auto_min_max()
+
+    auto_min_max_percentiles = qt_property.Property(
+        default_value=(0.0, 100.0),
+        coerce_arg_fn=coerce_to_percentiles,
+        post_set_callback=_auto_min_max_percentiles_post_set,
+        doc='The (low, high) percentiles of the histogram to which auto min/max sets min and max. The default, (0, 100), '
+            'uses the image min and max; clipping a few pixels, e.g. with (0.1, 99.9), keeps a hot pixel from '
+            'setting the display range. Percentiles are computed from the histogram, so are only as precise as its bins.')
+
+    def _auto_min_max_smoothing_pre_set(self, v):
+        if not 0 <= v < 1:
+            warnings.warn('auto_min_max_smoothing must be in the interval [0, 1).')
+            return False
+
+    auto_min_max_smoothing = qt_property.Property(
+        default_value=0.0,
+        coerce_arg_fn=float,
+        pre_set_callback=_auto_min_max_smoothing_pre_set,
+        doc='Weight given to the previous auto min/max values when the image changes: each new histogram moves min and '
+            'max only (1 - auto_min_max_smoothing) of the way to its percentiles, and then only if they would move by '
+            'more than Layer.AUTO_MIN_MAX_HYSTERESIS. Use e.g. 0.8 to keep the display range of a live stream from '
+            'flickering. 0 (the default) disables smoothing.')
+
     def _min_default(self):
         if self.image is None:
             return 0.0
@@ -326,11 +611,47 @@ class Layer(qt_property.QtPropertyOwner):
         coerce_arg_fn=float,
         pre_set_callback=_gamma_pre_set)
 
+    def _colormap_post_set(self, v):
+        self._lut = None
+
+    colormap = qt_property.Property(
+        default_value=None,
+        coerce_arg_fn=coerce_to_colormap,
+        post_set_callback=_colormap_post_set,
+        doc='None, or the name of a matplotlib colormap (e.g. \'viridis\'; requires matplotlib) or an (N, 3) or (N, 4) array of RGB(A) values in '
+            '[0, 1], to which [min, max] (after gamma) is mapped, and which is then scaled by tint. Each channel of an RGB(A) '
+            'image is mapped through the corresponding channel. Requires the default transform_section. See USE_LUT.')
+
+    def uses_lut(self):
+        """Whether the layer is drawn through its lookup_table() (see USE_LUT)."""
+        return (self.USE_LUT or self.colormap is not None) and self.transform_section == self.DEFAULT_TRANSFORM_SECTION
+
+    def lookup_table(self):
+        """Return the (LUT_SIZE, 4) float32 RGBA table to which values in [min, max], rescaled to [0, 1], are
+        mapped: the colormap (or grey ramp) sampled at the rescaled values raised to gamma, times tint. The same
+        array is returned until gamma, tint, or colormap change."""
+        key = self.gamma, self.tint
+        if self._lut is None or self._lut[0] != key:
+            levels = numpy.linspace(0, 1, self.LUT_SIZE) ** self.gamma
+            colormap = self.colormap
+            if colormap is None:
+                table = numpy.empty((self.LUT_SIZE, 4), dtype=numpy.float32)
+                table[:, :3] = levels[:, numpy.newaxis]
+                table[:, 3] = 1
+            else:
+                if isinstance(colormap, str):
+                    colormap = named_colormap(colormap)
+                positions = numpy.linspace(0, 1, len(colormap))
+                table = numpy.stack([numpy.interp(levels, positions, channel) for channel in colormap.T], axis=1).astype(numpy.float32)
+            table *= numpy.array(self.tint, dtype=numpy.float32)
+            self._lut = key, table
+        return self._lut[1]
+
     def _histogram_min_default(self):
         if self.image is None:
             return 0.0
         elif self.dtype == numpy.float32:
-            return self.image_min
+            return 0.0 if numpy.isnan(self.image_min) else self.image_min
         else:
             return float(self.image.valid_range[0])
 
@@ -338,7 +659,7 @@ class Layer(qt_property.QtPropertyOwner):
         if self.image is None:
             return 65535.0
         elif self.dtype == numpy.float32:
-            return self.image_max
+            return 1.0 if numpy.isnan(self.image_max) else self.image_max
         else:
             return float(self.image.valid_range[1])
 
@@ -362,7 +683,7 @@ class Layer(qt_property.QtPropertyOwner):
 
     def _histogram_min_max_post_set(self, v):
         if self.image is not None:
-            self.calculate_histogram()
+            self._update_histogram()
         self._retain_auto_min_max_on_min_max_change = True
         try:
             if self.min < self.histogram_min:
@@ -386,6 +707,31 @@ class Layer(qt_property.QtPropertyOwner):
         pre_set_callback=_histogram_max_pre_set,
         post_set_callback=_histogram_min_max_post_set)
 
+    def _histogram_bins_pre_set(self, v):
+        if v is not None and not 1 <= v <= histogram.MAX_BINS:
+            warnings.warn('histogram_bins must be in [1, {}].'.format(histogram.MAX_BINS))
+            return False
+
+    def _histogram_binning_post_set(self, v):
+        if self.image is not None:
+            self._update_histogram()
+
+    histogram_bins = qt_property.Property(
+        default_value=None,
+        coerce_arg_fn=coerce_to_optional_int,
+        pre_set_callback=_histogram_bins_pre_set,
+        post_set_callback=_histogram_binning_post_set,
+        doc='Number of histogram bins, or None (the default) for 256 for uint8 images (or one bin per value '
+            'if histogram_min or histogram_max is set) and 1024 otherwise. Power-of-two bin counts are fastest for uint16 '
+            'images, and 65536 gives one bin per value. See histogram.histogram().')
+
+    histogram_log_bins = qt_property.Property(
+        default_value=False,
+        coerce_arg_fn=bool,
+        post_set_callback=_histogram_binning_post_set,
+        doc='If True, the histogram bins of float32 images are evenly spaced in log(value) between histogram_min '
+            '(or a positive lower bound; see histogram.log_bin_range()) and histogram_max.')
+
     def _getcolor_expression_default(self):
         image = self.image
         if image is None:
@@ -158,6 +158,7 @@ class LayerStack(Qt.QObject):
 
     @histogram_mask.setter
     def histogram_mask(self, r):
+        self._histogram_mask = r
         for layer in self.layers:
             layer.histogram_mask = r
 
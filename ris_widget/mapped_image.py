@@ -0,0 +1,102 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import pathlib
+import struct
+
+import numpy
+
+TIFF_SUFFIXES = {'.tif', '.tiff'}
+RAW_SUFFIXES = {'.raw', '.bin', '.dat'}
+
+_TIFF_TYPE_FORMATS = {3: 'H', 4: 'I'} # SHORT, LONG
+_TIFF_SAMPLE_FORMATS = {1: 'u', 3: 'f'} # unsigned integer, IEEE float
+
+def map_image_file(path, shape=None, dtype=None, offset=0):
+    """Memory-map an image file copy-on-write as a numpy array of shape (x, y) or (x, y, c), suitable for
+    wrapping in an Image without copying. Only the pages of the file that are actually read (e.g. to upload
+    a texture or compute a histogram) are loaded into memory, so image series larger than physical memory
+    can be browsed. The array may be written to (e.g. by the painter), but the changes are made only to
+    private copies of the pages written, and never to the file.
+
+    Supported files are:
+        .npy files, mapped as they were saved (i.e. the array's shape is taken to be (x, y)).
+        Uncompressed, little-endian TIFF files with contiguous strips of 8- or 16-bit unsigned or 32-bit
+            float samples, and one or more interleaved samples per pixel. Only the first image of a
+            multi-page file is mapped.
+        Raw files of pixel data (with a suffix in RAW_SUFFIXES), for which shape (x, y) or (x, y, c) and
+            dtype must be given, and offset is the size in bytes of any header. The pixels are assumed to
+            be stored in rows along x, as written by most cameras.
+
+    Raises ValueError if the file cannot be memory-mapped (e.g. a compressed TIFF or a PNG).
+    """
+    path = pathlib.Path(path)
+    suffix = path.suffix.lower()
+    if suffix == '.npy':
+        return numpy.load(str(path), mmap_mode='c')
+    if suffix in TIFF_SUFFIXES:
+        shape, dtype, offset = _tiff_layout(path)
+    elif suffix not in RAW_SUFFIXES:
+        raise ValueError('Image file "{}" is not of a type that can be memory-mapped.'.format(path))
+    elif shape is None or dtype is None:
+        raise ValueError('The shape and dtype of raw image file "{}" must be specified.'.format(path))
+    shape = tuple(shape)
+    if len(shape) not in (2, 3):
+        raise ValueError('Image shape must be (x, y) or (x, y, c).')
+    # the file holds rows of pixels along x, i.e. a C-ordered (y, x[, c]) array
+    file_shape = (shape[1], shape[0]) + shape[2:]
+    return numpy.memmap(str(path), dtype=dtype, mode='c', offset=offset, shape=file_shape).swapaxes(0, 1)
+
+def _tiff_layout(path):
+    """Return the (x, y[, c]) shape, dtype, and data offset of the first image of an uncompressed TIFF file."""
+    with path.open('rb') as f:
+        header = f.read(8)
+        if header[:4] != b'II*\0':
+            raise ValueError('"{}" is not a little-endian TIFF file.'.format(path))
+        ifd_offset, = struct.unpack('<I', header[4:])
+        f.seek(ifd_offset)
+        entry_count, = struct.unpack('<H', f.read(2))
+        tags = {}
+        for _ in range(entry_count):
+            tag, tag_type, count, value = struct.unpack('<HHI4s', f.read(12))
+            if tag_type not in _TIFF_TYPE_FORMATS:
+                continue
+            fmt = '<{}{}'.format(count, _TIFF_TYPE_FORMATS[tag_type])
+            size = struct.calcsize(fmt)
+            if size > 4:
+                value_offset, = struct.unpack('<I', value)
+                position = f.tell()
+                f.seek(value_offset)
+                value = f.read(size)
+                f.seek(position)
+            tags[tag] = struct.unpack(fmt, value[:size])
+
+    def tag_value(tag, default=None):
+        value = tags.get(tag, default)
+        if value is None:
+            raise ValueError('TIFF file "{}" lacks required tag {}.'.format(path, tag))
+        return value
+
+    width, = tag_value(256)
+    height, = tag_value(257)
+    samples, = tag_value(277, (1,))
+    bits = tag_value(258, (1,) * samples)
+    sample_format = tag_value(339, (1,) * samples)
+    rows_per_strip, = tag_value(278, (height,))
+    if tag_value(259, (1,)) != (1,):
+        raise ValueError('TIFF file "{}" is compressed.'.format(path))
+    if 322 in tags:
+        raise ValueError('TIFF file "{}" is tiled.'.format(path))
+    if samples > 1 and tag_value(284, (1,)) != (1,):
+        raise ValueError('TIFF file "{}" has separate sample planes.'.format(path))
+    dtype = None
+    if len(set(bits)) == 1 and len(set(sample_format)) == 1 and sample_format[0] in _TIFF_SAMPLE_FORMATS and bits[0] in (8, 16, 32):
+        dtype = numpy.dtype('<{}{}'.format(_TIFF_SAMPLE_FORMATS[sample_format[0]], bits[0] // 8))
+    if dtype not in (numpy.uint8, numpy.uint16, numpy.float32):
+        raise ValueError('TIFF file "{}" has unsupported sample types.'.format(path))
+    strip_offsets = tag_value(273)
+    row_bytes = width * samples * dtype.itemsize
+    expected_offsets = [strip_offsets[0] + i * rows_per_strip * row_bytes for i in range(len(strip_offsets))]
+    if list(strip_offsets) != expected_offsets:
+        raise ValueError('TIFF file "{}" has non-contiguous strips.'.format(path))
+    shape = (width, height) if samples == 1 else (width, height, samples)
+    return shape, dtype, strip_offsets[0]
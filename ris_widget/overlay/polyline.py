@@ -36,6 +36,16 @@ class Polyline(point_set.PointSet):
         else:
             self._set_drawing(False)
 
+    @property
+    def histogram_mask(self):
+        """Mask geometry suitable for Layer.histogram_mask or LayerStack.histogram_mask, restricting
+        the histogram to the pixels within the polygon closed by the polyline, or None if
+        the polyline has fewer than three points."""
+        geometry = self.geometry
+        if geometry is None or len(geometry) < 3:
+            return None
+        return 'polygon', geometry
+
     def _generate_path(self):
         positions = []
         # filter duplicates
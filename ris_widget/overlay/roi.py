@@ -76,6 +76,15 @@ class _ROIMixin(base.RWGeometryItemMixin):
         self.setSelected(False)
         self._set_rect(geometry)
 
+    @property
+    def histogram_mask(self):
+        """Mask geometry suitable for Layer.histogram_mask or LayerStack.histogram_mask, restricting
+        the histogram to the pixels within the ROI, or None if no ROI is shown."""
+        geometry = self.geometry
+        if geometry is None:
+            return None
+        return self.HISTOGRAM_MASK_TYPE, geometry
+
     def _set_rect(self, rect):
         self.dragging = False
         if rect is None:
@@ -190,6 +199,7 @@ class _ROIMixin(base.RWGeometryItemMixin):
 
 class RectROI(_ROIMixin, Qt.QGraphicsRectItem):
     QGRAPHICSITEM_TYPE = shared_resources.generate_unique_qgraphicsitem_type()
+    HISTOGRAM_MASK_TYPE = 'rect'
 
     @property
     def slice(self):
@@ -231,6 +241,7 @@ class RoundRectROI(RectROI):
 
 class EllipseROI(_ROIMixin, Qt.QGraphicsEllipseItem):
     QGRAPHICSITEM_TYPE = shared_resources.generate_unique_qgraphicsitem_type()
+    HISTOGRAM_MASK_TYPE = 'ellipse'
 
 
 class _ResizeHandle(base.Handle):
@@ -7,11 +7,13 @@ from OpenGL import GL
 from PyQt5 import Qt
 
 from . import shader_item
+from .. import histogram
 from .. import shared_resources
 from .. import internal_util
 
 class HistogramItem(shader_item.ShaderItem):
     QGRAPHICSITEM_TYPE = shared_resources.generate_unique_qgraphicsitem_type()
+    CHANNEL_HISTOGRAM_COLORS = (Qt.QColor(255, 0, 0, 160), Qt.QColor(0, 255, 0, 160), Qt.QColor(0, 0, 255, 160))
 
     def __init__(self, layer_stack, graphics_item_parent=None):
         super().__init__(graphics_item_parent)
@@ -21,11 +23,15 @@ class HistogramItem(shader_item.ShaderItem):
         self._hist_tex_needs_upload = True
         self._bounding_rect = Qt.QRectF(0, 0, 1, 1)
         self._tex = None
+        self._max_tex_width = None
         self._gl_widget = None
         self.min_item = MinMaxItem(self, 'min')
         self.max_item = MinMaxItem(self, 'max')
         self.gamma_item = GammaItem(self, self.min_item, self.max_item)
         self.gamma_gamma = 1.0
+        # if True, the red, green, and blue histograms of RGB(A) images are drawn as curves over the luminance histogram
+        self.show_channel_histograms = True
+        self._channel_paths = None
         self.hide()
         layer_stack.layer_focus_changed.connect(self._on_layer_focus_changed)
         self._connect_layer(layer_stack.layers[0])
@@ -35,6 +41,7 @@ class HistogramItem(shader_item.ShaderItem):
         assert self.layer is old_layer
         if old_layer is not None:
             old_layer.image_changed.disconnect(self._on_layer_histogram_change)
+            old_layer.histogram_changed.disconnect(self._on_layer_histogram_change)
             old_layer.min_changed.disconnect(self.min_item.arrow_item._on_value_changed)
             old_layer.max_changed.disconnect(self.max_item.arrow_item._on_value_changed)
             old_layer.histogram_min_changed.disconnect(self._on_layer_histogram_change)
@@ -46,6 +53,7 @@ class HistogramItem(shader_item.ShaderItem):
         self.layer = layer
         if layer is not None:
             layer.image_changed.connect(self._on_layer_histogram_change)
+            layer.histogram_changed.connect(self._on_layer_histogram_change)
             layer.min_changed.connect(self.min_item.arrow_item._on_value_changed)
             layer.max_changed.connect(self.max_item.arrow_item._on_value_changed)
             layer.histogram_min_changed.connect(self._on_layer_histogram_change)
@@ -70,14 +78,14 @@ class HistogramItem(shader_item.ShaderItem):
                 self._tex = None
         else:
             widget_size = widget.size()
-            histogram = self.layer.histogram
+            hist = self.layer.histogram
             with ExitStack() as estack:
                 qpainter.beginNativePainting()
                 estack.callback(qpainter.endNativePainting)
                 QGL = shared_resources.QGL()
                 desired_shader_type = 'G'
-                if desired_shader_type in self.progs:
-                    prog = self.progs[desired_shader_type]
+                prog = self.get_shader_prog(desired_shader_type)
+                if prog is not None:
                     if not QGL.glIsProgram(prog.programId()):
                         # The current GL context is in a state of flux, likely because a histogram view is in a dock widget that is in
                         # the process of being floated or docked.
@@ -87,7 +95,13 @@ class HistogramItem(shader_item.ShaderItem):
                         desired_shader_type,
                         'planar_quad_vertex_shader',
                         'histogram_item_fragment_shader')
-                desired_tex_width = len(histogram)
+                if self._max_tex_width is None:
+                    self._max_tex_width = int(GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE))
+                if len(hist) > self._max_tex_width:
+                    # too many bins for a 1D texture (e.g. one bin per value of a uint16 image): sum adjacent bins
+                    factor = -(-len(hist) // self._max_tex_width)
+                    hist = numpy.add.reduceat(hist, numpy.arange(0, len(hist), factor)).astype(numpy.uint32)
+                desired_tex_width = len(hist)
                 tex = self._tex
                 if tex is not None:
                     if tex.width() != desired_tex_width:
@@ -110,12 +124,12 @@ class HistogramItem(shader_item.ShaderItem):
                 else:
                     tex.bind()
                     estack.callback(tex.release)
-                max_bin_val = histogram.max()
+                max_bin_val = hist.max()
                 if self._hist_tex_needs_upload:
                     GL.glTexSubImage1D(
                         GL.GL_TEXTURE_1D, 0, 0, desired_tex_width, GL.GL_RED,
                         GL.GL_UNSIGNED_INT,
-                        memoryview(histogram)
+                        memoryview(hist)
                     )
                     self._hist_tex_needs_upload = False
                     self._tex = tex
@@ -146,6 +160,35 @@ class HistogramItem(shader_item.ShaderItem):
                 self.set_blend(estack)
                 QGL.glEnableClientState(QGL.GL_VERTEX_ARRAY)
                 QGL.glDrawArrays(QGL.GL_TRIANGLE_FAN, 0, 4)
+            if self.show_channel_histograms and layer.channel_histograms is not None:
+                self._paint_channel_histograms(qpainter, layer.channel_histograms)
+
+    def _paint_channel_histograms(self, qpainter, channel_histograms):
+        if self._channel_paths is None or self._channel_paths[0] != self.gamma_gamma:
+            # polyline through the bin centers, scaled so the tallest bin of any channel fills the item
+            heights = channel_histograms.astype(float)**self.gamma_gamma
+            max_height = heights.max()
+            if max_height > 0:
+                heights /= max_height
+            n_bins = heights.shape[1]
+            xs = (numpy.arange(n_bins) + 0.5) / n_bins
+            paths = []
+            for channel_heights in heights:
+                path = Qt.QPainterPath()
+                path.addPolygon(Qt.QPolygonF([Qt.QPointF(x, 1 - y) for x, y in zip(xs, channel_heights)]))
+                paths.append(path)
+            self._channel_paths = self.gamma_gamma, paths
+        qpainter.save()
+        try:
+            qpainter.setBrush(Qt.Qt.NoBrush)
+            for color, path in zip(self.CHANNEL_HISTOGRAM_COLORS, self._channel_paths[1]):
+                pen = Qt.QPen(color)
+                pen.setWidth(1)
+                pen.setCosmetic(True)
+                qpainter.setPen(pen)
+                qpainter.drawPath(path)
+        finally:
+            qpainter.restore()
 
     def hoverMoveEvent(self, event):
         self.contextual_info_pos = event.pos()
@@ -162,27 +205,54 @@ class HistogramItem(shader_item.ShaderItem):
             if layer is not None:
                 image = layer.image
                 if image is not None:
-                    histogram = layer.histogram
-                    hist_min = layer.histogram_min
-                    hist_width = layer.histogram_max - hist_min
-                    n_bins = len(histogram)
-                    bin_width = hist_width / n_bins
-                    bin = int(self.contextual_info_pos.x() * n_bins)
-                    l, r = hist_min + bin * bin_width, hist_min + (bin + 1) * bin_width
+                    hist = layer.histogram
+                    n_bins = len(hist)
+                    bin = min(max(int(self.contextual_info_pos.x() * n_bins), 0), n_bins - 1)
+                    log_range = self._log_bin_range()
+                    if log_range is not None:
+                        l, r = histogram.bin_edges(n_bins, log_range, log_bins=True)[bin:bin+2]
+                    else:
+                        hist_min = layer.histogram_min
+                        bin_width = (layer.histogram_max - hist_min) / n_bins
+                        l, r = hist_min + bin * bin_width, hist_min + (bin + 1) * bin_width
                     if image.data.dtype == numpy.float32:
                         bin_text = '[{:.8g},{:.8g}{}'.format(l, r, ']' if bin == n_bins - 1 else ')')
                     else:
                         l, r = int(math.ceil(l)), int(math.floor(r))
                         bin_text = '{}'.format(l) if image.data.dtype == numpy.uint8 else '[{},{}]'.format(l, r)
-                    text = bin_text + ': {}'.format(histogram[bin])
+                    text = bin_text + ': {}'.format(hist[bin])
         self.scene().contextual_info_item.set_info_text(text)
 
+    def _log_bin_range(self):
+        """The range of the layer's histogram if its bins are evenly spaced in log(value), or else None."""
+        layer = self.layer
+        if layer.histogram_log_bins and layer.dtype == numpy.float32:
+            return histogram.log_bin_range(layer.histogram_min, layer.histogram_max)
+
+    def value_to_x(self, v):
+        """Map a value of the layer's image to the x coordinate of its histogram bin, in [0, 1]."""
+        log_range = self._log_bin_range()
+        if log_range is None:
+            mn, mx = self.layer.histogram_min, self.layer.histogram_max
+            return (v - mn) / (mx - mn)
+        mn, mx = log_range
+        return math.log(v / mn) / math.log(mx / mn) if v > 0 else 0
+
+    def x_to_value(self, x):
+        log_range = self._log_bin_range()
+        if log_range is None:
+            mn, mx = self.layer.histogram_min, self.layer.histogram_max
+            return mn + x * float(mx - mn)
+        mn, mx = log_range
+        return mn * (mx / mn)**x
+
     def _on_layer_histogram_change(self):
         if self.layer is None or self.layer.image is None:
             self.hide()
         else:
             self.show()
             self._hist_tex_needs_upload = True
+            self._channel_paths = None
             self.min_item.arrow_item._on_value_changed()
             self.max_item.arrow_item._on_value_changed()
             self.gamma_item._on_value_changed()
@@ -268,9 +338,8 @@ class MinMaxArrowItem(Qt.QGraphicsObject):
             elif x > 1:
                 self.setX(1)
                 x = 1
-            layer = self.parentItem().layer
-            mn, mx = layer.histogram_min, layer.histogram_max
-            setattr(layer, self.name, mn + x * float(mx - mn))
+            histogram_item = self.parentItem()
+            setattr(histogram_item.layer, self.name, histogram_item.x_to_value(x))
         self._min_max_item.setX(x)
 
     def _on_y_changed(self):
@@ -279,12 +348,13 @@ class MinMaxArrowItem(Qt.QGraphicsObject):
 
     def _on_value_changed(self):
         with self._ignore_x_change:
-            layer = self.parentItem().layer
+            histogram_item = self.parentItem()
+            layer = histogram_item.layer
             mn, mx = layer.histogram_min, layer.histogram_max
             if mx == mn:
                 x = mn
             else:
-                x = (getattr(layer, self.name) - mn) / (mx - mn)
+                x = histogram_item.value_to_x(getattr(layer, self.name))
             self.setX(x)
 
 class GammaItem(Qt.QGraphicsObject):
@@ -1,11 +1,15 @@
 ﻿# This code is licensed under the MIT License (see LICENSE file for details)
 
 from contextlib import ExitStack
+import math
 import numpy
+from OpenGL import GL
 from PyQt5 import Qt
 from string import Template
 import textwrap
 from .. import shared_resources
+from .. import async_texture
+from .. import layer as layer_module
 from . import shader_item
 
 
@@ -19,7 +23,8 @@ UNIFORM_SECTION = Template(textwrap.dedent("""\
     uniform float rescale_min_${tex_unit};
     uniform float rescale_range_${tex_unit};
     uniform float gamma_${tex_unit};
-    uniform vec4 tint_${tex_unit};"""))
+    uniform vec4 tint_${tex_unit};
+    uniform vec4 tex_rect_${tex_unit};"""))
 
 COLOR_TRANSFORM = Template(textwrap.dedent("""\
     vec4 color_transform_${tex_unit}(vec4 in_, vec4 tint, float rescale_min, float rescale_range, float gamma_scalar)
@@ -33,7 +38,7 @@ COLOR_TRANSFORM = Template(textwrap.dedent("""\
 
 MAIN_SECTION = Template(textwrap.dedent("""\
         // layer_stack[${layer_index}]
-        s = texture2D(tex_${tex_unit}, tex_coord);
+        s = texture2D(tex_${tex_unit}, ((tex_coord - tex_rect_${tex_unit}.xy) / tex_rect_${tex_unit}.zw)${tex_coord});
         s = color_transform_${tex_unit}(${getcolor_expression}, tint_${tex_unit}, rescale_min_${tex_unit}, rescale_range_${tex_unit}, gamma_${tex_unit});
         sca = s.rgb * s.a;
     ${blend_function}
@@ -41,6 +46,65 @@ MAIN_SECTION = Template(textwrap.dedent("""\
         dca = clamp(dca, 0, 1);
     """))
 
+# Replaces the default transform_section for layers drawn through a lookup table (see Layer.uses_lut()). Rescaled
+# values in [0, 1] are mapped to the centers of the first and last texels of the table.
+LUT_UNIFORM_SECTION = Template('uniform sampler1D lut_${tex_unit};')
+
+LUT_TRANSFORM_SECTION = Template(textwrap.dedent("""\
+    vec3 lut_coord = clamp((in_.rgb - rescale_min) / (rescale_range), 0.0f, 1.0f) * ${lut_scale} + ${lut_offset};
+        out_.r = texture1D(lut_${tex_unit}, lut_coord.r).r;
+        out_.g = texture1D(lut_${tex_unit}, lut_coord.g).g;
+        out_.b = texture1D(lut_${tex_unit}, lut_coord.b).b;
+        out_.a *= texture1D(lut_${tex_unit}, lut_coord.r).a;"""))
+
+def lut_transform_section(tex_unit, lut_size):
+    return LUT_TRANSFORM_SECTION.substitute(tex_unit=tex_unit, lut_scale=repr((lut_size - 1) / lut_size), lut_offset=repr(0.5 / lut_size))
+
+# The "uber-shader" sections below composite any number of layers that use the default getcolor_expressions and
+# transform_section (see LayerStackItem.USE_UBER_SHADER), selecting each layer's getcolor expression, blend function,
+# and texture coordinate order by integer uniforms. Thus one program serves every such stack of a given length.
+UBER_GETCOLOR_EXPRESSIONS = sorted(set(layer_module.Layer.IMAGE_TYPE_TO_GETCOLOR_EXPRESSION.values()))
+UBER_BLEND_FUNCTIONS = ['src'] + sorted(layer_module.Layer.BLEND_FUNCTIONS)
+
+UBER_UNIFORM_SECTION = Template(textwrap.dedent("""\
+    uniform int getcolor_${tex_unit};
+    uniform int blend_${tex_unit};
+    uniform int transposed_${tex_unit};"""))
+
+UBER_FUNCTIONS = Template(textwrap.dedent("""\
+    vec4 getcolor(vec4 s, int getcolor_index)
+    {
+    ${getcolor_cases}
+        return s;
+    }
+
+    vec4 color_transform(vec4 in_, vec4 tint, float rescale_min, float rescale_range, float gamma_scalar)
+    {
+        vec4 out_;
+        out_.a = in_.a;
+        vec3 gamma = vec3(gamma_scalar, gamma_scalar, gamma_scalar);
+        ${transform_section}
+        return clamp(out_, 0, 1);
+    }
+
+    void blend(vec4 s, vec3 sca, inout vec3 dca, inout float da, int blend_index)
+    {
+        float isa, ida, osa, oda, sada;
+        int i;
+    ${blend_cases}
+    }"""))
+
+UBER_MAIN_SECTION = Template(textwrap.indent(textwrap.dedent("""\
+        // visible layer ${tex_unit}
+        layer_tex_coord = (tex_coord - tex_rect_${tex_unit}.xy) / tex_rect_${tex_unit}.zw;
+        s = texture2D(tex_${tex_unit}, transposed_${tex_unit} != 0 ? layer_tex_coord.yx : layer_tex_coord);
+        s = ${color_transform}(getcolor(s, getcolor_${tex_unit}), tint_${tex_unit}, rescale_min_${tex_unit}, rescale_range_${tex_unit}, gamma_${tex_unit});
+        sca = s.rgb * s.a;
+        blend(s, sca, dca, da, blend_${tex_unit});
+        da = clamp(da, 0, 1);
+        dca = clamp(dca, 0, 1);
+    """), '    '))
+
 
 class LayerStackItem(shader_item.ShaderItem):
     """The layer_stack attribute of LayerStackItem is an SignalingList, a container with a list interface, containing a sequence
@@ -73,6 +137,12 @@ class LayerStackItem(shader_item.ShaderItem):
     QGRAPHICSITEM_TYPE = shared_resources.generate_unique_qgraphicsitem_type()
     DEFAULT_BOUNDING_RECT = Qt.QRectF(Qt.QPointF(0, 0), Qt.QSizeF(1000, 1000))
     TEXTURE_BORDER_COLOR = Qt.QColor(0, 0, 0, 0)
+    # milliseconds between redraws while textures (or tiles of a tiled layer) are being uploaded
+    UPLOAD_POLL_INTERVAL = 15
+    # If True, stacks of layers with default getcolor_expressions and transform_sections are drawn with a shader
+    # program built once per number of visible layers, so that showing, hiding, or changing the blend function of
+    # such layers costs no shader compilation. Other stacks are drawn with a program generated for the combination.
+    USE_UBER_SHADER = True
 
     bounding_rect_changed = Qt.pyqtSignal()
     new_image_painted = Qt.pyqtSignal()
@@ -90,6 +160,7 @@ class LayerStackItem(shader_item.ShaderItem):
         layers.removed.connect(self._on_layers_removed)
         layers.replaced.connect(self._on_layers_replaced)
         self._attach_layers(layers)
+        self._luts = {} # layer: (lookup table, Qt.QOpenGLTexture holding it)
 
         layer_stack.layer_focus_changed.connect(self._on_layer_focus_changed)
         layer_stack.solo_layer_mode_action.toggled.connect(self.update)
@@ -235,48 +306,9 @@ class LayerStackItem(shader_item.ShaderItem):
         qpainter.beginNativePainting()
         with ExitStack() as estack:
             estack.callback(qpainter.endNativePainting)
-            visible_layer_indices = self._get_visible_layer_indices_and_update_texs()
-            if not visible_layer_indices:
-                return
-            layer_indices = [(tex_unit, layer_index, self.layer_stack.layers[layer_index]) for tex_unit, layer_index in enumerate(visible_layer_indices)]
-            prog_desc = tuple((layer.getcolor_expression,
-                               layer.blend_function if tex_unit > 0 else 'src',
-                               layer.transform_section)
-                              for tex_unit, layer_index, layer in layer_indices)
-            if prog_desc in self.progs:
-                prog = self.progs[prog_desc]
-            else:
-                uniforms = [UNIFORM_SECTION.substitute(tex_unit=tex_unit) for tex_unit, layer_index, layer in layer_indices]
-                color_transforms = [COLOR_TRANSFORM.substitute(tex_unit=tex_unit, transform_section=layer.transform_section)
-                                    for tex_unit, layer_index, layer in layer_indices]
-                mains = [MAIN_SECTION.substitute(layer_index=layer_index, tex_unit=tex_unit,
-                                                 getcolor_expression=layer.getcolor_expression,
-                                                 blend_function=layer.BLEND_FUNCTIONS[layer.blend_function] if tex_unit > 0 else SRC_BLEND)
-                         for tex_unit, layer_index, layer in layer_indices]
-
-                prog = self.build_shader_prog(
-                    prog_desc,
-                    'planar_quad_vertex_shader',
-                    'layer_stack_item_fragment_shader_template',
-                    uniforms='\n'.join(uniforms),
-                    color_transforms='\n'.join(color_transforms),
-                    main='\n'.join(mains))
-            prog.bind()
-            estack.callback(prog.release)
             if widget is None:
                 # We are being called as a result of a BaseView.snapshot(..) invocation
                 widget = self.scene().views()[0].gl_widget
-            glQuad = shared_resources.GL_QUAD()
-            glQuad.buffer.bind()
-            estack.callback(glQuad.buffer.release)
-            glQuad.vao.bind()
-            estack.callback(glQuad.vao.release)
-            vert_coord_loc = prog.attributeLocation('vert_coord')
-            prog.enableAttributeArray(vert_coord_loc)
-            QGL = shared_resources.QGL()
-            prog.setAttributeBuffer(vert_coord_loc, QGL.GL_FLOAT, 0, 2, 0)
-            prog.setUniformValue('viewport_height', QGL.glGetFloatv(QGL.GL_VIEWPORT)[3])
-            prog.setUniformValue('layer_stack_item_opacity', self.opacity())
             # The next few lines of code compute frag_to_tex, representing an affine transform in 2D space from pixel coordinates
             # to normalized (unit square) texture coordinates.  That is, matrix multiplication of frag_to_tex and homogenous
             # pixel coordinate vector <x, max_y-y, w> (using max_y-y to invert GL's Y axis which is upside-down, typically
@@ -295,6 +327,9 @@ class LayerStackItem(shader_item.ShaderItem):
             # layer of the layer_stack, layer_stack[0].  Therefore, it is this lowest layer that determines the aspect
             # ratio of the unit square's projection onto the view.  Any subsequent layers in the stack use this same projection,
             # with the result that they are stretched to fill the LayerStackItem.
+            #
+            # The texture of a layer whose image is transposed (see Image.transposed) holds the image with its axes swapped,
+            # so that layer's fragment shader section swaps the texture coordinates from frag_to_tex before sampling.
             frag_to_tex = Qt.QTransform()
             frame = Qt.QPolygonF(widget.view.mapFromScene(Qt.QPolygonF(self.sceneTransform().mapToPolygon(self.boundingRect().toRect()))))
             dpi_ratio = widget.devicePixelRatio()
@@ -304,37 +339,263 @@ class LayerStackItem(shader_item.ShaderItem):
                 frame = dpi_transform.map(frame)
             if not qpainter.transform().quadToSquare(frame, frag_to_tex):
                 raise RuntimeError('Failed to compute gl_FragCoord to texture coordinate transformation matrix.')
-            prog.setUniformValue('frag_to_tex', frag_to_tex)
-            min_max = numpy.empty((2,), dtype=float)
-            for tex_unit, layer_index, layer in layer_indices:
-                image = layer.image
-                min_max[0], min_max[1] = layer.min, layer.max
-                min_max = self._normalize_for_gl(min_max, image)
-                prog.setUniformValue(f'tex_{tex_unit}', tex_unit)
-                rescale_min = min_max[0]
-                rescale_range = min_max[1] - min_max[0]
-                if rescale_range == 0:
-                    # make it so same-color images appear pure white if values
-                    # are > 0, and black otherwise.
-                    rescale_min = 0
-                    rescale_range = max(0, min_max[0])
-                prog.setUniformValue(f'rescale_min_{tex_unit}', rescale_min)
-                prog.setUniformValue(f'rescale_range_{tex_unit}', rescale_range)
-                prog.setUniformValue(f'gamma_{tex_unit}', layer.gamma)
-                prog.setUniformValue(f'tint_{tex_unit}', Qt.QVector4D(*layer.tint))
+            visible_layer_indices, uploads_pending = self._get_visible_layer_indices_and_update_texs(frag_to_tex)
+            if uploads_pending:
+                # redraw once the textures currently being uploaded are ready
+                Qt.QTimer.singleShot(self.UPLOAD_POLL_INTERVAL, self.update)
+            if not visible_layer_indices:
+                return
+            layer_indices = [(tex_unit, layer_index, self.layer_stack.layers[layer_index]) for tex_unit, layer_index in enumerate(visible_layer_indices)]
+            glQuad = shared_resources.GL_QUAD()
+            glQuad.buffer.bind()
+            estack.callback(glQuad.buffer.release)
+            glQuad.vao.bind()
+            estack.callback(glQuad.vao.release)
+            QGL = shared_resources.QGL()
+            viewport = QGL.glGetFloatv(QGL.GL_VIEWPORT)
+            passes, tiles_pending = self._get_tile_passes(layer_indices, frag_to_tex, viewport[2], viewport[3])
+            lut_sizes = self._lut_sizes(layer_indices)
+            lut_units = self._bind_luts(layer_indices, lut_sizes, estack)
             self.set_blend(estack)
             QGL.glEnableClientState(QGL.GL_VERTEX_ARRAY)
-            QGL.glDrawArrays(QGL.GL_TRIANGLE_FAN, 0, 4)
-        if self._new_image:
+            min_max = numpy.empty((2,), dtype=float)
+            for clip_rect, tile_textures in passes:
+                # tile_textures maps the texture units of tiled layers to the texture to draw in this pass (bound
+                # here), the (x, y, w, h) rectangle, in normalized item coordinates, that it covers, and whether
+                # it is minified from its mipmaps
+                textures = []
+                for tex_unit, layer_index, layer in layer_indices:
+                    if tex_unit in tile_textures:
+                        texture, tex_rect, mipmaps = tile_textures[tex_unit]
+                        texture.bind(tex_unit, mipmaps)
+                    else:
+                        texture = layer.texture
+                    textures.append(texture)
+                transposed = [texture.transposed for texture in textures]
+                prog, uber = self._get_prog(layer_indices, transposed, lut_sizes)
+                prog.bind()
+                try:
+                    vert_coord_loc = prog.attributeLocation('vert_coord')
+                    prog.enableAttributeArray(vert_coord_loc)
+                    prog.setAttributeBuffer(vert_coord_loc, QGL.GL_FLOAT, 0, 2, 0)
+                    prog.setUniformValue('viewport_height', viewport[3])
+                    prog.setUniformValue('layer_stack_item_opacity', self.opacity())
+                    prog.setUniformValue('frag_to_tex', frag_to_tex)
+                    prog.setUniformValue('clip_rect', Qt.QVector4D(*clip_rect))
+                    for tex_unit, layer_index, layer in layer_indices:
+                        image = layer.image
+                        min_max[0], min_max[1] = layer.min, layer.max
+                        min_max = self._normalize_for_gl(min_max, image)
+                        prog.setUniformValue(f'tex_{tex_unit}', tex_unit)
+                        tex_rect = tile_textures[tex_unit][1] if tex_unit in tile_textures else (0, 0, 1, 1)
+                        prog.setUniformValue(f'tex_rect_{tex_unit}', Qt.QVector4D(*tex_rect))
+                        rescale_min = min_max[0]
+                        rescale_range = min_max[1] - min_max[0]
+                        if rescale_range == 0:
+                            # make it so same-color images appear pure white if values
+                            # are > 0, and black otherwise.
+                            rescale_min = 0
+                            rescale_range = max(0, min_max[0])
+                        prog.setUniformValue(f'rescale_min_{tex_unit}', rescale_min)
+                        prog.setUniformValue(f'rescale_range_{tex_unit}', rescale_range)
+                        prog.setUniformValue(f'gamma_{tex_unit}', layer.gamma)
+                        prog.setUniformValue(f'tint_{tex_unit}', Qt.QVector4D(*layer.tint))
+                        if tex_unit in lut_units:
+                            prog.setUniformValue(f'lut_{tex_unit}', lut_units[tex_unit])
+                        if uber:
+                            prog.setUniformValue(f'getcolor_{tex_unit}', UBER_GETCOLOR_EXPRESSIONS.index(layer.getcolor_expression))
+                            blend_function = layer.blend_function if tex_unit > 0 else 'src'
+                            prog.setUniformValue(f'blend_{tex_unit}', UBER_BLEND_FUNCTIONS.index(blend_function))
+                            prog.setUniformValue(f'transposed_{tex_unit}', int(transposed[tex_unit]))
+                    QGL.glDrawArrays(QGL.GL_TRIANGLE_FAN, 0, 4)
+                finally:
+                    prog.release()
+            if tiles_pending and not uploads_pending:
+                Qt.QTimer.singleShot(self.UPLOAD_POLL_INTERVAL, self.update)
+        if self._new_image and not uploads_pending:
             self.new_image_painted.emit()
             self._new_image = False
 
+    @staticmethod
+    def _lut_sizes(layer_indices):
+        """Return the size of the lookup table of each layer drawn through one (see Layer.uses_lut()), or 0 for
+        layers drawn without. Each lookup table takes a texture unit beyond those of the layers' images: if there
+        are too few for all, the layers left over apply gamma and tint per pixel instead. Layers with a colormap,
+        which is drawn only through a lookup table, are the last to be left over."""
+        max_units = min(GL.glGetIntegerv(GL.GL_MAX_TEXTURE_IMAGE_UNITS), GL.glGetIntegerv(GL.GL_MAX_COMBINED_TEXTURE_IMAGE_UNITS))
+        free_units = max_units - len(layer_indices)
+        lut_sizes = [0] * len(layer_indices)
+        lut_layers = [(layer.colormap is None, tex_unit, layer) for tex_unit, layer_index, layer in layer_indices if layer.uses_lut()]
+        for colormap_is_none, tex_unit, layer in sorted(lut_layers, key=lambda lut_layer: lut_layer[:2])[:max(0, free_units)]:
+            lut_sizes[tex_unit] = layer.LUT_SIZE
+        return lut_sizes
+
+    def _bind_luts(self, layer_indices, lut_sizes, estack):
+        """Bind the lookup table textures of the layers drawn through them (see Layer.uses_lut()) to the texture
+        units following those of the layers' images, uploading the tables that have changed since last drawn.
+        Return a dict mapping the texture units of those layers' images to those of their lookup tables."""
+        layers = set(self.layer_stack.layers)
+        for layer in [layer for layer in self._luts if layer not in layers]:
+            self._luts.pop(layer)[1].destroy()
+        lut_units = {}
+        for (tex_unit, layer_index, layer), lut_size in zip(layer_indices, lut_sizes):
+            if not lut_size:
+                continue
+            lut_unit = len(layer_indices) + len(lut_units)
+            lut_units[tex_unit] = lut_unit
+            table = layer.lookup_table()
+            old_table, tex = self._luts.get(layer, (None, None))
+            if tex is not None and tex.width() != len(table):
+                tex.destroy()
+                tex = None
+            if tex is None:
+                tex = Qt.QOpenGLTexture(Qt.QOpenGLTexture.Target1D)
+                tex.setFormat(Qt.QOpenGLTexture.RGBA32F)
+                tex.setWrapMode(Qt.QOpenGLTexture.ClampToEdge)
+                tex.setMipLevels(1)
+                tex.setAutoMipMapGenerationEnabled(False)
+                tex.setSize(len(table))
+                tex.allocateStorage()
+                tex.setMinMagFilters(Qt.QOpenGLTexture.Linear, Qt.QOpenGLTexture.Linear)
+                old_table = None
+            tex.bind(lut_unit)
+            estack.callback(tex.release, lut_unit)
+            if table is not old_table:
+                GL.glTexSubImage1D(GL.GL_TEXTURE_1D, 0, 0, len(table), GL.GL_RGBA, GL.GL_FLOAT, memoryview(table))
+            self._luts[layer] = table, tex
+        return lut_units
+
+    def _get_prog(self, layer_indices, transposed, lut_sizes):
+        """Return the shader program with which to draw the given layers, and whether it is the uber-shader
+        program, whose per-layer modes are set by uniforms. lut_sizes gives the size of each layer's lookup
+        table, or 0 for layers not drawn through one."""
+        if self.USE_UBER_SHADER and all(self._uber_shader_compatible(layer) for tex_unit, layer_index, layer in layer_indices):
+            return self._get_uber_prog(lut_sizes), True
+        return self._get_templated_prog(layer_indices, transposed, lut_sizes), False
+
+    @staticmethod
+    def _uber_shader_compatible(layer):
+        return (layer.getcolor_expression in UBER_GETCOLOR_EXPRESSIONS
+                and layer.transform_section == layer_module.Layer.DEFAULT_TRANSFORM_SECTION
+                and layer.BLEND_FUNCTIONS[layer.blend_function] == layer_module.Layer.BLEND_FUNCTIONS.get(layer.blend_function))
+
+    def _get_uber_prog(self, lut_sizes):
+        prog_desc = 'uber', tuple(lut_sizes)
+        prog = self.get_shader_prog(prog_desc)
+        if prog is not None:
+            return prog
+        layer_count = len(lut_sizes)
+        uniforms = [UNIFORM_SECTION.substitute(tex_unit=tex_unit) + '\n' + UBER_UNIFORM_SECTION.substitute(tex_unit=tex_unit)
+                    for tex_unit in range(layer_count)]
+        uniforms += [LUT_UNIFORM_SECTION.substitute(tex_unit=tex_unit) for tex_unit, lut_size in enumerate(lut_sizes) if lut_size]
+        # layers drawn through lookup tables each have their own color transform, sampling their table
+        lut_transforms = [COLOR_TRANSFORM.substitute(tex_unit=tex_unit, transform_section=lut_transform_section(tex_unit, lut_size))
+                          for tex_unit, lut_size in enumerate(lut_sizes) if lut_size]
+        getcolor_cases = '\n'.join('    if(getcolor_index == {}) return {};'.format(index, expression)
+                                   for index, expression in enumerate(UBER_GETCOLOR_EXPRESSIONS))
+        blend_functions = [SRC_BLEND] + [layer_module.Layer.BLEND_FUNCTIONS[name] for name in UBER_BLEND_FUNCTIONS[1:]]
+        blend_cases = '\n    else '.join('if(blend_index == {})\n    {{\n{}\n    }}'.format(index, blend_function)
+                                        for index, blend_function in enumerate(blend_functions))
+        functions = UBER_FUNCTIONS.substitute(getcolor_cases=getcolor_cases, blend_cases='    ' + blend_cases,
+                                              transform_section=layer_module.Layer.DEFAULT_TRANSFORM_SECTION)
+        mains = ['    vec2 layer_tex_coord;'] + [UBER_MAIN_SECTION.substitute(tex_unit=tex_unit,
+                                                   color_transform=f'color_transform_{tex_unit}' if lut_size else 'color_transform')
+                                                   for tex_unit, lut_size in enumerate(lut_sizes)]
+        return self.build_shader_prog(
+            prog_desc,
+            'planar_quad_vertex_shader',
+            'layer_stack_item_fragment_shader_template',
+            uniforms='\n'.join(uniforms),
+            color_transforms='\n\n'.join([functions] + lut_transforms),
+            main='\n'.join(mains))
+
+    def _get_templated_prog(self, layer_indices, transposed, lut_sizes):
+        prog_desc = tuple((layer.getcolor_expression,
+                           layer.blend_function if tex_unit > 0 else 'src',
+                           layer.transform_section,
+                           layer_transposed,
+                           lut_size)
+                          for (tex_unit, layer_index, layer), layer_transposed, lut_size in zip(layer_indices, transposed, lut_sizes))
+        prog = self.get_shader_prog(prog_desc)
+        if prog is not None:
+            return prog
+        uniforms = [UNIFORM_SECTION.substitute(tex_unit=tex_unit) for tex_unit, layer_index, layer in layer_indices]
+        uniforms += [LUT_UNIFORM_SECTION.substitute(tex_unit=tex_unit) for tex_unit, lut_size in enumerate(lut_sizes) if lut_size]
+        color_transforms = [COLOR_TRANSFORM.substitute(tex_unit=tex_unit,
+                                transform_section=lut_transform_section(tex_unit, lut_size) if lut_size else layer.transform_section)
+                            for (tex_unit, layer_index, layer), lut_size in zip(layer_indices, lut_sizes)]
+        mains = [MAIN_SECTION.substitute(layer_index=layer_index, tex_unit=tex_unit,
+                                         tex_coord='.yx' if layer_transposed else '',
+                                         getcolor_expression=layer.getcolor_expression,
+                                         blend_function=layer.BLEND_FUNCTIONS[layer.blend_function] if tex_unit > 0 else SRC_BLEND)
+                 for (tex_unit, layer_index, layer), layer_transposed in zip(layer_indices, transposed)]
+        return self.build_shader_prog(
+            prog_desc,
+            'planar_quad_vertex_shader',
+            'layer_stack_item_fragment_shader_template',
+            uniforms='\n'.join(uniforms),
+            color_transforms='\n'.join(color_transforms),
+            main='\n'.join(mains))
+
+    def _get_tile_passes(self, layer_indices, frag_to_tex, viewport_width, viewport_height):
+        """Return the passes in which to draw the layers, as a list of (clip_rect, tile_textures) (see paint()),
+        and whether any of the tiles to draw are still being uploaded. Layers with a non-tiled texture are drawn
+        whole in every pass. A pass is made for each tile of the lowest tiled layer (see image_pyramid.PyramidImage)
+        that is in view, at the pyramid level for the current zoom. Any other tiled layers are drawn from their
+        overview textures, as are tiles that are not yet uploaded."""
+        tiled = [(tex_unit, layer) for tex_unit, layer_index, layer in layer_indices if isinstance(layer.texture, async_texture.TiledTexture)]
+        if not tiled:
+            return [((0, 0, 1, 1), {})], False
+        full = 0, 0, 1, 1
+        overviews = {tex_unit: (layer.texture.overview, full, layer.mipmaps and self._minification(frag_to_tex, layer.image.overview.size) > 1)
+                     for tex_unit, layer in tiled}
+        tex_unit, layer = tiled[0]
+        image = layer.image
+        # map the view to normalized item coordinates to find the visible part of the image, and the number of
+        # image pixels per screen pixel
+        corners = [frag_to_tex.map(Qt.QPointF(x, y)) for x, y in ((0, 0), (viewport_width, 0), (0, viewport_height), (viewport_width, viewport_height))]
+        x0 = max(0, min(p.x() for p in corners))
+        x1 = min(1, max(p.x() for p in corners))
+        y0 = max(0, min(p.y() for p in corners))
+        y1 = min(1, max(p.y() for p in corners))
+        if x0 >= x1 or y0 >= y1:
+            return [], False
+        w, h = image.size.width(), image.size.height()
+        scale = self._minification(frag_to_tex, image.size)
+        level = image.level_for_scale(scale)
+        if level is None:
+            # the pyramid level is still being built: layer.changed is emitted when it is
+            return [(full, overviews)], False
+        passes = []
+        tiles_pending = False
+        for (tx, ty, tw, th), texture in layer.texture.visible_tiles(level, (x0*w, y0*h, (x1-x0)*w, (y1-y0)*h)):
+            clip_rect = tx / w, ty / h, min(tw, w - tx) / w, min(th, h - ty) / h
+            if texture is None:
+                tiles_pending = True
+                tile_textures = overviews
+            else:
+                tile_textures = dict(overviews)
+                tile_textures[tex_unit] = texture, (tx / w, ty / h, tw / w, th / h), layer.mipmaps and scale / 2**level > 1
+            passes.append((clip_rect, tile_textures))
+        return passes, tiles_pending
+
+    @staticmethod
+    def _minification(frag_to_tex, size):
+        """Return the number of texels of a texture of the given QSize, stretched over the item, per view pixel."""
+        origin = frag_to_tex.map(Qt.QPointF(0, 0))
+        px = frag_to_tex.map(Qt.QPointF(1, 0)) - origin
+        py = frag_to_tex.map(Qt.QPointF(0, 1)) - origin
+        w, h = size.width(), size.height()
+        return max(math.hypot(px.x() * w, px.y() * h), math.hypot(py.x() * w, py.y() * h))
+
     @staticmethod
     def _normalize_for_gl(v, image):
         """Some things to note:
-        * OpenGL normalizes uint16 data uploaded to float32 texture for the full uint16 range.  We store
-        our unpacked 12-bit images in uint16 arrays.  Therefore, OpenGL will normalize by dividing by
-        65535, even though no 12-bit image will have a component value larger than 4095.
+        * uint16 data is stored in 16-bit normalized integer textures (see async_texture), which are sampled
+        as values divided by the full uint16 range.  We store our unpacked 12-bit images in uint16 arrays.
+        Therefore, OpenGL will normalize by dividing by 65535, even though no 12-bit image will have a
+        component value larger than 4095.
+        * likewise, uint8 and bool data is stored in 8-bit normalized textures, sampled as values divided by 255
         * float32 data uploaded to float32 texture is not normalized"""
         if image.data.dtype == numpy.uint16:
             v /= 65535
@@ -346,12 +607,15 @@ class LayerStackItem(shader_item.ShaderItem):
             raise NotImplementedError('OpenGL-compatible normalization for {} missing.'.format(image.data.dtype))
         return v
 
-    def _get_visible_layer_indices_and_update_texs(self):
+    def _get_visible_layer_indices_and_update_texs(self, frag_to_tex):
         """Meant to be executed between a pair of QPainter.beginNativePainting() QPainter.endNativePainting() calls or,
         at the very least, when an OpenGL context is current, _get_visible_layer_indices_and_update_texs does whatever is required,
         for every visible layer with non-None .layer in self.layer_stack, in order that self._texs[layer] represents layer, including texture
         object creation and texture data uploading, and it leaves self._texs[layer] bound to texture unit n, where n is
-        the associated visible_layer_index."""
+        the associated visible_layer_index.  Layers whose textures have yet to complete their first upload are
+        omitted, as uploads are never waited for: the second value returned is whether any texture of a visible
+        layer has an upload pending, in which case the item should be redrawn shortly.  Textures are drawn from their
+        mipmaps (generated only now, if out of date) when minified by frag_to_tex, unless their layer's .mipmaps is False."""
         layer_stack = self.layer_stack
         if layer_stack.examine_layer_mode:
             layer_index = layer_stack.focused_layer_idx
@@ -360,10 +624,14 @@ class LayerStackItem(shader_item.ShaderItem):
             visible_layer_indices = [layer_index for layer_index, layer in enumerate(layer_stack.layers) if layer.visible and layer.image is not None]
         else:
             visible_layer_indices = []
-        bound = set()
-        for tex_unit, layer_index in enumerate(visible_layer_indices):
-            texture = layer_stack.layers[layer_index].texture
-            if texture not in bound:
-                texture.bind(tex_unit)
-                bound.add(texture)
-        return visible_layer_indices
\ No newline at end of file
+        drawable_layer_indices = []
+        uploads_pending = False
+        for layer_index in visible_layer_indices:
+            layer = layer_stack.layers[layer_index]
+            texture = layer.texture
+            texture_size = layer.image.overview.size if isinstance(texture, async_texture.TiledTexture) else layer.image.size
+            mipmaps = layer.mipmaps and self._minification(frag_to_tex, texture_size) > 1
+            if texture.bind(len(drawable_layer_indices), mipmaps):
+                drawable_layer_indices.append(layer_index)
+            uploads_pending |= texture.status == 'uploading'
+        return drawable_layer_indices, uploads_pending
\ No newline at end of file
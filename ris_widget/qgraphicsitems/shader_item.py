@@ -1,42 +1,72 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import collections
+import hashlib
+import os
+import pathlib
 import pkg_resources
 
+import numpy
+from OpenGL import GL
 from PyQt5 import Qt
+from PyQt5 import sip
 import string
 from .. import shared_resources
 
+# If True, linked shader program binaries are saved in PROGRAM_BINARY_CACHE_DIR (where the driver supports
+# glGetProgramBinary), and loaded from there rather than compiled and linked again, even in later sessions.
+USE_PROGRAM_BINARY_CACHE = True
+PROGRAM_BINARY_CACHE_DIR = None # if None, a ris_widget directory in the user's cache directory
 
 class ShaderItem(Qt.QGraphicsObject):
+    # At most MAX_PROGS shader programs are kept, the least recently used being deleted to make room
+    MAX_PROGS = 64
+
     def __init__(self, parent=None):
         Qt.QGraphicsObject.__init__(self, parent)
-        self.progs = {}
+        self.progs = collections.OrderedDict()
 
     # all subclasses MUST define their own unique QGRAPHICSITEM_TYPE
     QGRAPHICSITEM_TYPE = shared_resources.generate_unique_qgraphicsitem_type()
     def type(self):
         return self.QGRAPHICSITEM_TYPE
 
-    def build_shader_prog(self, desc, vert_name, frag_name, **frag_template_mapping):
-
-        vert_src = pkg_resources.resource_string(__name__, 'shaders/{}.glsl'.format(vert_name))
-        frag_src = pkg_resources.resource_string(__name__, 'shaders/{}.glsl'.format(frag_name))
-
-        prog = Qt.QOpenGLShaderProgram(self)
-
-        if not prog.addShaderFromSourceCode(Qt.QOpenGLShader.Vertex, vert_src):
-            raise RuntimeError('Failed to compile vertex shader "{}" for {} {} shader program.'.format(vert_name, type(self).__name__, desc))
+    def get_shader_prog(self, desc):
+        """Return the shader program previously built for desc, or None."""
+        prog = self.progs.get(desc)
+        if prog is not None:
+            self.progs.move_to_end(desc)
+        return prog
 
+    def build_shader_prog(self, desc, vert_name, frag_name, **frag_template_mapping):
+        vert_src = _shader_source(vert_name)
+        frag_src = _shader_source(frag_name)
         if frag_template_mapping:
             frag_template = string.Template(frag_src.decode('ascii'))
-            frag_src = frag_template.substitute(frag_template_mapping)
+            frag_src = frag_template.substitute(frag_template_mapping).encode('utf-8')
+
+        prog = Qt.QOpenGLShaderProgram(self)
+        binary_path = _program_binary_path(vert_src, frag_src)
+        if binary_path is None or not _load_program_binary(prog, binary_path):
+            if not prog.addShaderFromSourceCode(Qt.QOpenGLShader.Vertex, vert_src):
+                raise RuntimeError('Failed to compile vertex shader "{}" for {} {} shader program.'.format(vert_name, type(self).__name__, desc))
 
-        if not prog.addShaderFromSourceCode(Qt.QOpenGLShader.Fragment, frag_src):
-            raise RuntimeError('Failed to compile fragment shader "{}" for {} {} shader program.'.format(frag_name, type(self).__name__, desc))
+            if not prog.addShaderFromSourceCode(Qt.QOpenGLShader.Fragment, frag_src):
+                raise RuntimeError('Failed to compile fragment shader "{}" for {} {} shader program.'.format(frag_name, type(self).__name__, desc))
 
-        if not prog.link():
-            raise RuntimeError('Failed to link {} {} shader program.'.format(type(self).__name__, desc))
+            if binary_path is not None:
+                prog.create()
+                GL.glProgramParameteri(prog.programId(), GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+            if not prog.link():
+                raise RuntimeError('Failed to link {} {} shader program.'.format(type(self).__name__, desc))
+            if binary_path is not None:
+                _save_program_binary(prog, binary_path)
         self.progs[desc] = prog
+        while len(self.progs) > self.MAX_PROGS:
+            _, old_prog = self.progs.popitem(last=False)
+            # delete the program now, while its context is current, rather than whenever Python collects it
+            old_prog.removeAllShaders()
+            sip.delete(old_prog)
         return prog
 
     def set_blend(self, estack):
@@ -65,4 +95,73 @@ class ShaderItem(Qt.QGraphicsObject):
         bes = QGL.glGetIntegerv(QGL.GL_BLEND_EQUATION_RGB), QGL.glGetIntegerv(QGL.GL_BLEND_EQUATION_ALPHA)
         if bes != desired_bes:
             QGL.glBlendEquationSeparate(*desired_bes)
-            estack.callback(lambda: QGL.glBlendEquationSeparate(*bes))
\ No newline at end of file
+            estack.callback(lambda: QGL.glBlendEquationSeparate(*bes))
+
+_SHADER_SOURCES = {}
+def _shader_source(name):
+    if name not in _SHADER_SOURCES:
+        _SHADER_SOURCES[name] = pkg_resources.resource_string(__name__, 'shaders/{}.glsl'.format(name))
+    return _SHADER_SOURCES[name]
+
+_PROGRAM_BINARY_SUPPORT = {} # QOpenGLContext: whether glGetProgramBinary is supported
+def _program_binary_path(vert_src, frag_src):
+    """Return the path in which to cache the binary of the program linked from the given shader sources in
+    the current context, or None if program binaries are not to be (or cannot be) cached. The path depends
+    on the shader sources and the GL vendor, renderer, and version, as binaries are specific to a driver."""
+    if not USE_PROGRAM_BINARY_CACHE:
+        return None
+    context = Qt.QOpenGLContext.currentContext()
+    if context not in _PROGRAM_BINARY_SUPPORT:
+        supported = bool(GL.glGetProgramBinary) and bool(GL.glProgramBinary) and GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+        _PROGRAM_BINARY_SUPPORT[context] = supported
+        context.aboutToBeDestroyed.connect(lambda c=context: _PROGRAM_BINARY_SUPPORT.pop(c))
+    if not _PROGRAM_BINARY_SUPPORT[context]:
+        return None
+    key = hashlib.sha1()
+    for gl_string in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION):
+        key.update(GL.glGetString(gl_string) or b'')
+        key.update(b'\0')
+    key.update(vert_src)
+    key.update(b'\0')
+    key.update(frag_src)
+    cache_dir = PROGRAM_BINARY_CACHE_DIR
+    if cache_dir is None:
+        cache_dir = pathlib.Path(Qt.QStandardPaths.writableLocation(Qt.QStandardPaths.GenericCacheLocation)) / 'ris_widget' / 'shader_programs'
+    return pathlib.Path(cache_dir) / (key.hexdigest() + '.bin')
+
+def _load_program_binary(prog, path):
+    """Load prog from the program binary saved in path, if it exists and the driver accepts it."""
+    try:
+        contents = path.read_bytes()
+    except OSError:
+        return False
+    if len(contents) < 4:
+        return False
+    binary_format = int.from_bytes(contents[:4], 'little')
+    binary = numpy.frombuffer(contents, dtype=numpy.uint8, offset=4)
+    prog.create()
+    program_id = prog.programId()
+    GL.glProgramBinary(program_id, binary_format, binary, binary.size)
+    if not GL.glGetProgramiv(program_id, GL.GL_LINK_STATUS):
+        # e.g. the driver has been updated since the binary was saved: fall back to compiling the program
+        return False
+    # with no shaders added, QOpenGLShaderProgram.link() just checks that the program was linked otherwise
+    return prog.link()
+
+def _save_program_binary(prog, path):
+    program_id = prog.programId()
+    length = GL.glGetProgramiv(program_id, GL.GL_PROGRAM_BINARY_LENGTH)
+    if not length:
+        return
+    binary = numpy.empty(length, dtype=numpy.uint8)
+    written_length = numpy.zeros(1, dtype=numpy.int32)
+    binary_format = numpy.zeros(1, dtype=numpy.uint32)
+    GL.glGetProgramBinary(program_id, length, written_length, binary_format, binary)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix('.{}.tmp'.format(os.getpid()))
+        temp_path.write_bytes(int(binary_format[0]).to_bytes(4, 'little') + binary[:written_length[0]].tobytes())
+        # replace atomically, so that other processes never read a partially written binary
+        os.replace(str(temp_path), str(path))
+    except OSError:
+        pass
@@ -5,6 +5,9 @@
 uniform float layer_stack_item_opacity;
 uniform float viewport_height;
 uniform mat3 frag_to_tex;
+// (x, y, w, h) region of the item drawn in this pass: the part of the image covered by a tile, for
+// tiled images, or else all of it
+uniform vec4 clip_rect;
 $uniforms
 
 vec2 transform_frag_to_tex()
@@ -27,6 +30,10 @@ void main()
     float isa, ida, osa, oda, sada;
 
     if(tex_coord.x < 0.0f || tex_coord.x > 1.0f || tex_coord.y < 0.0f || tex_coord.y > 1.0f) discard;
+    // adjacent clip rects share edges: draw each such edge in only one of them
+    vec2 clip_end = clip_rect.xy + clip_rect.zw;
+    if(tex_coord.x < clip_rect.x || tex_coord.y < clip_rect.y) discard;
+    if((tex_coord.x >= clip_end.x && clip_end.x < 1.0f) || (tex_coord.y >= clip_end.y && clip_end.y < 1.0f)) discard;
 
 $main
     gl_FragColor = vec4(dca / da, da * layer_stack_item_opacity);
@@ -4,6 +4,9 @@ import numpy
 from PyQt5 import Qt
 
 def _equals(a, b):
+    if isinstance(a, numpy.ndarray) and a.ndim > 1 or isinstance(b, numpy.ndarray) and b.ndim > 1:
+        # multidimensional arrays (e.g. mask images) are only equal to arrays of the same shape and contents
+        return isinstance(a, numpy.ndarray) and isinstance(b, numpy.ndarray) and numpy.array_equal(a, b)
     r = a == b
     if isinstance(r, (bool, numpy.bool8)):
         return bool(r)
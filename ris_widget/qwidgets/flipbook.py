@@ -4,6 +4,7 @@
 import numpy
 import pathlib
 import glob
+import threading
 from PyQt5 import Qt
 import os.path
 
@@ -11,6 +12,11 @@ from ..object_model import uniform_signaling_list
 from ..object_model import drag_drop_model_behavior
 from ..object_model import property_table_model
 from .. import image
+from .. import image_pyramid
+from .. import histogram
+from .. import layer
+from .. import async_texture
+from .. import mapped_image
 from . import progress_thread_pool
 
 try:
@@ -71,8 +77,15 @@ class _ReadPageTaskDoneEvent(Qt.QEvent):
         self.task_page = task_page
         self.error = error
 
+class _PageHistogramsDoneEvent(Qt.QEvent):
+    TYPE = Qt.QEvent.registerEventType()
+    def __init__(self, task_futures, on_done):
+        super().__init__(self.TYPE)
+        self.task_futures = task_futures
+        self.on_done = on_done
+
 class _ReadPageTaskPage:
-    __slots__ = ["page", "im_fpaths", "im_names", "ims"]
+    __slots__ = ["page", "im_fpaths", "im_names", "ims", "map_kws"]
 
 _FLIPBOOK_PAGES_DOCSTRING = ("""
     The list of pages represented by a Flipbook instance's list view is available via a that
@@ -100,6 +113,12 @@ class Flipbook(Qt.QWidget):
     __doc__ += _FLIPBOOK_PAGES_DOCSTRING
 
     DISPLAY_PROPERTIES = ['name']
+    # Number of pages histogrammed by each background task of calculate_page_histograms()
+    HISTOGRAM_PAGES_PER_TASK = 8
+    # Number of pages before and after the current page whose images are uploaded to textures in
+    # layer.Layer.TEXTURE_CACHE when the event loop is next idle, so that flipping to them needs no upload.
+    # The cache must be large enough to hold them as well as the pages recently shown.
+    TEXTURE_READ_AHEAD_PAGES = 0
 
     current_page_changed = Qt.pyqtSignal(object)
 
@@ -119,6 +138,8 @@ class Flipbook(Qt.QWidget):
         self.pages_view.selectionModel().currentRowChanged.connect(self.apply)
         self.pages_view.selectionModel().selectionChanged.connect(self._on_page_selection_changed)
         self._attached_page = None
+        self._histogram_futures = []
+        self._read_ahead_pending = False
 
         Qt.QShortcut(Qt.Qt.Key_Up, self, self.focus_prev_page, context=Qt.Qt.ApplicationShortcut)
         Qt.QShortcut(Qt.Qt.Key_Down, self, self.focus_next_page, context=Qt.Qt.ApplicationShortcut)
@@ -184,6 +205,24 @@ class Flipbook(Qt.QWidget):
             self._attached_page = current_page
         self.layer_stack.layers = current_page # setter magic takes care of rest
         self.current_page_changed.emit(self)
+        if self.TEXTURE_READ_AHEAD_PAGES and not self._read_ahead_pending:
+            self._read_ahead_pending = True
+            Qt.QTimer.singleShot(0, self._read_ahead_textures)
+
+    def _read_ahead_textures(self):
+        self._read_ahead_pending = False
+        cache = layer.Layer.TEXTURE_CACHE
+        current_page_idx = self.current_page_idx
+        if cache is None or current_page_idx is None or not async_texture.USE_BG_UPLOAD_THREAD:
+            return
+        pages = self.pages
+        # preload the farthest pages first, so that the nearest are the last to be evicted
+        for offset in range(self.TEXTURE_READ_AHEAD_PAGES, 0, -1):
+            for idx in (current_page_idx + offset, current_page_idx - offset):
+                if 0 <= idx < len(pages):
+                    for page_image in pages[idx]:
+                        if not isinstance(page_image, image_pyramid.PyramidImage):
+                            cache.preload(page_image)
 
     def _detach_page(self):
         if self._attached_page is not None:
@@ -204,7 +243,8 @@ class Flipbook(Qt.QWidget):
         else:
             return list(path)
 
-    def add_image_files(self, image_paths, page_names=None, image_names=None, insertion_point=None):
+    def add_image_files(self, image_paths, page_names=None, image_names=None, insertion_point=None,
+            memory_map=False, raw_format=None):
         """Add image files (or stacks of image files) to the flipbook.
 
         Parameters:
@@ -223,11 +263,19 @@ class Flipbook(Qt.QWidget):
             insertion_point: numerical index before which to insert the images
                 in the flipbook (negative values permitted). If not specified,
                 images will be inserted after the last entry.
+            memory_map: If True, .npy files, uncompressed TIFF files, and (if
+                raw_format is specified) raw .raw/.bin/.dat files are memory-mapped rather than
+                read into memory, so that only the parts of the images that are
+                displayed or histogrammed are loaded. This allows browsing image
+                series larger than physical memory. Other files are read as usual.
+                See mapped_image.map_image_file() for details.
+            raw_format: dict of shape, dtype, and optionally offset for the
+                raw image files (i.e. not .npy or TIFF) to memory-map.
 
         Returns list of futures objects corresponding to the page-IO tasks.
         To wait until read is done, call concurrent.futures.wait() on this list.
         """
-        if freeimage is None:
+        if freeimage is None and not memory_map:
             raise RuntimeError('Could not import freeimage module for image IO')
         paths = []
         for page_paths in self._expand_to_path_list(image_paths):
@@ -258,6 +306,7 @@ class Flipbook(Qt.QWidget):
             task_page.page.name = page_name
             task_page.im_names = page_image_names
             task_page.im_fpaths = file_paths
+            task_page.map_kws = (raw_format or {}) if memory_map else None
             assert len(task_page.im_names) == len(task_page.im_fpaths)
             task_pages.append(task_page)
 
@@ -289,18 +338,42 @@ class Flipbook(Qt.QWidget):
             # attribute.
             del e.task_page.page.on_removal
             return True
+        if e.type() == _PageHistogramsDoneEvent.TYPE:
+            self._histogram_futures = [f for f in self._histogram_futures if f not in e.task_futures]
+            if not any(f.cancelled() or f.exception() is not None for f in e.task_futures):
+                mins, maxes, hists = zip(*(f.result() for f in e.task_futures))
+                e.on_done(numpy.concatenate(mins), numpy.concatenate(maxes), numpy.concatenate(hists))
+            return True
         return super().event(e)
 
     def _read_page_task(self, task_page):
-        task_page.ims = [freeimage.read(str(image_fpath)) for image_fpath in task_page.im_fpaths]
+        task_page.ims = [self._read_image_file(image_fpath, task_page.map_kws) for image_fpath in task_page.im_fpaths]
         Qt.QApplication.instance().postEvent(self, _ReadPageTaskDoneEvent(task_page))
 
+    @staticmethod
+    def _read_image_file(image_fpath, map_kws):
+        if map_kws is not None:
+            try:
+                return mapped_image.map_image_file(image_fpath, **map_kws)
+            except ValueError:
+                # not a file that can be mapped: read it normally
+                if freeimage is None:
+                    raise
+        return freeimage.read(str(image_fpath))
+
     def _on_task_error(self, task_page):
         Qt.QApplication.instance().postEvent(self, _ReadPageTaskDoneEvent(task_page, error=True))
 
-    def queue_page_creation_tasks(self, insertion_point, task_pages):
+    def _ensure_thread_pool(self):
         if not hasattr(self, 'thread_pool'):
-            self.thread_pool = progress_thread_pool.ProgressThreadPool(self.cancel_page_creation_tasks, self.layout)
+            self.thread_pool = progress_thread_pool.ProgressThreadPool(self._cancel_tasks, self.layout)
+
+    def _cancel_tasks(self):
+        self.cancel_page_creation_tasks()
+        self.cancel_page_histograms()
+
+    def queue_page_creation_tasks(self, insertion_point, task_pages):
+        self._ensure_thread_pool()
         new_pages = []
         page_futures = []
         for task_page in task_pages:
@@ -320,6 +393,53 @@ class Flipbook(Qt.QWidget):
                 # page removal calls the on_removal function, which as above is the future's cancel()
                 self.pages_model.removeRows(i, 1)
 
+    def calculate_page_histograms(self, on_done, image_idx=0, range=(None, None), image_bits=None, mask_geometry=None):
+        """Histogram the image_idx-th image of every page in the background, showing progress
+        in the flipbook's progress bar, and then call on_done(mins, maxes, hists) (on the GUI thread)
+        with each page's image min, max, and histogram stacked in page order, as returned by
+        histogram.histograms(). This is useful, for example, to choose a display range for a whole
+        time series. The remaining arguments are as for histogram.histograms(), except that if
+        image_bits is None, that of the images is used. The images must all have the same dtype
+        and image_bits, so that their histograms have the same bins. on_done is not called if the
+        calculation is cancelled or fails.
+
+        Returns the list of futures for the background tasks, each of which histograms
+        HISTOGRAM_PAGES_PER_TASK pages."""
+        if len(self.pages) == 0:
+            raise ValueError('There are no pages to histogram.')
+        if any(len(page) <= image_idx for page in self.pages):
+            raise ValueError('Every page must have an image at index {}.'.format(image_idx))
+        ims = [page[image_idx] for page in self.pages]
+        if len(set(im.data.dtype for im in ims)) > 1:
+            raise ValueError('The images at index {} of every page must have the same dtype.'.format(image_idx))
+        if image_bits is None:
+            if len(set(im.image_bits for im in ims)) > 1:
+                raise ValueError('The images at index {} of every page must have the same image_bits.'.format(image_idx))
+            image_bits = ims[0].image_bits
+        self._ensure_thread_pool()
+        # snapshot the image data now, as the pages may change while the tasks run
+        datas = [im.data for im in ims]
+        n = self.HISTOGRAM_PAGES_PER_TASK
+        # each task uses one thread: the thread pool runs the tasks in parallel
+        task_futures = [self.thread_pool.submit(histogram.histograms, datas[i:i+n], range, image_bits, mask_geometry, n_workers=1)
+            for i in numpy.arange(0, len(datas), n)]
+        self._histogram_futures.extend(task_futures)
+        lock = threading.Lock()
+        remaining = [len(task_futures)]
+        def task_done(future):
+            with lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                Qt.QApplication.instance().postEvent(self, _PageHistogramsDoneEvent(task_futures, on_done))
+        for future in task_futures:
+            future.add_done_callback(task_done)
+        return task_futures
+
+    def cancel_page_histograms(self):
+        for future in self._histogram_futures:
+            future.cancel()
+
     def delete_selected(self):
         sm = self.pages_view.selectionModel()
         m = self.pages_model
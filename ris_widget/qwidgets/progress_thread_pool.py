@@ -20,7 +20,7 @@ class UpdateEvent(Qt.QEvent):
 class ProgressThreadPool(Qt.QWidget):
     def __init__(self, cancel_jobs, attached_layout, parent=None):
         super().__init__(parent)
-        self.thread_pool = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()-1)
+        self.thread_pool = futures.ThreadPoolExecutor(max_workers=max(1, multiprocessing.cpu_count()-1))
         self.task_count_lock = threading.Lock()
         self._queued_tasks = 0
         self._retired_tasks = 0
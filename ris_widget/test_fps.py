@@ -101,3 +101,142 @@ def test_fps(rw, size=(2560,2160), dtype=numpy.uint16, tester_class=QTimerFPSTes
         rw.input('press enter end test')
     finally:
         tester.stop()
+
+def test_upload_throughput(size=(2560,2160), dtype=numpy.uint16, frames=100):
+    """Compare the throughput of background texture uploads directly from host memory and streamed through
+    pixel unpack buffers (see async_texture.USE_PBO_UPLOAD), printing MB/s and frames/s for each.
+    Requires a QApplication."""
+    from . import async_texture
+    from . import image
+    base = numpy.arange(size[0]*size[1], dtype=dtype).reshape(size, order='F')
+    images = [image.Image(numpy.add(base, 255*i, dtype=dtype)) for i in range(10)]
+    frame_bytes = base.nbytes
+    old_use_pbo = async_texture.USE_PBO_UPLOAD
+    try:
+        for use_pbo, name in ((False, 'direct'), (True, 'pixel buffer ring')):
+            async_texture.USE_PBO_UPLOAD = use_pbo
+            texture = async_texture.AsyncTexture()
+            texture.upload(images[0]) # allocate the texture before timing
+            _wait_for_uploads()
+            t0 = time.time()
+            for image in itertools.islice(itertools.cycle(images), frames):
+                texture.upload(image)
+                # wait for each frame, as when drawing it, so that no uploads are dropped as superseded
+                _wait_for_uploads()
+            elapsed = time.time() - t0
+            print('{}: {:.1f} MB/s, {:.1f} frames/s'.format(name, frames*frame_bytes/elapsed/2**20, frames/elapsed))
+            texture.destroy_after_uploads()
+    finally:
+        async_texture.USE_PBO_UPLOAD = old_use_pbo
+
+def test_streamed_swaps(size=(2560,2160), dtype=numpy.uint16, frames=100):
+    """Queue uploads of frames to one texture without waiting, faster than they can be uploaded, swapping in
+    completed uploads between frames (as bind() does when drawing), and check that the front texture changes
+    while later uploads are still queued, printing the number of frames drawn during the stream. Requires a
+    QApplication."""
+    from . import async_texture
+    from . import image
+    from . import shared_resources
+    base = numpy.arange(size[0]*size[1], dtype=dtype).reshape(size, order='F')
+    images = [image.Image(numpy.add(base, 255*i, dtype=dtype)) for i in range(10)]
+    surface = Qt.QOffscreenSurface()
+    surface.setFormat(shared_resources.GL_QSURFACE_FORMAT)
+    surface.create()
+    gl_context = Qt.QOpenGLContext()
+    gl_context.setShareContext(Qt.QOpenGLContext.globalShareContext())
+    gl_context.setFormat(surface.format())
+    if not gl_context.create():
+        raise RuntimeError('Failed to create OpenGL context.')
+    gl_context.makeCurrent(surface)
+    texture = async_texture.AsyncTexture()
+    try:
+        texture.upload(images[0]) # allocate the textures before streaming
+        _wait_for_uploads()
+        texture.swap()
+        front_keys = [texture._front.image_key]
+        for image in itertools.islice(itertools.cycle(images), frames):
+            texture.upload(image)
+            if texture.swap() and texture._front.image_key != front_keys[-1]:
+                front_keys.append(texture._front.image_key)
+        uploads_queued = texture._pending_uploads > 0
+        print('{} of {} frames drawn while streaming'.format(len(front_keys) - 1, frames))
+        assert len(front_keys) > 1 and uploads_queued, 'front texture did not change while uploads were queued'
+        _wait_for_uploads()
+    finally:
+        texture.destroy_after_uploads()
+        async_texture.destroy_retired_textures()
+        gl_context.doneCurrent()
+
+def test_parallel_upload_throughput(size=(2560,2160), dtype=numpy.uint16, layers=4, frames=50, thread_counts=(1, 4)):
+    """Compare the throughput of background uploads of the textures of a stack of layers that all change
+    together, with the uploads spread across each number of upload threads in thread_counts (see
+    async_texture.UPLOAD_THREADS), printing MB/s and stack frames/s for each. Run with LIBGL_ALWAYS_SOFTWARE=1
+    to measure Mesa's software renderer, whose uploads are CPU-bound. Requires a QApplication."""
+    from . import async_texture
+    from . import image
+    base = numpy.arange(size[0]*size[1], dtype=dtype).reshape(size, order='F')
+    stacks = [[image.Image(numpy.add(base, 255*(i+j), dtype=dtype)) for j in range(layers)] for i in range(4)]
+    frame_bytes = base.nbytes * layers
+    old_upload_threads = async_texture.UPLOAD_THREADS
+    try:
+        for thread_count in thread_counts:
+            async_texture.UPLOAD_THREADS = thread_count
+            textures = [async_texture.AsyncTexture() for _ in range(layers)]
+            for texture, layer_image in zip(textures, stacks[0]):
+                texture.upload(layer_image) # allocate the textures before timing
+            _wait_for_uploads()
+            t0 = time.time()
+            for stack in itertools.islice(itertools.cycle(stacks), frames):
+                for texture, layer_image in zip(textures, stack):
+                    texture.upload(layer_image)
+                # wait for each stack, as when drawing it, so that no uploads are dropped as superseded
+                _wait_for_uploads()
+            elapsed = time.time() - t0
+            print('{} thread(s): {:.1f} MB/s, {:.1f} frames/s'.format(thread_count, frames*frame_bytes/elapsed/2**20, frames/elapsed))
+            for texture in textures:
+                texture.destroy_after_uploads()
+    finally:
+        async_texture.UPLOAD_THREADS = old_upload_threads
+
+def test_lut_paint_time(rw, size=(2560,2160), dtype=numpy.uint16, layer_counts=(1, 2, 4, 8, 16), frames=50):
+    """Compare the time to paint stacks of each number of layers in layer_counts, with gamma and tint applied
+    per pixel (pow) and through lookup table textures (see layer.Layer.USE_LUT), printing ms/frame for each.
+    Note that each layer drawn through a lookup table uses an additional texture unit."""
+    from . import async_texture
+    from . import layer
+    base = numpy.arange(size[0]*size[1], dtype=dtype).reshape(size, order='F')
+    gl_widget = rw.qt_object.image_view.gl_widget
+    old_use_lut = layer.Layer.USE_LUT
+    try:
+        for layer_count in layer_counts:
+            rw.layers = [numpy.add(base, 255*i, dtype=dtype) for i in range(layer_count)]
+            for l in rw.layers:
+                l.gamma = 0.5
+            _wait_for_uploads()
+            for use_lut, name in ((False, 'pow'), (True, 'lookup table')):
+                layer.Layer.USE_LUT = use_lut
+                gl_widget.repaint() # build the shader program and lookup tables before timing
+                t0 = time.time()
+                for _ in range(frames):
+                    gl_widget.repaint()
+                gl_widget.makeCurrent()
+                async_texture.GL.glFinish()
+                gl_widget.doneCurrent()
+                elapsed = time.time() - t0
+                print('{} layer(s), {}: {:.2f} ms/frame'.format(layer_count, name, 1000*elapsed/frames))
+    finally:
+        layer.Layer.USE_LUT = old_use_lut
+
+def _wait_for_uploads():
+    """Wait until the uploads queued to every upload thread are complete."""
+    from . import async_texture
+    events = []
+    for thread in async_texture.OffscreenContextThread._THREADS:
+        done = threading.Event()
+        def finish(done=done):
+            async_texture.GL.glFinish()
+            done.set()
+        thread.enqueue(finish)
+        events.append(done)
+    for done in events:
+        done.wait()
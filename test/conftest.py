@@ -0,0 +1,19 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import time
+
+import pytest
+from PyQt5 import Qt
+
+@pytest.fixture(scope='session')
+def qapplication():
+    from ris_widget import shared_resources
+    shared_resources.init_qapplication()
+    return shared_resources.QAPPLICATION
+
+def process_events_until(condition, timeout=10):
+    """Process Qt events until condition() is true, or fail after timeout seconds."""
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out waiting for Qt events'
+        Qt.QCoreApplication.processEvents(Qt.QEventLoop.AllEvents, 10)
@@ -0,0 +1,81 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import threading
+import time
+
+import numpy
+from PyQt5 import Qt
+
+from ris_widget import async_histogram
+from ris_widget.histogram import histogram_with_channels
+from conftest import process_events_until
+
+def _images(count, shape=(300, 200)):
+    rng = numpy.random.default_rng(0)
+    return [rng.integers(0, 4096, shape, dtype=numpy.uint16) for _ in range(count)]
+
+def _assert_result(result, image):
+    for x, y in zip(result, histogram_with_channels(image)):
+        numpy.testing.assert_array_equal(x, y)
+
+def _block_executor():
+    # occupy the histogram thread that the next job will run on, until the returned event is set
+    release = threading.Event()
+    started = threading.Event()
+    def block():
+        started.set()
+        release.wait()
+    executor = async_histogram._executor()
+    futures = [executor.submit(block) for _ in range(executor._max_workers)]
+    started.wait()
+    return release, futures
+
+def test_latest_wins(qapplication):
+    images = _images(5)
+    results = []
+    histogrammer = async_histogram.AsyncHistogram()
+    histogrammer.ready.connect(results.append)
+    release, futures = _block_executor()
+    for image in images:
+        histogrammer.submit(image, (None, None), None, None)
+    release.set()
+    process_events_until(lambda: results)
+    # let any superseded result arrive, so that it would be counted
+    time.sleep(0.1)
+    Qt.QCoreApplication.processEvents()
+    assert len(results) == 1
+    _assert_result(results[0], images[-1])
+
+def test_superseded_changed_regions_are_merged(qapplication):
+    image, = _images(1)
+    results = []
+    histogrammer = async_histogram.AsyncHistogram()
+    histogrammer.ready.connect(results.append)
+    _assert_result(histogrammer.compute(image, (None, None), None, None), image)
+    release, futures = _block_executor()
+    image[0:10, 0:10] = 0
+    histogrammer.submit(image, (None, None), None, None, changed_region=(0, 0, 10, 10))
+    image[250:300, 150:200] = 4095
+    histogrammer.submit(image, (None, None), None, None, changed_region=(250, 150, 50, 50))
+    release.set()
+    process_events_until(lambda: results)
+    _assert_result(results[-1], image)
+
+def test_cancel(qapplication):
+    image, = _images(1)
+    results = []
+    histogrammer = async_histogram.AsyncHistogram()
+    histogrammer.ready.connect(results.append)
+    release, futures = _block_executor()
+    histogrammer.submit(image, (None, None), None, None)
+    histogrammer.cancel()
+    release.set()
+    for future in futures:
+        future.result()
+    time.sleep(0.1)
+    Qt.QCoreApplication.processEvents()
+    assert results == []
+    # a job after cancellation still delivers its result
+    histogrammer.submit(image, (None, None), None, None)
+    process_events_until(lambda: results)
+    _assert_result(results[0], image)
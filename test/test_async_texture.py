@@ -0,0 +1,84 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import numpy
+import pytest
+from OpenGL import GL
+
+from ris_widget import async_texture
+
+@pytest.mark.parametrize('image_type, dtype', list(async_texture.IMAGE_TYPE_TO_GL_TEXTURE_FORMATS))
+def test_texture_formats_match_dtypes(image_type, dtype):
+    format = async_texture.IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[image_type, dtype]
+    # textures take no more memory per pixel than the image data
+    assert async_texture.GL_TEXTURE_FORMAT_BYTES[format] == len(image_type) * numpy.dtype(dtype).itemsize
+    float_format = async_texture.IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[image_type, numpy.float32]
+    assert async_texture._FORMAT_IMAGE_TYPES[format] == async_texture._FORMAT_IMAGE_TYPES[float_format] == image_type
+
+def test_texture_nbytes():
+    levels = async_texture.MIPMAP_MAX_LEVEL + 1
+    assert async_texture.texture_nbytes(GL.GL_R16, (1024, 512)) == 2 * sum((1024 >> l) * (512 >> l) for l in range(levels))
+    # mipmap levels are at least one pixel on each side
+    assert async_texture.texture_nbytes(GL.GL_RGBA8, (3, 1)) == 4 * (3 + 1 * (levels - 1))
+    assert async_texture.texture_nbytes(GL.GL_RGB32F, (256, 256)) == 2 * async_texture.texture_nbytes(GL.GL_RGB16, (256, 256))
+
+class _QueueOnlyThread(async_texture.OffscreenContextThread):
+    # queues functions without running them, as no GL context is needed to test the queue itself
+    def start(self):
+        pass
+
+class _Texture:
+    def __init__(self):
+        self.pending_uploads = 0
+
+    def _drop_upload(self):
+        self.pending_uploads -= 1
+
+    _coalesce_upload = staticmethod(async_texture.AsyncTexture._coalesce_upload)
+
+def _upload(thread, texture, region, name):
+    texture.pending_uploads += 1
+    # args as for AsyncTexture._upload(): data, format, transposed, source_format, source_type, upload_region, image_key
+    thread.enqueue_upload(texture, region is None, name, None, None, False, None, None, region, name)
+
+def _queued(thread):
+    return [(entry[2], entry[1][5], entry[1][6]) for entry in thread._queue]
+
+def test_whole_uploads_supersede_queued_uploads(qapplication):
+    thread = _QueueOnlyThread()
+    a, b = _Texture(), _Texture()
+    _upload(thread, a, (0, 0, 10, 10), 'a1')
+    _upload(thread, b, None, 'b1')
+    _upload(thread, a, (5, 5, 10, 10), 'a2')
+    assert _queued(thread) == [(a, (0, 0, 10, 10), 'a1'), (b, None, 'b1'), (a, (5, 5, 10, 10), 'a2')]
+    assert thread.has_work_for(a) and thread.dropped_uploads == 0
+    _upload(thread, a, None, 'a3')
+    assert _queued(thread) == [(b, None, 'b1'), (a, None, 'a3')]
+    assert (a.pending_uploads, b.pending_uploads, thread.dropped_uploads) == (1, 1, 2)
+    assert thread.max_depth_seen == 3
+    # a running upload is never dropped
+    assert thread._get()[2] is b
+    _upload(thread, b, None, 'b2')
+    assert _queued(thread) == [(a, None, 'a3'), (b, None, 'b2')]
+    assert b.pending_uploads == 2 and thread.dropped_uploads == 2
+
+def test_full_queue_coalesces_partial_uploads(qapplication):
+    thread = _QueueOnlyThread()
+    thread.MAX_QUEUE_DEPTH = 3
+    a, b = _Texture(), _Texture()
+    for i in range(3):
+        _upload(thread, b, (i, 0, 1, 1), 'b{}'.format(i))
+    _upload(thread, a, (0, 0, 10, 10), 'a1')
+    _upload(thread, a, (20, 5, 10, 10), 'a2')
+    # the queue does not grow by more than one upload per texture, and no changed region is lost
+    assert _queued(thread)[-1] == (a, (0, 0, 30, 15), 'a2')
+    assert thread.queue_depth == 4 and thread.coalesced_uploads == 1
+    _upload(thread, b, (9, 9, 1, 1), 'b3')
+    assert _queued(thread) == [(a, (0, 0, 30, 15), 'a2'), (b, (0, 0, 10, 10), 'b3')]
+    assert (a.pending_uploads, b.pending_uploads) == (1, 1)
+    assert (thread.coalesced_uploads, thread.dropped_uploads) == (4, 4)
+    assert thread.max_depth_seen == 4
+    thread._get()
+    thread._get()
+    assert thread.queue_depth == 0 and not thread.has_work_for(a)
+    # until its upload has run
+    assert thread.has_work_for(b)
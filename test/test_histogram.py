@@ -0,0 +1,189 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import numpy
+import pytest
+
+from ris_widget.histogram import histogram, histogram_with_channels, histograms, bin_edges, log_bin_range, percentile_range, MAX_BINS, TiledHistogram
+from ris_widget.histogram.histogram import SINGLE_PASS_MAX_BIN_FRACTION, LOG_BINS_MAX_RATIO
+
+def _normal_image(shape=(600, 500), seed=0):
+    return numpy.random.default_rng(seed).normal(100, 20, shape).astype(numpy.float32)
+
+def _random_image(dtype, shape=(600, 500), seed=0):
+    rng = numpy.random.default_rng(seed)
+    if dtype == numpy.float32:
+        return _normal_image(shape, seed)
+    return rng.integers(0, numpy.iinfo(dtype).max, shape, endpoint=True, dtype=dtype)
+
+def _assert_results_equal(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        if x is None or y is None:
+            assert x is y
+        else:
+            numpy.testing.assert_array_equal(x, y)
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16, numpy.float32])
+@pytest.mark.parametrize('mask_geometry', [None, (0.5, 0.5, 0.4)])
+def test_parallel_matches_serial(dtype, mask_geometry):
+    image = _random_image(dtype)
+    serial = histogram(image, mask_geometry=mask_geometry)
+    for n_workers in (2, 3, 8):
+        _assert_results_equal(histogram(image, mask_geometry=mask_geometry, n_workers=n_workers), serial)
+
+def test_parallel_matches_serial_transposed():
+    image = _random_image(numpy.uint16).T
+    _assert_results_equal(histogram(image, range=(1000, 50000), n_workers=4), histogram(image, range=(1000, 50000)))
+
+def test_uint16_matches_numpy():
+    image = _random_image(numpy.uint16)
+    mn, mx, hist = histogram(image, n_workers=4)
+    assert (mn, mx) == (image.min(), image.max())
+    numpy.testing.assert_array_equal(hist, numpy.bincount((image >> 6).ravel(), minlength=1024))
+
+@pytest.mark.parametrize('provisional', [False, True])
+def test_single_pass_error_bound(provisional):
+    image = _normal_image()
+    mn, mx, exact = histogram(image)
+    single_pass = (float(mn) - 1, float(mx) + 1) if provisional else True
+    sp_mn, sp_mx, approximate = histogram(image, single_pass=single_pass)
+    assert (sp_mn, sp_mx) == (mn, mx)
+    assert approximate.sum() == exact.sum() == image.size
+    # counts may only move across a bin edge, to the adjacent bin, from values within the stated
+    # fraction of a bin width of that edge
+    n_bins = len(exact)
+    edges = numpy.linspace(mn, mx, n_bins + 1)[1:-1]
+    tolerance = 1.01 * SINGLE_PASS_MAX_BIN_FRACTION / 2 * (mx - mn) / n_bins
+    values = numpy.sort(image, axis=None).astype(numpy.float64)
+    near_edge = numpy.searchsorted(values, edges + tolerance, 'right') - numpy.searchsorted(values, edges - tolerance, 'left')
+    moved = numpy.abs(numpy.cumsum(approximate, dtype=numpy.int64) - numpy.cumsum(exact, dtype=numpy.int64))[:-1]
+    assert (moved <= near_edge).all()
+    assert 0 < moved.sum()
+
+def test_single_pass_exact_with_range():
+    image = _normal_image()
+    assert all(numpy.array_equal(a, b) for a, b in zip(histogram(image, range=(50, 150)),
+        histogram(image, range=(50, 150), single_pass=True)))
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16, numpy.float32])
+@pytest.mark.parametrize('range', [(None, None), (50, 200)])
+def test_tiled_matches_full_recompute(dtype, range):
+    rng = numpy.random.default_rng(1)
+    image = _random_image(dtype)
+    tiled = TiledHistogram(tile_size=64)
+    _assert_results_equal(tiled.update(image, range), histogram_with_channels(image, range))
+    for x, y, w, h in [(10, 20, 30, 40), (100, 0, 200, 64), (590, 490, 10, 10), (0, 0, 600, 500)]:
+        # include changes that move the image min and max, and so the bins of unranged float histograms
+        image[x:x+w, y:y+h] = _random_image(dtype, (w, h), seed=rng.integers(1000)) * (1 + (dtype == numpy.float32))
+        _assert_results_equal(tiled.update(image, range, changed_region=(x, y, w, h)), histogram_with_channels(image, range))
+
+def test_tiled_rgb_matches_full_recompute():
+    image = _random_image(numpy.uint8, (300, 200, 3))
+    tiled = TiledHistogram(tile_size=64)
+    tiled.update(image)
+    image[40:90, 30:60] = 0
+    _assert_results_equal(tiled.update(image, changed_region=(40, 30, 50, 30)), histogram_with_channels(image))
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16])
+@pytest.mark.parametrize('channels', [3, 4])
+def test_rgb_matches_numpy(dtype, channels):
+    image = _random_image(dtype, (300, 200, channels))
+    shift = 0 if dtype == numpy.uint8 else 6
+    n_bins = 256 if dtype == numpy.uint8 else 1024
+    rgb = image[..., :3].astype(numpy.float64)
+    luminance = (0.2126*rgb[..., 0] + 0.7152*rgb[..., 1] + 0.0722*rgb[..., 2]).astype(dtype)
+    mn, mx, hist, channel_hists = histogram_with_channels(image, n_workers=4)
+    assert (mn, mx) == (luminance.min(), luminance.max())
+    numpy.testing.assert_array_equal(hist, numpy.bincount((luminance >> shift).ravel(), minlength=n_bins))
+    for channel in range(3):
+        expected = numpy.bincount((image[..., channel] >> shift).ravel(), minlength=n_bins)
+        numpy.testing.assert_array_equal(channel_hists[channel], expected)
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16, numpy.float32])
+def test_batch_matches_single_images(dtype):
+    stack = numpy.stack([_random_image(dtype, (100, 80), seed) for seed in range(7)])
+    for images in (stack, list(stack)):
+        mins, maxes, hists = histograms(images, n_workers=3)
+        assert hists.shape[0] == len(stack)
+        for image, mn, mx, hist in zip(stack, mins, maxes, hists):
+            _assert_results_equal((mn, mx, hist), histogram(image))
+
+def test_batch_empty_mask_and_dtypes():
+    images = [numpy.ones((100, 80), dtype=numpy.uint16) for _ in range(2)]
+    mins, maxes, hists = histograms(images, mask_geometry=('rect', ((200, 200), (220, 220))))
+    assert mins.dtype == numpy.float32 and numpy.isnan(mins).all() and numpy.isnan(maxes).all()
+    assert not hists.any()
+    with pytest.raises(ValueError):
+        histograms([numpy.ones((10, 10), dtype=numpy.uint8), numpy.ones((10, 10), dtype=numpy.uint16)])
+    with pytest.raises(ValueError):
+        histograms([])
+
+def _reference_bins(values, n_bins, r_min, r_max):
+    # as the ranged kernels bin values, in float32 arithmetic
+    values = numpy.asarray(values, dtype=numpy.float32).ravel()
+    values = values[(values >= r_min) & (values <= r_max)]
+    bin_factor = numpy.float32(n_bins) / numpy.float32(r_max - r_min)
+    bins = bin_factor * (values - numpy.float32(r_min))
+    return numpy.bincount(numpy.minimum(bins, n_bins - 1).astype(int), minlength=n_bins)
+
+def test_bin_counts():
+    image = _random_image(numpy.uint16)
+    mn, mx, hist = histogram(image, n_bins=65536)
+    numpy.testing.assert_array_equal(hist, numpy.bincount(image.ravel(), minlength=65536))
+    image_12_bit = image >> 4
+    hist = histogram(image_12_bit, image_bits=12, n_bins=4096)[2]
+    numpy.testing.assert_array_equal(hist, numpy.bincount(image_12_bit.ravel(), minlength=4096))
+    hist = histogram(image, range=(100, 40000), n_bins=100, n_workers=4)[2]
+    numpy.testing.assert_array_equal(hist, _reference_bins(image, 100, 100, 40000))
+    image = _random_image(numpy.uint8)
+    for n_bins, range in [(10, (None, None)), (7, (20, 200))]:
+        r_min, r_max = (0, 255) if range == (None, None) else range
+        hist = histogram(image, range=range, n_bins=n_bins)[2]
+        numpy.testing.assert_array_equal(hist, _reference_bins(image, n_bins, r_min, r_max))
+    image = _normal_image()
+    mn, mx, hist = histogram(image, n_bins=333)
+    numpy.testing.assert_array_equal(hist, _reference_bins(image, 333, mn, mx))
+    for n_bins in (0, MAX_BINS + 1):
+        with pytest.raises(ValueError):
+            histogram(image, n_bins=n_bins)
+
+def test_log_bins():
+    image = numpy.random.default_rng(0).lognormal(0, 3, (400, 300)).astype(numpy.float32)
+    image[0, :10] = [0, -1, 0, 0, 0, 0, 0, 0, 0, 0]
+    mn, mx, hist = histogram(image, log_bins=True, n_bins=200)
+    assert (mn, mx) == (image.min(), image.max())
+    low, high = log_bin_range(mn, mx)
+    assert low == mx / LOG_BINS_MAX_RATIO and high == mx
+    edges = bin_edges(200, (mn, mx), log_bins=True)
+    numpy.testing.assert_allclose(edges[[0, -1]], (low, high))
+    numpy.testing.assert_allclose(numpy.diff(numpy.log(edges)), numpy.log(high / low) / 200)
+    # values outside the limited range (including those that are not positive) are not counted
+    expected, _ = numpy.histogram(numpy.log(image[(image >= low) & (image <= high)].astype(numpy.float64)),
+        numpy.log(edges))
+    # a value within float32 rounding of a bin edge may fall on either side
+    assert hist.sum() == expected.sum()
+    assert numpy.abs(numpy.cumsum(hist) - numpy.cumsum(expected)).max() <= 2
+    assert log_bin_range(-2, 0) is None
+    assert numpy.isnan(bin_edges(4, (-2, 0), log_bins=True)).all()
+
+def test_percentile_range():
+    image = _normal_image()
+    mn, mx, hist = histogram(image, n_bins=1024)
+    bin_width = (mx - mn) / 1024
+    for percentiles in [(0.1, 99.9), (5, 95), (50, 50)]:
+        low, high = percentile_range(hist, (mn, mx), percentiles)
+        numpy.testing.assert_allclose((low, high), numpy.percentile(image, percentiles), atol=bin_width)
+    # the extreme percentiles are the outer edges of the first and last non-empty bins
+    hist = numpy.zeros(10, dtype=numpy.uint32)
+    hist[[2, 3, 7]] = [5, 1, 4]
+    assert percentile_range(hist, (0, 10), (0, 100)) == (2, 8)
+    # empty bins at the boundary of the high percentile's count are excluded from the range
+    assert percentile_range(hist, (0, 10), (50, 60)) == (3, 4)
+    assert percentile_range(numpy.zeros(10, dtype=numpy.uint32), (0, 10)) is None
+
+def test_percentile_range_log_bins():
+    image = numpy.random.default_rng(0).lognormal(0, 1, (400, 300)).astype(numpy.float32)
+    mn, mx, hist = histogram(image, n_bins=1024, log_bins=True)
+    low, high = percentile_range(hist, (mn, mx), (1, 99), log_bins=True)
+    bin_ratio = (mx / log_bin_range(mn, mx)[0]) ** (1 / 1024)
+    numpy.testing.assert_allclose(numpy.log((low, high)), numpy.log(numpy.percentile(image, (1, 99))), atol=numpy.log(bin_ratio))
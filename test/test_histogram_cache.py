@@ -0,0 +1,59 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import numpy
+
+from ris_widget.histogram import HistogramCache
+from ris_widget.histogram.cache import hashable
+
+def _result(n_bins=256):
+    # 1 KiB for 256 uint32 bins
+    return 0, 255, numpy.zeros(n_bins, dtype=numpy.uint32), None
+
+def test_lru_eviction():
+    cache = HistogramCache(max_bytes=3*1024)
+    for key in 'abc':
+        cache.put(key, _result())
+    assert len(cache) == 3 and cache.nbytes == 3*1024
+    # using 'a' makes 'b' the least recently used
+    assert cache.get('a') is not None
+    cache.put('d', _result())
+    assert len(cache) == 3 and cache.nbytes == 3*1024
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    # a larger result evicts as many as needed
+    cache.put('e', _result(512))
+    assert cache.get('a') is None and cache.get('c') is None
+    assert cache.get('d') is not None and cache.get('e') is not None
+    assert cache.nbytes == 3*1024
+
+def test_replace_and_oversized():
+    cache = HistogramCache(max_bytes=2*1024)
+    cache.put('a', _result())
+    replacement = _result(128)
+    cache.put('a', replacement)
+    assert len(cache) == 1 and cache.nbytes == 512
+    assert cache.get('a') is replacement
+    # a result larger than the cache is not cached, and evicts nothing
+    cache.put('b', _result(1024))
+    assert cache.get('b') is None and cache.get('a') is replacement
+
+def test_counts_and_clear():
+    cache = HistogramCache()
+    cache.put('a', _result())
+    cache.get('a')
+    cache.get('b')
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0 and (cache.hits, cache.misses) == (0, 0)
+
+def test_hashable_masks():
+    mask = numpy.zeros((10, 10), dtype=bool)
+    mask[2:5, 3:7] = True
+    key = hashable(mask)
+    assert hash(key) == hash(hashable(mask.copy()))
+    other = mask.copy()
+    other[0, 0] = True
+    assert key != hashable(other)
+    polygon = ('polygon', [(1, 2), (3, 4), (5, 0)])
+    assert hashable(polygon) == hashable(('polygon', ((1, 2), (3, 4), (5, 0))))
+    hash(hashable(polygon))
@@ -0,0 +1,111 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import numpy
+import pytest
+from PyQt5 import Qt
+
+from ris_widget.image import Image
+
+from conftest import process_events_until
+
+def _array(shape, dtype=numpy.uint16):
+    return numpy.arange(numpy.prod(shape), dtype=dtype).reshape(shape)
+
+@pytest.mark.parametrize('data, transposed', [
+    (numpy.asfortranarray(_array((30, 20))), False),
+    (_array((20, 30)).T, False),
+    (_array((30, 20)), True),
+    # crops keep the row stride of the full array
+    (numpy.asfortranarray(_array((30, 20)))[5:25, 3:17], False),
+    (_array((30, 20))[5:25, 3:17], True),
+    # interleaved (y, x, c) and (x, y, c) arrays
+    (_array((20, 30, 3), numpy.uint8).swapaxes(0, 1), False),
+    (_array((30, 20, 4), numpy.float32), True),
+    (_array((20, 30, 2), numpy.uint8).swapaxes(0, 1)[2:10, 4:18], False),
+])
+def test_wrapped_without_copy(data, transposed):
+    assert Image._texture_layout(data) is transposed
+    image = Image(data)
+    assert image.data is data
+    assert image.transposed is transposed
+
+@pytest.mark.parametrize('data', [
+    # pixels not contiguous along either axis
+    numpy.asfortranarray(_array((30, 20)))[::2],
+    _array((30, 20))[:, ::2],
+    numpy.asfortranarray(_array((30, 20)))[::-1],
+    # channels not interleaved
+    numpy.asfortranarray(_array((30, 20, 3))),
+    _array((3, 30, 20)).transpose(1, 2, 0),
+])
+def test_copied(data):
+    assert Image._texture_layout(data) is None
+    image = Image(data)
+    assert image.data is not data
+    assert not numpy.shares_memory(image.data, data)
+    numpy.testing.assert_array_equal(image.data, data)
+    assert image.transposed is False
+    assert Image._texture_layout(image.data) is False
+
+def test_converted_dtypes():
+    image = Image(_array((30, 20), numpy.int32).T)
+    assert image.data.dtype == numpy.float32
+    numpy.testing.assert_array_equal(image.data, _array((30, 20)).T)
+    with pytest.raises(ValueError):
+        Image(_array((30, 20), numpy.uint8), image_bits=8)
+
+def _record_changes(image):
+    changes = []
+    image.changed.connect(changes.append)
+    return changes
+
+def test_immediate_refresh(qapplication):
+    image = Image(_array((30, 20)))
+    changes = _record_changes(image)
+    image.refresh()
+    image.refresh((1, 2, 3, 4))
+    assert changes == [None, (1, 2, 3, 4)]
+    assert (image.generation, image.refresh_count, image.coalesced_refresh_count) == (2, 2, 0)
+
+def test_deferred_refreshes_coalesced(qapplication):
+    image = Image(_array((30, 20)))
+    changes = _record_changes(image)
+    image.refresh((10, 10, 5, 5), defer=True)
+    image.refresh((2, 12, 4, 10), defer=True)
+    image.refresh((12, 3, 1, 1), defer=True)
+    assert changes == []
+    assert image.generation == 3
+    process_events_until(lambda: changes)
+    assert changes == [(2, 3, 13, 19)]
+    assert (image.refresh_count, image.coalesced_refresh_count) == (3, 2)
+    # a refresh of the whole image covers any region
+    image.refresh((1, 1, 1, 1), defer=True)
+    image.refresh(defer=True)
+    process_events_until(lambda: len(changes) == 2)
+    assert changes[1] is None
+    Qt.QCoreApplication.processEvents()
+    assert len(changes) == 2
+
+def test_flush_refresh(qapplication):
+    image = Image(_array((30, 20)))
+    changes = _record_changes(image)
+    image.refresh((0, 0, 1, 1), defer=True)
+    image.flush_refresh()
+    assert changes == [(0, 0, 1, 1)]
+    # an immediate refresh also emits the changes of pending deferred refreshes, once
+    image.refresh((5, 5, 1, 1), defer=True)
+    image.refresh((0, 0, 1, 1))
+    assert changes[1:] == [(0, 0, 6, 6)]
+    Qt.QCoreApplication.processEvents()
+    image.flush_refresh()
+    assert len(changes) == 2
+
+def test_coalesce_refreshes_default(qapplication, monkeypatch):
+    monkeypatch.setattr(Image, 'COALESCE_REFRESHES', True)
+    image = Image(_array((30, 20)))
+    changes = _record_changes(image)
+    image.refresh()
+    image.refresh()
+    assert changes == []
+    process_events_until(lambda: changes)
+    assert changes == [None] and image.coalesced_refresh_count == 1
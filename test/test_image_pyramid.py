@@ -0,0 +1,80 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import time
+
+import numpy
+import pytest
+
+from ris_widget import image_pyramid
+
+class _SmallPyramidImage(image_pyramid.PyramidImage):
+    TILE_SIZE = 16
+    HISTOGRAM_MAX_PIXELS = 400
+    BAND_PIXELS = 64
+
+def _wait_for_levels(image, timeout=10):
+    t0 = time.time()
+    while len(image.levels) < image.level_count:
+        assert time.time() - t0 < timeout, 'pyramid levels were not built'
+        time.sleep(0.01)
+
+def _reference_downsample(array):
+    # 2x2 block means, repeating the last row or column of arrays with an odd number
+    pad = [(0, array.shape[0] % 2), (0, array.shape[1] % 2)] + [(0, 0)] * (array.ndim - 2)
+    array = numpy.pad(array, pad, mode='edge').astype(numpy.float64)
+    return (array[0::2, 0::2] + array[1::2, 0::2] + array[0::2, 1::2] + array[1::2, 1::2]) / 4
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16, numpy.float32])
+@pytest.mark.parametrize('shape', [(100, 70), (101, 37), (75, 90, 3)])
+@pytest.mark.parametrize('order', ['F', 'C'])
+def test_levels(dtype, shape, order):
+    data = numpy.random.default_rng(0).integers(0, 256, shape).astype(dtype)
+    data = data.copy(order=order)
+    image = _SmallPyramidImage(data)
+    assert image.level_count == 1 + int(numpy.ceil(numpy.log2(max(shape[:2]) / 16)))
+    _wait_for_levels(image)
+    assert image.levels[0] is image.data
+    for src, dst in zip(image.levels, image.levels[1:]):
+        assert dst.dtype == dtype
+        expected = _reference_downsample(src)
+        if dtype == numpy.float32:
+            numpy.testing.assert_allclose(dst, expected, rtol=1e-6)
+        else:
+            numpy.testing.assert_array_equal(dst, numpy.floor(expected + 0.5))
+        # levels keep the layout of .data, so that tiles upload in the same orientation
+        assert image._texture_layout(dst) is image.transposed
+    assert max(image.levels[-1].shape[:2]) <= 16
+    assert image.overview.data is image.levels[-1]
+
+def test_tiles():
+    image = _SmallPyramidImage(numpy.zeros((100, 70), dtype=numpy.uint16))
+    _wait_for_levels(image)
+    assert [image.tile_grid(level) for level in range(image.level_count)] == [(7, 5), (4, 3), (2, 2), (1, 1)]
+    assert image.tile_rect(0, 6, 4) == (96, 64, 4, 6)
+    assert image.tile_rect(1, 3, 2) == (96, 64, 4, 6)
+    # edge tiles of downsampled levels may extend past the edge of .data
+    assert image.tile_rect(2, 1, 1) == (64, 64, 36, 8)
+    assert image.tile_image(1, 0, 0).data.shape == (16, 16)
+    assert [image.level_for_scale(scale) for scale in (0, 0.5, 1, 1.9, 2, 4, 7.9, 8, 100)] == [0, 0, 0, 0, 1, 2, 2, 3, 3]
+
+def test_refresh_rebuilds_levels():
+    data = numpy.zeros((100, 70), dtype=numpy.uint16)
+    image = _SmallPyramidImage(data)
+    _wait_for_levels(image)
+    data[:] = 1000
+    image.refresh()
+    _wait_for_levels(image)
+    assert all((level == 1000).all() for level in image.levels)
+    assert (image.overview.data == 1000).all()
+
+def test_histogram_sample():
+    data = numpy.arange(100*70, dtype=numpy.uint16).reshape((100, 70))
+    image = _SmallPyramidImage(data)
+    sample, mask_geometry = image.histogram_sample(('rect', ((10, 20), (30, 40))))
+    assert sample.size <= image.HISTOGRAM_MAX_PIXELS
+    numpy.testing.assert_array_equal(sample, data[::5, ::5])
+    assert mask_geometry == ('rect', [(2, 4), (6, 8)])
+    circle = (0.5, 0.5, 0.25)
+    assert image.histogram_sample(circle)[1] == circle
+    mask = numpy.zeros(data.shape, dtype=bool)
+    assert image.histogram_sample(mask)[1].shape == sample.shape
@@ -0,0 +1,57 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import numpy
+import pytest
+
+from ris_widget import layer
+
+def _levels():
+    return numpy.linspace(0, 1, layer.Layer.LUT_SIZE)
+
+def test_grey_lookup_table(qapplication):
+    l = layer.Layer()
+    table = l.lookup_table()
+    assert table.shape == (layer.Layer.LUT_SIZE, 4) and table.dtype == numpy.float32
+    numpy.testing.assert_allclose(table[:, :3], numpy.repeat(_levels()[:, numpy.newaxis], 3, axis=1), atol=1e-7)
+    assert (table[:, 3] == 1).all()
+    # the table is rebuilt only when it would change
+    l.min = 10
+    assert l.lookup_table() is table
+    l.gamma = 0.5
+    l.tint = (1, 0.5, 0, 0.5)
+    table = l.lookup_table()
+    numpy.testing.assert_allclose(table, _levels()[:, numpy.newaxis]**0.5 * [1, 0.5, 0, 0] + [0, 0, 0, 0.5], atol=1e-6)
+
+def test_array_colormap(qapplication):
+    l = layer.Layer()
+    assert not l.uses_lut()
+    l.colormap = [(0, 0, 1), (1, 0, 0), (1, 1, 1)]
+    assert l.uses_lut()
+    assert l.colormap.shape == (3, 4) and (l.colormap[:, 3] == 1).all()
+    l.gamma = 2
+    table = l.lookup_table()
+    levels = _levels()**2
+    numpy.testing.assert_allclose(table[:, 0], numpy.minimum(1, 2*levels), atol=1e-6)
+    numpy.testing.assert_allclose(table[:, 1], numpy.maximum(0, 2*levels - 1), atol=1e-6)
+    numpy.testing.assert_allclose(table[:, 2], numpy.abs(2*levels - 1), atol=1e-6)
+    l.colormap = None
+    assert not l.uses_lut()
+    assert (l.lookup_table()[:, 0] == l.lookup_table()[:, 2]).all()
+    for colormap in ([(0, 0, 0)], [(0, 0), (1, 1)], [(0, 0, 2), (1, 1, 1)]):
+        with pytest.raises(ValueError):
+            layer.coerce_to_colormap(colormap)
+
+def test_named_colormap(qapplication):
+    matplotlib = pytest.importorskip('matplotlib')
+    l = layer.Layer()
+    l.colormap = 'viridis'
+    viridis = matplotlib.colormaps['viridis'] if hasattr(matplotlib, 'colormaps') else matplotlib.cm.get_cmap('viridis')
+    table = l.lookup_table()
+    numpy.testing.assert_allclose(table[[0, -1]], viridis([0.0, 1.0]), atol=1e-6)
+    with pytest.raises(ValueError):
+        layer.coerce_to_colormap('not a colormap')
+
+def test_named_colormap_without_matplotlib(monkeypatch):
+    monkeypatch.setattr(layer, 'matplotlib', None)
+    with pytest.raises(RuntimeError, match='optional dependency'):
+        layer.named_colormap('viridis')
@@ -0,0 +1,124 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import struct
+
+import numpy
+import pytest
+
+from ris_widget.image import Image
+from ris_widget.mapped_image import map_image_file
+
+def _write_tiff(path, data, rows_per_strip=None, compression=1):
+    """Write the (x, y[, c]) array data as an uncompressed little-endian TIFF file with contiguous strips."""
+    width, height = data.shape[:2]
+    samples = 1 if data.ndim == 2 else data.shape[2]
+    rows_per_strip = height if rows_per_strip is None else rows_per_strip
+    pixels = numpy.ascontiguousarray(data.swapaxes(0, 1)).tobytes()
+    row_bytes = len(pixels) // height
+    sample_format = 3 if data.dtype.kind == 'f' else 1
+    pixel_offset = 8
+    strip_offsets = [pixel_offset + i * row_bytes for i in range(0, height, rows_per_strip)]
+    strip_counts = [row_bytes * min(rows_per_strip, height - i) for i in range(0, height, rows_per_strip)]
+    entries = [ # (tag, type, values), with type 3 SHORT and 4 LONG
+        (256, 4, [width]),
+        (257, 4, [height]),
+        (258, 3, [data.dtype.itemsize * 8] * samples),
+        (259, 3, [compression]),
+        (262, 3, [1 if samples == 1 else 2]),
+        (273, 4, strip_offsets),
+        (277, 3, [samples]),
+        (278, 4, [rows_per_strip]),
+        (279, 4, strip_counts),
+        (339, 3, [sample_format] * samples),
+    ]
+    ifd_offset = pixel_offset + len(pixels)
+    extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd = struct.pack('<H', len(entries))
+    extra = b''
+    for tag, tag_type, values in entries:
+        packed = struct.pack('<{}{}'.format(len(values), 'H' if tag_type == 3 else 'I'), *values)
+        if len(packed) > 4:
+            value = struct.pack('<I', extra_offset + len(extra))
+            extra += packed
+        else:
+            value = packed.ljust(4, b'\0')
+        ifd += struct.pack('<HHI', tag, tag_type, len(values)) + value
+    ifd += struct.pack('<I', 0)
+    path.write_bytes(b'II*\0' + struct.pack('<I', ifd_offset) + pixels + ifd + extra)
+
+def _array(shape, dtype):
+    return (numpy.arange(numpy.prod(shape)) % 251).astype(dtype).reshape(shape)
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16, numpy.float32])
+@pytest.mark.parametrize('shape', [(30, 20), (30, 20, 3)])
+@pytest.mark.parametrize('rows_per_strip', [None, 7])
+def test_tiff(tmp_path, dtype, shape, rows_per_strip):
+    data = _array(shape, dtype)
+    path = tmp_path / 'image.tif'
+    _write_tiff(path, data, rows_per_strip)
+    mapped = map_image_file(path)
+    assert mapped.dtype == dtype
+    numpy.testing.assert_array_equal(mapped, data)
+    # as rows along x, the mapped strips are wrapped in an Image without copying
+    assert Image._texture_layout(mapped) is False
+    image = Image.from_file(path)
+    assert image.name == str(path)
+    numpy.testing.assert_array_equal(image.data, data)
+
+@pytest.mark.parametrize('data', [_array((30, 20), numpy.uint16), numpy.asfortranarray(_array((30, 20, 4), numpy.uint8))])
+def test_npy(tmp_path, data):
+    path = tmp_path / 'image.npy'
+    numpy.save(str(path), data)
+    mapped = map_image_file(path)
+    assert isinstance(mapped, numpy.memmap)
+    numpy.testing.assert_array_equal(mapped, data)
+
+@pytest.mark.parametrize('shape', [(30, 20), (30, 20, 3)])
+def test_raw(tmp_path, shape):
+    data = _array(shape, numpy.uint16)
+    header = b'header of 16 by'
+    path = tmp_path / 'image.raw'
+    path.write_bytes(header + b'\0' + numpy.ascontiguousarray(data.swapaxes(0, 1)).tobytes())
+    mapped = map_image_file(path, shape, numpy.uint16, offset=16)
+    numpy.testing.assert_array_equal(mapped, data)
+    # rows along x are contiguous in the file, and so in the texture
+    assert Image._texture_layout(mapped) is False
+    with pytest.raises(ValueError):
+        map_image_file(path)
+    with pytest.raises(ValueError):
+        map_image_file(path, (30,), numpy.uint16)
+
+@pytest.mark.parametrize('name, write', [
+    ('image.npy', lambda path, data: numpy.save(str(path), data)),
+    ('image.tif', _write_tiff),
+    ('image.raw', lambda path, data: path.write_bytes(numpy.ascontiguousarray(data.T).tobytes())),
+])
+def test_copy_on_write(tmp_path, name, write):
+    data = _array((30, 20), numpy.uint16)
+    path = tmp_path / name
+    write(path, data)
+    contents = path.read_bytes()
+    image = Image.from_file(path, shape=data.shape, dtype=data.dtype)
+    image.data[5:10, 5:10] = 9999
+    assert (image.data[5:10, 5:10] == 9999).all()
+    del image
+    assert path.read_bytes() == contents
+
+def test_unsupported_files(tmp_path):
+    data = _array((30, 20), numpy.uint16)
+    path = tmp_path / 'compressed.tif'
+    _write_tiff(path, data, compression=5)
+    with pytest.raises(ValueError):
+        map_image_file(path)
+    path = tmp_path / 'big_endian.tif'
+    path.write_bytes(b'MM\0*' + bytes(100))
+    with pytest.raises(ValueError):
+        map_image_file(path)
+    path = tmp_path / 'uint32.tif'
+    _write_tiff(path, data.astype(numpy.uint32))
+    with pytest.raises(ValueError):
+        map_image_file(path)
+    path = tmp_path / 'image.png'
+    path.write_bytes(bytes(100))
+    with pytest.raises(ValueError):
+        map_image_file(path)
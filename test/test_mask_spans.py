@@ -0,0 +1,99 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import numpy
+import pytest
+
+from ris_widget.histogram import histogram
+from ris_widget.histogram import mask_spans
+
+SHAPE = (90, 70)
+
+def _mask_from_spans(mask_geometry, shape, transpose):
+    """Return the (x, y) boolean mask that mask_spans.rasterize() describes."""
+    spans = mask_spans.rasterize(mask_geometry, shape, transpose)
+    n_cols, n_rows = (shape[1], shape[0]) if transpose else shape
+    mask = numpy.zeros((n_rows, n_cols), dtype=bool)
+    if spans is None:
+        mask[:] = True
+    else:
+        ymin, ymax, offsets, starts, ends = spans
+        for row in range(ymin, ymax):
+            for k in range(offsets[row - ymin], offsets[row - ymin + 1]):
+                mask[row, starts[k]:ends[k]] = True
+    return mask if transpose else mask.T
+
+def _pixel_centers(shape):
+    return numpy.meshgrid(numpy.arange(shape[0]) + 0.5, numpy.arange(shape[1]) + 0.5, indexing='ij')
+
+def _polygon_reference(points, shape):
+    """Even-odd point-in-polygon test of each pixel center."""
+    px, py = _pixel_centers(shape)
+    inside = numpy.zeros(shape, dtype=bool)
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        if y0 == y1:
+            continue
+        crosses = (y0 <= py) != (y1 <= py)
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x_cross <= px)
+    return inside
+
+def _random_polygon(rng, n_points):
+    # points scattered beyond the image's edges, so that the polygon is clipped and self-intersecting
+    return [(float(x), float(y)) for x, y in rng.uniform(-20, 110, (n_points, 2))]
+
+@pytest.mark.parametrize('transpose', [False, True])
+@pytest.mark.parametrize('seed', range(5))
+def test_polygon_matches_reference(transpose, seed):
+    points = _random_polygon(numpy.random.default_rng(seed), 3 + 2*seed)
+    mask = _mask_from_spans(('polygon', points), SHAPE, transpose)
+    numpy.testing.assert_array_equal(mask, _polygon_reference(points, SHAPE))
+
+@pytest.mark.parametrize('transpose', [False, True])
+def test_rect_and_ellipse_match_reference(transpose):
+    (x1, y1), (x2, y2) = corners = (10.3, 5.8), (60.6, 49.1)
+    px, py = _pixel_centers(SHAPE)
+    rect = (px >= x1) & (px < x2) & (py >= y1) & (py < y2)
+    numpy.testing.assert_array_equal(_mask_from_spans(('rect', corners), SHAPE, transpose), rect)
+    # corners given in any order describe the same rectangle
+    numpy.testing.assert_array_equal(_mask_from_spans(('rect', corners[::-1]), SHAPE, transpose), rect)
+    ellipse = ((px - (x1 + x2)/2) / ((x2 - x1)/2))**2 + ((py - (y1 + y2)/2) / ((y2 - y1)/2))**2 <= 1
+    numpy.testing.assert_array_equal(_mask_from_spans(('ellipse', corners), SHAPE, transpose), ellipse)
+
+@pytest.mark.parametrize('transpose', [False, True])
+def test_boolean_array(transpose):
+    mask = numpy.random.default_rng(0).random(SHAPE) < 0.3
+    numpy.testing.assert_array_equal(_mask_from_spans(mask, SHAPE, transpose), mask)
+
+def test_circle():
+    mask = _mask_from_spans((0.5, 0.5, 0.25), SHAPE, False)
+    assert mask[45, 35]
+    x, y = numpy.nonzero(mask)
+    assert (numpy.hypot(x - 45, y - 35) <= 0.25 * SHAPE[0] + 1).all()
+    r = int(0.25 * SHAPE[0])
+    window = mask[45-r:45+r+1, 35-r:35+r+1]
+    assert window.sum() == mask.sum()
+    numpy.testing.assert_array_equal(window, window[::-1])
+    numpy.testing.assert_array_equal(window, window[:, ::-1])
+    numpy.testing.assert_array_equal(window, window.T)
+
+def test_whole_and_empty_masks():
+    assert mask_spans.rasterize(('rect', ((-5, -5), (100, 100))), SHAPE, False) is None
+    for geometry in [('rect', ((100, 100), (120, 120))), ('rect', ((10, 10), (10, 30))), ('polygon', [(1, 1), (5, 5)])]:
+        ymin, ymax, offsets, starts, ends = mask_spans.rasterize(geometry, SHAPE, False)
+        assert len(starts) == len(ends) == 0
+
+def test_masked_histogram_matches_reference():
+    points = _random_polygon(numpy.random.default_rng(10), 7)
+    image = numpy.random.default_rng(0).integers(0, 256, SHAPE, dtype=numpy.uint8)
+    inside = _polygon_reference(points, SHAPE)
+    for data in (image, numpy.asfortranarray(image)):
+        mn, mx, hist = histogram(data, mask_geometry=('polygon', points), n_workers=3)
+        assert (mn, mx) == (image[inside].min(), image[inside].max())
+        numpy.testing.assert_array_equal(hist, numpy.bincount(image[inside], minlength=256))
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.uint16, numpy.float32])
+def test_empty_mask_histogram(dtype):
+    image = numpy.ones(SHAPE, dtype=dtype)
+    mn, mx, hist = histogram(image, mask_geometry=('rect', ((10, 10), (10, 30))))
+    assert numpy.isnan(mn) and numpy.isnan(mx)
+    assert not hist.any()